@@ -0,0 +1,29 @@
+"""
+Topic types for running the benchmarks without an RTI installation:
+
+    PYDDS_BACKEND=fake python benchmarks/decode.py bench_types bench.Nested bench.Wide
+    PYDDS_BACKEND=fake python benchmarks/ffi.py bench_types bench.Nested
+
+dds_fake imports this module when the `bench_types' library is loaded.
+"""
+
+import dds_fake as fake
+
+Mode = fake.enum('bench::Mode', ['IDLE', 'RUNNING', 'STOPPED', 'FAULT'])
+Point = fake.struct('bench::Point', [('x', fake.DOUBLE), ('y', fake.DOUBLE), ('z', fake.DOUBLE)])
+
+Nested = fake.struct('bench::Nested', [
+    ('id', fake.LONG, fake.KEY),
+    ('name', fake.string()),
+    ('mode', Mode),
+    ('position', Point),
+    ('path', fake.sequence(Point, 10000)),
+    ('samples', fake.sequence(fake.DOUBLE, 100000)),
+    ('modes', fake.sequence(Mode, 10000)),
+    ('payload', fake.sequence(fake.OCTET, 1 << 20)),
+])
+
+Wide = fake.struct('bench::Wide', [('id', fake.LONG, fake.KEY)] +
+                   [('value%d' % i, fake.DOUBLE) for i in range(100)])
+
+fake.register_library('bench_types', [Nested, Wide])
@@ -0,0 +1,101 @@
+"""
+Compares the recursive `unpack_dd' decoder with the compiled type plans that
+topics use to decode received samples.
+
+usage: python benchmarks/decode.py LIBRARY TYPE [TYPE ...] [--length N] [--iterations N]
+
+e.g.   python benchmarks/decode.py my_topics my.dds.nested_struct my.dds.enum_heavy
+
+Each type is filled with synthetic data (every sequence gets --length
+elements) before it is decoded repeatedly with both decoders.
+"""
+
+from __future__ import print_function
+
+import argparse
+import ctypes
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dds
+
+
+def fill(dd, plan, length):
+    if plan.kind == dds.TCKind.STRUCT:
+        for member in plan.members:
+            fill_member(dd, member, member.name, dds.DDS_DYNAMIC_DATA_MEMBER_ID_UNSPECIFIED, length)
+    else:
+        if plan.kind == dds.TCKind.SEQUENCE:
+            count = min(length, plan.bound) if plan.bound else length
+        else:
+            count = dd.get_member_count()
+        for i in range(count):
+            fill_member(dd, plan.element, None, i + 1, length)
+
+
+def fill_member(dd, member, name, member_id, length):
+    kind = member.kind
+    if kind in dds._dyn_basic_types:
+        func_name, data_type, bounds = dds._dyn_basic_types[kind]
+        value = {
+            dds.TCKind.CHAR: b'x',
+            dds.TCKind.WCHAR: u'x',
+            dds.TCKind.BOOLEAN: True,
+            dds.TCKind.FLOAT: 1.5,
+            dds.TCKind.DOUBLE: 1.5,
+        }.get(kind, 7)
+        getattr(dd, 'set_' + func_name)(name, member_id, value)
+    elif member.plan is not None:
+        inner = member.plan.acquire()
+        dd.bind_complex_member(inner, name, member_id)
+        try:
+            fill(inner, member.plan, length)
+        finally:
+            dd.unbind_complex_member(inner)
+            member.plan.release(inner)
+    elif kind == dds.TCKind.STRING:
+        dd.set_string(name, member_id, b'benchmark')
+    elif kind == dds.TCKind.WSTRING:
+        dd.set_wstring(name, member_id, u'benchmark')
+    elif kind == dds.TCKind.ENUM:
+        dd.set_ulong(name, member_id, len(member.labels) - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('library')
+    parser.add_argument('types', nargs='+')
+    parser.add_argument('--length', type=int, default=32, help='elements per sequence (default 32)')
+    parser.add_argument('--iterations', type=int, default=2000, help='decodes per measurement (default 2000)')
+    args = parser.parse_args()
+
+    library = dds.Library([dds.libname(args.library)])
+    for qualified_name in args.types:
+        data_type = getattr(library, qualified_name.replace('.', '_'))
+        tc = data_type._get_typecode()
+        support = dds.DDSFunc.DynamicDataTypeSupport_new(
+            tc, dds.get('DYNAMIC_DATA_TYPE_PROPERTY_DEFAULT', dds.DDSType.DynamicDataTypeProperty_t))
+        sample = support.create_data()
+        try:
+            plan = dds._type_plan(tc)
+            fill(sample, plan, args.length)
+            assert plan.decode(sample) == dds.unpack_dd(sample)
+
+            recursive = min(timeit.repeat(lambda: dds.unpack_dd(sample), number=args.iterations, repeat=3))
+            compiled = min(timeit.repeat(lambda: plan.decode(sample), number=args.iterations, repeat=3))
+            print('%-40s unpack_dd %9.1f us   plan %9.1f us   speedup %5.1fx' % (
+                qualified_name,
+                recursive / args.iterations * 1e6,
+                compiled / args.iterations * 1e6,
+                recursive / compiled,
+            ))
+        finally:
+            support.delete_data(sample)
+            support.delete()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Measures the Python-side overhead of calling into the DDS library on the hot
+paths: read/take, the DynamicData getters and setters and bind_complex_member.
+
+usage: python benchmarks/ffi.py LIBRARY TYPE [--iterations N]
+
+e.g.   python benchmarks/ffi.py my_topics my.dds.my_custom_topic
+
+Every function is called three ways:
+
+  direct   through a module level reference to the function (the hot paths)
+  method   as a method of a DDSType pointer, e.g. `dd.get_long(...)'
+  before   through a closure created for each new pointer object, the way
+           DDSType pointers used to bind their methods, with the library
+           constants looked up on every call
+
+The type should have at least one numeric member and one struct, sequence or
+array member.
+"""
+
+from __future__ import print_function
+
+import argparse
+import ctypes
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dds
+
+
+def closure(f, ptr):
+    def m(*args):
+        return f(ptr, *args)
+    return m
+
+
+def report(name, iterations, **timings):
+    print('%-32s' % name + ''.join('%8s %7.2f us' % (label, timings[label] / iterations * 1e6)
+                                   for label in ('direct', 'method', 'before') if label in timings))
+
+
+def measure(statement, iterations):
+    return min(timeit.repeat(statement, number=iterations, repeat=3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('library')
+    parser.add_argument('type')
+    parser.add_argument('--iterations', type=int, default=20000, help='calls per measurement (default 20000)')
+    args = parser.parse_args()
+    n = args.iterations
+
+    instance = dds.DDS(args.library)
+    topic = instance.get_topic(args.type)
+    plan = topic._plan
+
+    basic = [m for m in plan.members if m.kind in dds._dyn_basic_types]
+    complex_ = [m for m in plan.members if m.plan is not None]
+    if not basic or not complex_:
+        parser.error('%s needs a numeric member and a struct, sequence or array member' % args.type)
+
+    # read (rather than take) keeps the published sample in the reader
+    reader = topic._get_reader()
+    topic.publish({})
+    data_seq = dds.DDSType.DynamicDataSeq()
+    info_seq = dds.DDSType.SampleInfoSeq()
+    data_seq.initialize()
+    info_seq.initialize()
+
+    def read_direct():
+        dds._DynamicDataReader_read(reader, ctypes.byref(data_seq), ctypes.byref(info_seq), dds.DDS_LENGTH_UNLIMITED,
+                                    dds._ANY_SAMPLE_STATE, dds._ANY_VIEW_STATE, dds._ANY_INSTANCE_STATE)
+        dds._DynamicDataReader_return_loan(reader, ctypes.byref(data_seq), ctypes.byref(info_seq))
+
+    def read_method():
+        reader.read(ctypes.byref(data_seq), ctypes.byref(info_seq), dds.DDS_LENGTH_UNLIMITED,
+                    dds._ANY_SAMPLE_STATE, dds._ANY_VIEW_STATE, dds._ANY_INSTANCE_STATE)
+        reader.return_loan(ctypes.byref(data_seq), ctypes.byref(info_seq))
+
+    def read_before():
+        closure(dds.DDSFunc.DynamicDataReader_read, reader)(
+            ctypes.byref(data_seq), ctypes.byref(info_seq), dds.DDS_LENGTH_UNLIMITED,
+            dds.get('ANY_SAMPLE_STATE', dds.DDS_SampleStateMask),
+            dds.get('ANY_VIEW_STATE', dds.DDS_ViewStateMask),
+            dds.get('ANY_INSTANCE_STATE', dds.DDS_InstanceStateMask))
+        closure(dds.DDSFunc.DynamicDataReader_return_loan, reader)(ctypes.byref(data_seq), ctypes.byref(info_seq))
+
+    report('read + return_loan', n, direct=measure(read_direct, n), method=measure(read_method, n),
+           before=measure(read_before, n))
+
+    sample = topic._pool.acquire()
+    member = basic[0]
+    func_name, data_type, bounds = dds._dyn_basic_types[member.kind]
+    getter = getattr(dds.DDSFunc, 'DynamicData_get_' + func_name)
+    setter = getattr(dds.DDSFunc, 'DynamicData_set_' + func_name)
+    value = data_type()
+    unspecified = dds.DDS_DYNAMIC_DATA_MEMBER_ID_UNSPECIFIED
+    method_get = getattr(sample, 'get_' + func_name)
+    method_set = getattr(sample, 'set_' + func_name)
+
+    report('get_%s' % func_name, n,
+           direct=measure(lambda: getter(sample, ctypes.byref(value), member.name, unspecified), n),
+           method=measure(lambda: method_get(ctypes.byref(value), member.name, unspecified), n),
+           before=measure(lambda: closure(getter, sample)(ctypes.byref(value), member.name, unspecified), n))
+    report('set_%s' % func_name, n,
+           direct=measure(lambda: setter(sample, member.name, unspecified, 1), n),
+           method=measure(lambda: method_set(member.name, unspecified, 1), n),
+           before=measure(lambda: closure(setter, sample)(member.name, unspecified, 1), n))
+
+    member = complex_[0]
+    inner = member.plan.acquire()
+    bind = dds.DDSFunc.DynamicData_bind_complex_member
+    unbind = dds.DDSFunc.DynamicData_unbind_complex_member
+
+    def bind_direct():
+        bind(sample, inner, member.name, unspecified)
+        unbind(sample, inner)
+
+    def bind_method():
+        sample.bind_complex_member(inner, member.name, unspecified)
+        sample.unbind_complex_member(inner)
+
+    def bind_before():
+        closure(bind, sample)(inner, member.name, unspecified)
+        closure(unbind, sample)(inner)
+
+    report('bind + unbind_complex_member', n, direct=measure(bind_direct, n), method=measure(bind_method, n),
+           before=measure(bind_before, n))
+
+    report('constant lookup', n, direct=measure(lambda: dds._ANY_SAMPLE_STATE, n),
+           before=measure(lambda: dds.get('ANY_SAMPLE_STATE', dds.DDS_SampleStateMask), n))
+
+    member.plan.release(inner)
+    topic._pool.release(sample)
+    data_seq.finalize()
+    info_seq.finalize()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Compares the throughput of a topic with the default writer QoS and with
+asynchronous publishing and batching.
+
+usage: python benchmarks/throughput.py LIBRARY TYPE [--samples N] [--batch N] [--flush-delay S]
+
+e.g.   python benchmarks/throughput.py my_topics my.dds.my_custom_topic
+
+Every run publishes the same sample N times from one `DDS' instance to a
+subscriber in another and reports the publish rate and the rate at which the
+samples arrived. Samples lost along the way (e.g. by best effort readers) are
+reported as well.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dds
+
+
+def run(args, qos):
+    publisher = dds.DDS(args.library)
+    subscriber = dds.DDS(args.library)
+    received = [0]
+    done = threading.Event()
+
+    def on_batch(samples):
+        received[0] += len(samples)
+        if received[0] >= args.samples:
+            done.set()
+
+    reader_topic = subscriber.get_topic(args.type)
+    writer_topic = publisher.get_topic(args.type)
+    if qos is not None:
+        reader_topic.set_qos(qos=qos)
+        writer_topic.set_qos(qos=qos)
+    reader_topic.subscribe(on_batch, dispatch='inline', batch=True)
+
+    sample = {}
+    start = time.time()
+    writer_topic.publish_many([sample] * args.samples)
+    published = time.time() - start
+    done.wait(args.timeout)
+    elapsed = time.time() - start
+
+    reader_topic.unsubscribe()
+    return published, elapsed, received[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('library')
+    parser.add_argument('type')
+    parser.add_argument('--samples', type=int, default=100000, help='samples per run (default 100000)')
+    parser.add_argument('--batch', type=int, default=64, help='samples per batch (default 64)')
+    parser.add_argument('--flush-delay', type=float, default=0.001,
+                        help='seconds before an incomplete batch is sent (default 0.001)')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for the samples (default 30)')
+    args = parser.parse_args()
+
+    runs = [
+        ('default', None),
+        ('batched', dds.Qos(reliability='reliable', keep_all=True, publish_mode='asynchronous',
+                            batch_max_samples=args.batch, batch_flush_delay=args.flush_delay)),
+    ]
+    print('%-10s %14s %14s %10s' % ('qos', 'published/s', 'received/s', 'lost'))
+    for name, qos in runs:
+        published, elapsed, received = run(args, qos)
+        print('%-10s %14.0f %14.0f %10d' % (name, args.samples / published, received / elapsed,
+                                            args.samples - received))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,25 @@
 from __future__ import print_function
 
+import array
+import asyncio
 import ctypes
+import math
+import os
 import weakref
 import collections
+import collections.abc
 import uuid
 import platform
+import sys
 import threading
+import time
+import traceback
+import types
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def libname(name):
     if platform.uname()[0] == 'Windows':
@@ -15,8 +29,19 @@ def libname(name):
     else:
         return 'lib' + name + '.so'
 
-_ddscore_lib = ctypes.CDLL(libname('nddscore'), ctypes.RTLD_GLOBAL)
-_ddsc_lib = ctypes.CDLL(libname('nddsc'))
+# PYDDS_BACKEND=fake replaces the RTI libraries with the in-process bus in
+# dds_fake, so the module can run without an RTI installation.
+_backend = os.environ.get('PYDDS_BACKEND', 'rti')
+if _backend == 'fake':
+    import dds_fake
+    _load_library = dds_fake.load_library
+elif _backend == 'rti':
+    _load_library = ctypes.CDLL
+else:
+    raise ImportError("PYDDS_BACKEND must be 'rti' or 'fake', not %r" % _backend)
+
+_ddscore_lib = _load_library(libname('nddscore'), ctypes.RTLD_GLOBAL)
+_ddsc_lib = _load_library(libname('nddsc'))
 
 # some types
 enum = ctypes.c_int
@@ -98,10 +123,15 @@ class Error(Exception):
 class NoDataError(Exception):
     pass
 
+class WaitTimeoutError(Error):
+    pass
+
 
 def check_code(result, func, arguments):
     if result == 11:
         raise NoDataError()
+    if result == 10:
+        raise WaitTimeoutError('timeout')
     if result != 0:
         # raise Error(str(result))
         raise Error({
@@ -152,16 +182,23 @@ def get(name, data_type):
 class DDSFunc(object):
     pass
 
+def _method(f):
+    def m(self, *args):
+        return f(self, *args)
+    return m
+
 class DDSType_(type):
     def __getattr__(self, attr):
         contents = type(attr, (ctypes.Structure,), {})
 
         def g(self2, attr2):
+            # installed on the struct (or pointer) class the first time it is
+            # used, so later calls are plain method calls on every instance
             f = getattr(DDSFunc, attr + '_' + attr2)
-            def m(*args):
-                return f(self2, *args)
-            setattr(self2, attr2, m)
-            return m
+            m = _method(f)
+            m.__name__ = attr2
+            setattr(type(self2), attr2, m)
+            return getattr(self2, attr2)
         # make structs dynamically present bound methods
         contents.__getattr__ = g
         # take advantage of POINTERs being cached to make type pointers do the same
@@ -316,6 +353,39 @@ DDSType.LivelinessChangedStatus._fields_ = [
     ('last_publication_handle', DDSType.InstanceHandle_t),
 ]
 
+DDSType.SampleLostStatus._fields_ = [
+    ('total_count', DDS_Long),
+    ('total_count_change', DDS_Long),
+    ('last_reason', ctypes.c_int),
+]
+
+DDSType.SampleRejectedStatus._fields_ = [
+    ('total_count', DDS_Long),
+    ('total_count_change', DDS_Long),
+    ('last_reason', ctypes.c_int),
+    ('last_instance_handle', DDSType.InstanceHandle_t),
+]
+
+DDSType.RequestedDeadlineMissedStatus._fields_ = [
+    ('total_count', DDS_Long),
+    ('total_count_change', DDS_Long),
+    ('last_instance_handle', DDSType.InstanceHandle_t),
+]
+
+# last_reason values of the sample lost and sample rejected statuses
+_sample_lost_reasons = {
+    0: 'NOT_LOST',
+    1: 'LOST_BY_WRITER',
+    2: 'LOST_BY_INSTANCES_LIMIT',
+}
+
+_sample_rejected_reasons = {
+    0: 'NOT_REJECTED',
+    1: 'REJECTED_BY_INSTANCES_LIMIT',
+    2: 'REJECTED_BY_SAMPLES_LIMIT',
+    3: 'REJECTED_BY_SAMPLES_PER_INSTANCE_LIMIT',
+}
+
 class TCKind(object):
     NULL             =  0
     SHORT            =  1
@@ -377,6 +447,9 @@ list(map(_define_func, [
     ('DomainParticipantFactory_set_default_participant_qos_with_profile',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.DomainParticipantFactory), ctypes.c_char_p, ctypes.c_char_p]),
+    ('DomainParticipantFactory_reload_profiles',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.DomainParticipantFactory)]),
     ('DomainParticipantFactory_create_participant',
         check_null, ctypes.POINTER(DDSType.DomainParticipant),
         [ctypes.POINTER(DDSType.DomainParticipantFactory), DDS_DomainId_t, ctypes.POINTER(DDSType.DomainParticipantQos), ctypes.POINTER(DDSType.DomainParticipantListener), DDS_StatusMask]),
@@ -426,6 +499,9 @@ list(map(_define_func, [
     ('DomainParticipant_delete_contentfilteredtopic',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.DomainParticipant), ctypes.POINTER(DDSType.ContentFilteredTopic)]),
+    ('ContentFilteredTopic_set_expression_parameters',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.ContentFilteredTopic), ctypes.POINTER(DDSType.StringSeq)]),
     ('DomainParticipant_get_builtin_subscriber',
         None, ctypes.POINTER(DDSType.Subscriber),
         [ctypes.POINTER(DDSType.DomainParticipant)]),
@@ -491,6 +567,9 @@ list(map(_define_func, [
     ('Publisher_create_datawriter',
         check_null, ctypes.POINTER(DDSType.DataWriter),
         [ctypes.POINTER(DDSType.Publisher), ctypes.POINTER(DDSType.Topic), ctypes.POINTER(DDSType.DataWriterQos), ctypes.POINTER(DDSType.DataWriterListener), DDS_StatusMask]),
+    ('Publisher_create_datawriter_with_profile',
+        check_null, ctypes.POINTER(DDSType.DataWriter),
+        [ctypes.POINTER(DDSType.Publisher), ctypes.POINTER(DDSType.Topic), ctypes.c_char_p, ctypes.c_char_p, ctypes.POINTER(DDSType.DataWriterListener), DDS_StatusMask]),
     ('Publisher_delete_datawriter',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.Publisher), ctypes.POINTER(DDSType.DataWriter)]),
@@ -498,6 +577,9 @@ list(map(_define_func, [
     ('Subscriber_create_datareader',
         check_null, ctypes.POINTER(DDSType.DataReader),
         [ctypes.POINTER(DDSType.Subscriber), ctypes.POINTER(DDSType.TopicDescription), ctypes.POINTER(DDSType.DataReaderQos), ctypes.POINTER(DDSType.DataReaderListener), DDS_StatusMask]),
+    ('Subscriber_create_datareader_with_profile',
+        check_null, ctypes.POINTER(DDSType.DataReader),
+        [ctypes.POINTER(DDSType.Subscriber), ctypes.POINTER(DDSType.TopicDescription), ctypes.c_char_p, ctypes.c_char_p, ctypes.POINTER(DDSType.DataReaderListener), DDS_StatusMask]),
     ('Subscriber_delete_datareader',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.Subscriber), ctypes.POINTER(DDSType.DataReader)]),
@@ -508,6 +590,21 @@ list(map(_define_func, [
     ('DataReader_set_listener',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.DataReader), ctypes.POINTER(DDSType.DataReaderListener), DDS_StatusMask]),
+    ('DataReader_get_sample_lost_status',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.DataReader), ctypes.POINTER(DDSType.SampleLostStatus)]),
+    ('DataReader_get_sample_rejected_status',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.DataReader), ctypes.POINTER(DDSType.SampleRejectedStatus)]),
+    ('DataReader_get_requested_deadline_missed_status',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.DataReader), ctypes.POINTER(DDSType.RequestedDeadlineMissedStatus)]),
+    ('DataReader_create_readcondition',
+        check_null, ctypes.POINTER(DDSType.ReadCondition),
+        [ctypes.POINTER(DDSType.DataReader), DDS_SampleStateMask, DDS_ViewStateMask, DDS_InstanceStateMask]),
+    ('DataReader_delete_readcondition',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.DataReader), ctypes.POINTER(DDSType.ReadCondition)]),
 
     ('DynamicDataTypeSupport_new',
         check_null, ctypes.POINTER(DDSType.DynamicDataTypeSupport),
@@ -540,6 +637,12 @@ list(map(_define_func, [
 ] + [
     ('DynamicData_set_' + func_name, check_code, DDS_ReturnCode_t, [ctypes.POINTER(DDSType.DynamicData), ctypes.c_char_p, DDS_DynamicDataMemberId, data_type])
         for func_name, data_type, bounds  in _dyn_basic_types.values()
+] + [
+    ('DynamicData_get_%s_array' % func_name, check_code, DDS_ReturnCode_t, [ctypes.POINTER(DDSType.DynamicData), ctypes.POINTER(data_type), ctypes.POINTER(DDS_UnsignedLong), ctypes.c_char_p, DDS_DynamicDataMemberId])
+        for func_name, data_type, bounds in _dyn_basic_types.values()
+] + [
+    ('DynamicData_set_%s_array' % func_name, check_code, DDS_ReturnCode_t, [ctypes.POINTER(DDSType.DynamicData), ctypes.c_char_p, DDS_DynamicDataMemberId, DDS_UnsignedLong, ctypes.POINTER(data_type)])
+        for func_name, data_type, bounds in _dyn_basic_types.values()
 ] + [
     ('DynamicData_get_string',
         check_code, DDS_ReturnCode_t,
@@ -577,6 +680,9 @@ list(map(_define_func, [
     ('DynamicData_delete',
         None, None,
         [ctypes.POINTER(DDSType.DynamicData)]),
+    ('DynamicData_copy',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.DynamicData), ctypes.POINTER(DDSType.DynamicData)]),
 
     ('DynamicDataWriter_narrow',
         check_null, ctypes.POINTER(DDSType.DynamicDataWriter),
@@ -587,6 +693,12 @@ list(map(_define_func, [
     ('DynamicDataWriter_dispose',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.DynamicDataWriter), ctypes.POINTER(DDSType.DynamicData), ctypes.POINTER(DDSType.InstanceHandle_t)]),
+    ('DynamicDataWriter_register_instance',
+        None, DDSType.InstanceHandle_t,
+        [ctypes.POINTER(DDSType.DynamicDataWriter), ctypes.POINTER(DDSType.DynamicData)]),
+    ('DynamicDataWriter_unregister_instance',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.DynamicDataWriter), ctypes.POINTER(DDSType.DynamicData), ctypes.POINTER(DDSType.InstanceHandle_t)]),
 
 
     ('DynamicDataReader_get_key_value',
@@ -598,6 +710,9 @@ list(map(_define_func, [
     ('DynamicDataReader_take',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.DynamicDataReader), ctypes.POINTER(DDSType.DynamicDataSeq), ctypes.POINTER(DDSType.SampleInfoSeq), DDS_Long, DDS_SampleStateMask, DDS_ViewStateMask, DDS_InstanceStateMask]),
+    ('DynamicDataReader_read',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.DynamicDataReader), ctypes.POINTER(DDSType.DynamicDataSeq), ctypes.POINTER(DDSType.SampleInfoSeq), DDS_Long, DDS_SampleStateMask, DDS_ViewStateMask, DDS_InstanceStateMask]),
     ('DynamicDataReader_take_next_sample',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.DynamicDataReader), ctypes.POINTER(DDSType.DynamicData), ctypes.POINTER(DDSType.SampleInfo)]),
@@ -619,6 +734,12 @@ list(map(_define_func, [
         check_ex, DDS_UnsignedLong, [ctypes.POINTER(DDSType.TypeCode), ctypes.c_char_p, ctypes.POINTER(DDS_ExceptionCode_t)]),
     ('TypeCode_is_member_key',
         check_ex, DDS_Boolean, [ctypes.POINTER(DDSType.TypeCode), DDS_UnsignedLong, ctypes.POINTER(DDS_ExceptionCode_t)]),
+    ('TypeCode_length',
+        check_ex, DDS_UnsignedLong, [ctypes.POINTER(DDSType.TypeCode), ctypes.POINTER(DDS_ExceptionCode_t)]),
+    ('TypeCode_content_type',
+        check_ex, ctypes.POINTER(DDSType.TypeCode), [ctypes.POINTER(DDSType.TypeCode), ctypes.POINTER(DDS_ExceptionCode_t)]),
+    ('TypeCode_element_count',
+        check_ex, DDS_UnsignedLong, [ctypes.POINTER(DDSType.TypeCode), ctypes.POINTER(DDS_ExceptionCode_t)]),
 
     ('DynamicDataSeq_initialize',
         check_true, DDS_Boolean, [ctypes.POINTER(DDSType.DynamicDataSeq)]),
@@ -654,9 +775,15 @@ list(map(_define_func, [
 
 
     ('WaitSet_new', None, ctypes.POINTER(DDSType.WaitSet), []),
+    ('WaitSet_delete',
+        None, None,
+        [ctypes.POINTER(DDSType.WaitSet)]),
     ('WaitSet_attach_condition',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.WaitSet), ctypes.POINTER(DDSType.Condition)]),
+    ('WaitSet_detach_condition',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.WaitSet), ctypes.POINTER(DDSType.Condition)]),
     ('WaitSet_wait',
         check_code, DDS_ReturnCode_t,
         [ctypes.POINTER(DDSType.WaitSet), ctypes.POINTER(DDSType.ConditionSeq), ctypes.POINTER(DDSType.Duration_t)]),
@@ -672,8 +799,41 @@ list(map(_define_func, [
         check_true, DDS_Boolean, [ctypes.POINTER(DDSType.ConditionSeq)]),
     ('ConditionSeq_finalize',
         check_true, DDS_Boolean, [ctypes.POINTER(DDSType.ConditionSeq)]),
+    ('ConditionSeq_get_length',
+        None, DDS_Long, [ctypes.POINTER(DDSType.ConditionSeq)]),
+    ('ConditionSeq_get',
+        None, ctypes.POINTER(DDSType.Condition), [ctypes.POINTER(DDSType.ConditionSeq), DDS_Long]),
+
+    ('GuardCondition_new', None, ctypes.POINTER(DDSType.GuardCondition), []),
+    ('GuardCondition_delete',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.GuardCondition)]),
+    ('GuardCondition_set_trigger_value',
+        check_code, DDS_ReturnCode_t,
+        [ctypes.POINTER(DDSType.GuardCondition), DDS_Boolean]),
 ]))
 
+# Hot paths call these directly rather than through the methods of DDSType
+# pointers, and use these constants instead of looking them up on every call.
+
+_ANY_SAMPLE_STATE              = get('ANY_SAMPLE_STATE', DDS_SampleStateMask)
+_ANY_VIEW_STATE                = get('ANY_VIEW_STATE', DDS_ViewStateMask)
+_ANY_INSTANCE_STATE            = get('ANY_INSTANCE_STATE', DDS_InstanceStateMask)
+_DYNAMIC_DATA_PROPERTY_DEFAULT = get('DYNAMIC_DATA_PROPERTY_DEFAULT', DDSType.DynamicDataProperty_t)
+
+_DynamicDataReader_take          = DDSFunc.DynamicDataReader_take
+_DynamicDataReader_read          = DDSFunc.DynamicDataReader_read
+_DynamicDataReader_return_loan   = DDSFunc.DynamicDataReader_return_loan
+_DynamicDataReader_get_key_value = DDSFunc.DynamicDataReader_get_key_value
+_DynamicDataWriter_write         = DDSFunc.DynamicDataWriter_write
+_DynamicDataWriter_dispose       = DDSFunc.DynamicDataWriter_dispose
+_DynamicDataWriter_register_instance   = DDSFunc.DynamicDataWriter_register_instance
+_DynamicDataWriter_unregister_instance = DDSFunc.DynamicDataWriter_unregister_instance
+_DynamicDataSeq_get_length       = DDSFunc.DynamicDataSeq_get_length
+_DynamicDataSeq_get_reference    = DDSFunc.DynamicDataSeq_get_reference
+_SampleInfoSeq_get_reference     = DDSFunc.SampleInfoSeq_get_reference
+_DynamicData_copy                = DDSFunc.DynamicData_copy
+
 def write_into_dd_member(obj, dd, member_name=None, member_id=DDS_DYNAMIC_DATA_MEMBER_ID_UNSPECIFIED):
     tc = ctypes.POINTER(DDSType.TypeCode)()
     dd.get_member_type(ctypes.byref(tc), member_name, member_id, ex())
@@ -685,7 +845,7 @@ def write_into_dd_member(obj, dd, member_name=None, member_id=DDS_DYNAMIC_DATA_M
             raise ValueError('%r not in range [%r, %r)' % (obj, bounds[0], bounds[1]))
         getattr(dd, 'set_' + func_name)(member_name, member_id, obj)
     elif kind == TCKind.STRUCT or kind == TCKind.SEQUENCE or kind == TCKind.ARRAY:
-        inner = DDSFunc.DynamicData_new(None, get('DYNAMIC_DATA_PROPERTY_DEFAULT', DDSType.DynamicDataProperty_t))
+        inner = DDSFunc.DynamicData_new(None, _DYNAMIC_DATA_PROPERTY_DEFAULT)
         try:
             dd.bind_complex_member(inner, member_name, member_id)
             try:
@@ -733,7 +893,7 @@ def unpack_dd_member(dd, member_name=None, member_id=DDS_DYNAMIC_DATA_MEMBER_ID_
         getattr(dd, 'get_' + func_name)(ctypes.byref(inner), member_name, member_id)
         return inner.value
     elif kind == TCKind.STRUCT or kind == TCKind.SEQUENCE or kind == TCKind.ARRAY:
-        inner = DDSFunc.DynamicData_new(None, get('DYNAMIC_DATA_PROPERTY_DEFAULT', DDSType.DynamicDataProperty_t))
+        inner = DDSFunc.DynamicData_new(None, _DYNAMIC_DATA_PROPERTY_DEFAULT)
         try:
             dd.bind_complex_member(inner, member_name, member_id)
             try:
@@ -780,9 +940,1531 @@ def unpack_dd(dd):
     else:
         raise NotImplementedError(kind)
 
+# Compiled type plans
+#
+# unpack_dd and write_into_dd ask the DynamicData for the type, kind and name of
+# every member of every sample they touch. A plan walks the TypeCode once instead,
+# and keeps what is needed to read or write a sample of that type: the member
+# names, the bound getters and setters, range bounds, the plans of nested types
+# and the enum label tables. Plans are cached per TypeCode and array format.
+#
+# Sequences and arrays of numbers are read and written in one call with the
+# DynamicData_get/set_<type>_array functions, and decoded as a list, an
+# array.array or a numpy array depending on the array format. Octets may be
+# decoded as bytes or as a memoryview of the buffer they were copied into instead.
+# Record plans decode structs into a namedtuple class generated for each type
+# instead of a dict.
+#
+# Plans are built under _plans_lock. Plans still being built (including the
+# ones a recursive type refers to) are kept in _building, which only the
+# building thread looks at, and are published to _plans together once the
+# outermost plan is complete.
+
+_plans = {}
+_plans_lock = threading.RLock()
+_building = {}
+
+_DynamicData_new                   = DDSFunc.DynamicData_new
+_DynamicData_bind_complex_member   = DDSFunc.DynamicData_bind_complex_member
+_DynamicData_unbind_complex_member = DDSFunc.DynamicData_unbind_complex_member
+_DynamicData_get_member_count      = DDSFunc.DynamicData_get_member_count
+_DynamicData_get_string            = DDSFunc.DynamicData_get_string
+_DynamicData_get_wstring           = DDSFunc.DynamicData_get_wstring
+_DynamicData_get_ulong             = DDSFunc.DynamicData_get_ulong
+_DynamicData_set_string            = DDSFunc.DynamicData_set_string
+_DynamicData_set_wstring           = DDSFunc.DynamicData_set_wstring
+_DynamicData_set_ulong             = DDSFunc.DynamicData_set_ulong
+_String_free                       = DDSFunc.String_free
+_Wstring_free                      = DDSFunc.Wstring_free
+
+def _resolve_alias(tc):
+    while tc.kind(ex()) == TCKind.ALIAS:
+        tc = tc.content_type(ex())
+    return tc
+
+_array_formats = ('list', 'array', 'numpy')
+_octet_formats = (None, 'bytes', 'memoryview')
+
+# buffer formats that are interchangeable when the item sizes match
+_buffer_formats = ('bhilqn', 'BHILQN', 'fd', '?')
+_byte_order = '@=' + ('<' if sys.byteorder == 'little' else '>')
+
+def _check_array_format(array_format, octet_format=None):
+    if array_format not in _array_formats:
+        raise ValueError('array_format must be one of %s' % ', '.join(_array_formats))
+    if octet_format not in _octet_formats:
+        raise ValueError("octet_format must be None, 'bytes' or 'memoryview'")
+    if array_format == 'numpy' and numpy is None:
+        raise ImportError("array_format='numpy' requires numpy")
+
+def _type_plan(tc, array_format='list', octet_format=None, record=False):
+    tc = _resolve_alias(tc)
+    key = (ctypes.cast(tc, ctypes.c_void_p).value, array_format, octet_format, record)
+    plan = _plans.get(key)
+    if plan is None:
+        with _plans_lock:
+            plan = _plans.get(key)
+            if plan is None:
+                plan = _building.get(key)
+            if plan is None:
+                outermost = not _building
+                try:
+                    plan = _TypePlan(tc, key, array_format, octet_format, record)
+                except:
+                    if outermost:
+                        _building.clear()
+                    raise
+                if outermost:
+                    _plans.update(_building)
+                    _building.clear()
+    return plan
+
+def _array_length_error(member_name, size, count):
+    name = "'%s'" % bytes.decode(member_name) if member_name is not None else 'the element'
+    raise ValueError('%s is an array of %d elements, got %d values' % (name, size, count))
+
+class _MemberPlan(object):
+    def __init__(self, tc, name=None, array_format='list', octet_format=None, record=False):
+        tc = _resolve_alias(tc)
+        self.name  = name
+        self.field = bytes.decode(name) if name is not None else None
+        self.kind  = kind = tc.kind(ex())
+        self.plan  = None
+        self.labels = None
+
+        if kind in _dyn_basic_types:
+            func_name, data_type, bounds = _dyn_basic_types[kind]
+            self.read  = self._basic_reader(getattr(DDSFunc, 'DynamicData_get_' + func_name), data_type)
+            self.write = self._basic_writer(getattr(DDSFunc, 'DynamicData_set_' + func_name), bounds)
+        elif kind == TCKind.STRUCT or kind == TCKind.SEQUENCE or kind == TCKind.ARRAY:
+            self.plan  = plan = _type_plan(tc, array_format, octet_format, record)
+            element = plan.element
+            if element is not None and element.kind in _dyn_basic_types and element.kind not in (TCKind.CHAR, TCKind.WCHAR):
+                func_name, data_type, bounds = _dyn_basic_types[element.kind]
+                if element.kind == TCKind.OCTET and octet_format is not None:
+                    output = self._octet_output(octet_format)
+                else:
+                    output = self._bulk_output(array_format, data_type)
+                self.read  = self._bulk_reader(plan, getattr(DDSFunc, 'DynamicData_get_%s_array' % func_name), data_type, output)
+                self.write = self.merge = self._bulk_writer(getattr(DDSFunc, 'DynamicData_set_%s_array' % func_name), data_type,
+                                                            bounds, plan.size)
+            else:
+                self.read  = self._complex_reader(plan)
+                self.write = self._complex_writer(plan, 'encode')
+                self.merge = self._complex_writer(plan, 'merge')
+        elif kind == TCKind.STRING:
+            self.read  = self._string_reader
+            self.write = self._string_writer
+        elif kind == TCKind.WSTRING:
+            self.read  = self._wstring_reader
+            self.write = self._wstring_writer
+        elif kind == TCKind.ENUM:
+            self.labels = [tc.member_name(i, ex()) for i in range(tc.member_count(ex()))]
+            self.read  = self._enum_reader(self.labels)
+            self.write = self._enum_writer(tc.name(ex()), self.labels)
+        else:
+            self.read  = self._unsupported_reader
+            self.write = self._unsupported_writer
+
+        if not hasattr(self, 'merge'):
+            self.merge = self.write
+
+    @staticmethod
+    def _basic_reader(getter, data_type):
+        byref = ctypes.byref
+        def read(dd, member_name, member_id):
+            inner = data_type()
+            getter(dd, byref(inner), member_name, member_id)
+            return inner.value
+        return read
+
+    @staticmethod
+    def _complex_reader(plan):
+        def read(dd, member_name, member_id):
+            inner = plan.acquire()
+            try:
+                _DynamicData_bind_complex_member(dd, inner, member_name, member_id)
+                try:
+                    return plan.decode(inner)
+                finally:
+                    _DynamicData_unbind_complex_member(dd, inner)
+            finally:
+                plan.release(inner)
+        return read
+
+    @staticmethod
+    def _bulk_reader(plan, getter, data_type, output):
+        byref = ctypes.byref
+        size  = plan.size
+        def read(dd, member_name, member_id):
+            count = size
+            if count is None:
+                inner = plan.acquire()
+                try:
+                    _DynamicData_bind_complex_member(dd, inner, member_name, member_id)
+                    try:
+                        count = _DynamicData_get_member_count(inner)
+                    finally:
+                        _DynamicData_unbind_complex_member(dd, inner)
+                finally:
+                    plan.release(inner)
+            values = (data_type * count)()
+            length = DDS_UnsignedLong(count)
+            getter(dd, values, byref(length), member_name, member_id)
+            return output(values, length.value)
+        return read
+
+    @staticmethod
+    def _bulk_output(array_format, data_type):
+        if array_format == 'numpy':
+            def output(values, count):
+                return numpy.frombuffer(values, dtype=data_type, count=count)
+        elif array_format == 'array' and data_type._type_ != '?':
+            # array.array has no boolean typecode, so booleans stay a list
+            typecode = data_type._type_
+            itemsize = ctypes.sizeof(data_type)
+            def output(values, count):
+                result = array.array(typecode)
+                result.frombytes(memoryview(values).cast('B')[:count * itemsize])
+                return result
+        else:
+            def output(values, count):
+                return values[:count]
+        return output
+
+    @staticmethod
+    def _octet_output(octet_format):
+        if octet_format == 'memoryview':
+            def output(values, count):
+                return memoryview(values).cast('B')[:count]
+        else:
+            def output(values, count):
+                return memoryview(values).cast('B')[:count].tobytes()
+        return output
+
+    @staticmethod
+    def _enum_reader(labels):
+        byref = ctypes.byref
+        def read(dd, member_name, member_id):
+            val = DDS_UnsignedLong()
+            _DynamicData_get_ulong(dd, byref(val), member_name, member_id)
+            return labels[val.value]
+        return read
+
+    @staticmethod
+    def _string_reader(dd, member_name, member_id):
+        inner = ctypes.c_char_p(None)
+        try:
+            _DynamicData_get_string(dd, ctypes.byref(inner), None, member_name, member_id)
+            return inner.value
+        finally:
+            _String_free(inner)
+
+    @staticmethod
+    def _wstring_reader(dd, member_name, member_id):
+        inner = ctypes.c_wchar_p(None)
+        try:
+            _DynamicData_get_wstring(dd, ctypes.byref(inner), None, member_name, member_id)
+            return inner.value
+        finally:
+            _Wstring_free(inner)
+
+    def _unsupported_reader(self, dd, member_name, member_id):
+        raise NotImplementedError(self.kind)
+
+    @staticmethod
+    def _basic_writer(setter, bounds):
+        if bounds is None:
+            def write(obj, dd, member_name, member_id):
+                setter(dd, member_name, member_id, obj)
+        else:
+            low, high = bounds
+            def write(obj, dd, member_name, member_id):
+                if not low <= obj < high:
+                    raise ValueError('%r not in range [%r, %r)' % (obj, low, high))
+                setter(dd, member_name, member_id, obj)
+        return write
+
+    @staticmethod
+    def _bulk_writer(setter, data_type, bounds, size=None):
+        # buffers holding numbers of the right type and size (array.array,
+        # numpy arrays, bytes for octets) are copied into the sample as they are.
+        # Arrays (size is not None) are written whole, so the length must match.
+        itemsize = ctypes.sizeof(data_type)
+        formats  = [f for f in _buffer_formats if data_type._type_ in f][0]
+        octets   = data_type is DDS_Octet
+        pointer  = ctypes.POINTER(data_type)
+        def write(obj, dd, member_name, member_id):
+            if octets and type(obj) is bytes:
+                if size is not None and len(obj) != size:
+                    _array_length_error(member_name, size, len(obj))
+                # passed by reference to the bytes object, copied once by the setter
+                setter(dd, member_name, member_id, len(obj), ctypes.cast(ctypes.c_char_p(obj), pointer))
+                return
+            try:
+                view = memoryview(obj)
+            except TypeError:
+                view = None
+            if view is not None and view.format.lstrip(_byte_order) in formats and view.itemsize == itemsize and view.c_contiguous:
+                count = view.nbytes // itemsize
+                if view.readonly:
+                    values = (data_type * count).from_buffer_copy(view)
+                else:
+                    values = (data_type * count).from_buffer(view)
+            else:
+                if not isinstance(obj, (list, tuple)):
+                    obj = list(obj)
+                if bounds is not None:
+                    low, high = bounds
+                    for x in obj:
+                        if not low <= x < high:
+                            raise ValueError('%r not in range [%r, %r)' % (x, low, high))
+                values = (data_type * len(obj))()
+                values[:] = obj
+            if size is not None and len(values) != size:
+                _array_length_error(member_name, size, len(values))
+            setter(dd, member_name, member_id, len(values), values)
+        return write
+
+    @staticmethod
+    def _complex_writer(plan, method):
+        def write(obj, dd, member_name, member_id):
+            inner = plan.acquire()
+            try:
+                _DynamicData_bind_complex_member(dd, inner, member_name, member_id)
+                try:
+                    getattr(plan, method)(obj, inner)
+                finally:
+                    _DynamicData_unbind_complex_member(dd, inner)
+            finally:
+                plan.release(inner)
+        return write
+
+    @staticmethod
+    def _enum_writer(enum_name, labels):
+        indices = {}
+        for i, label in enumerate(labels):
+            indices[label] = indices[bytes.decode(label)] = i
+        def write(obj, dd, member_name, member_id):
+            try:
+                index = indices[obj]
+            except (KeyError, TypeError):
+                raise ValueError('%r is not a member of enum %s' % (obj, bytes.decode(enum_name)))
+            _DynamicData_set_ulong(dd, member_name, member_id, index)
+        return write
+
+    @staticmethod
+    def _string_writer(obj, dd, member_name, member_id):
+        if not isinstance(obj, bytes):
+            obj = obj.encode()
+        if b'\0' in obj:
+            raise ValueError('strings can not contain null characters')
+        _DynamicData_set_string(dd, member_name, member_id, obj)
+
+    @staticmethod
+    def _wstring_writer(obj, dd, member_name, member_id):
+        _DynamicData_set_wstring(dd, member_name, member_id, obj)
+
+    def _unsupported_writer(self, obj, dd, member_name, member_id):
+        raise NotImplementedError(self.kind)
+
+class _TypePlan(object):
+    def __init__(self, tc, key, array_format='list', octet_format=None, record=False):
+        self.tc   = tc
+        self.kind = kind = tc.kind(ex())
+        self.members = []
+        self.element = None
+        self.bound   = 0
+        self.size    = None
+        self._free   = []
+
+        # registered before the members are compiled so that recursive types terminate
+        _building[key] = self
+
+        if kind == TCKind.STRUCT:
+            self.name = tc.name(ex())
+            for i in range(tc.member_count(ex())):
+                self.members.append(_MemberPlan(tc.member_type(i, ex()), tc.member_name(i, ex()), array_format, octet_format, record))
+            self._readers = [(m.name, m.read) for m in self.members]
+            self._writers = [(m.field, m.name, m.write) for m in self.members]
+            self._fields  = {}
+            self._by_key  = {}
+            for m in self.members:
+                self._fields[m.name] = self._fields[m.field] = (m.name, m.merge)
+                self._by_key[m.name] = self._by_key[m.field] = m
+            self.decode = self._decode_struct
+            self.encode = self._encode_struct
+            self.merge  = self._merge_struct
+            self.record = None
+            if record:
+                self.record = collections.namedtuple(bytes.decode(self.name).split('::')[-1],
+                                                     [m.field for m in self.members], rename=True)
+                self.record.__qualname__ = bytes.decode(self.name).replace('::', '.')
+                # fields are renamed when a member name is not a valid field name
+                # (a keyword, say), so records are matched to members by position
+                self.record._dds_type = self.name
+                self.decode = self._decode_record
+        elif kind == TCKind.SEQUENCE or kind == TCKind.ARRAY:
+            self.name = None
+            if kind == TCKind.SEQUENCE:
+                self.bound = tc.length(ex())
+            else:
+                self.size = tc.element_count(ex())
+            self.element = _MemberPlan(tc.content_type(ex()), None, array_format, octet_format, record)
+            self.decode = self._decode_collection
+            self.encode = self._encode_collection
+            self.merge  = self._merge_collection
+        else:
+            raise NotImplementedError(kind)
+
+    def acquire(self):
+        # unbound DynamicData objects used to bind nested members of this type,
+        # reused across samples; one per concurrent decode
+        try:
+            return self._free.pop()
+        except IndexError:
+            return _DynamicData_new(None, _DYNAMIC_DATA_PROPERTY_DEFAULT)
+
+    def release(self, inner):
+        self._free.append(inner)
+
+    def _decode_struct(self, dd):
+        return {name: read(dd, name, DDS_DYNAMIC_DATA_MEMBER_ID_UNSPECIFIED) for name, read in self._readers}
+
+    def _decode_record(self, dd):
+        member_id = DDS_DYNAMIC_DATA_MEMBER_ID_UNSPECIFIED
+        return tuple.__new__(self.record, [read(dd, name, member_id) for name, read in self._readers])
+
+    def _decode_collection(self, dd):
+        read = self.element.read
+        return [read(dd, None, i) for i in range(1, _DynamicData_get_member_count(dd) + 1)]
+
+    def record_items(self, obj):
+        # the (member name, value) pairs of a record of this struct
+        if getattr(obj, '_dds_type', None) != self.name:
+            raise TypeError('%s is not a record of %s' % (type(obj).__name__, bytes.decode(self.name)))
+        return [(m.name, value) for m, value in zip(self.members, obj)]
+
+    def _encode_struct(self, obj, dd):
+        # decoded samples are keyed by bytes, user data by str; both are accepted
+        if isinstance(obj, tuple):
+            obj = dict(self.record_items(obj))
+        for field, name, write in self._writers:
+            write(obj[field] if field in obj else obj[name], dd, name, DDS_DYNAMIC_DATA_MEMBER_ID_UNSPECIFIED)
+
+    def _encode_collection(self, obj, dd):
+        write = self.element.write
+        for i, x in enumerate(obj):
+            write(x, dd, None, i + 1)
+
+    # merge writes only the members present in obj (which may be sparse at any
+    # depth) and leaves the rest of dd as it is; unknown keys are ignored
+
+    def _merge_struct(self, obj, dd):
+        fields = self._fields
+        items = self.record_items(obj) if isinstance(obj, tuple) else obj.items()
+        for key, value in items:
+            member = fields.get(key)
+            if member is not None:
+                member[1](value, dd, member[0], DDS_DYNAMIC_DATA_MEMBER_ID_UNSPECIFIED)
+
+    def _merge_collection(self, obj, dd):
+        merge = self.element.merge
+        for i, x in enumerate(obj):
+            merge(x, dd, None, i + 1)
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return types.MappingProxyType(dict((k, _freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, list):
+        return tuple(_freeze(x) for x in obj)
+    return obj
+
+def _thaw(obj):
+    if isinstance(obj, types.MappingProxyType):
+        return dict((k, _thaw(v)) for k, v in obj.items())
+    if isinstance(obj, tuple):
+        return [_thaw(x) for x in obj]
+    return obj
+
+# Callback dispatch
+#
+# Decoded samples are handed from the middleware's receive thread to the user's
+# callbacks by a dispatcher, chosen per subscription:
+#
+#   'thread'  a new thread per callback (unbounded, unordered)
+#   'inline'  directly in the receive thread
+#   'ordered' a single dispatcher thread, in arrival order
+#   'pool'    a pool of worker threads; samples of the same instance always go
+#             to the same worker so they stay in order
+
+_overflow_policies = ('block', 'drop_oldest', 'drop_newest')
+
+class _BoundedQueue(object):
+    def __init__(self, maxsize, overflow):
+        if overflow not in _overflow_policies:
+            raise ValueError('overflow must be one of %s' % ', '.join(_overflow_policies))
+        self.maxsize   = maxsize
+        self.overflow  = overflow
+        self.dropped   = 0
+        self._items    = collections.deque()
+        self._lock     = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full  = threading.Condition(self._lock)
+        self._closed   = False
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        # returns the number of items discarded, 0 or 1
+        with self._lock:
+            dropped = 0
+            if self.maxsize and len(self._items) >= self.maxsize:
+                if self.overflow == 'drop_newest':
+                    self.dropped += 1
+                    return 1
+                elif self.overflow == 'drop_oldest':
+                    self._items.popleft()
+                    self.dropped += 1
+                    dropped = 1
+                else:
+                    while len(self._items) >= self.maxsize and not self._closed:
+                        self._not_full.wait()
+            if self._closed:
+                self.dropped += 1
+                return dropped + 1
+            self._items.append(item)
+            self._not_empty.notify()
+            return dropped
+
+    def get(self):
+        # returns None once the queue is closed and empty
+        with self._lock:
+            while not self._items:
+                if self._closed:
+                    return None
+                self._not_empty.wait()
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def get_all(self):
+        # like get, but takes everything queued
+        with self._lock:
+            while not self._items:
+                if self._closed:
+                    return None
+                self._not_empty.wait()
+            items = list(self._items)
+            self._items.clear()
+            self._not_full.notify_all()
+            return items
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+def _run_callback(callback, data, stats):
+    # callbacks are only timed when the topic records histograms
+    start  = time.perf_counter() if stats is not None and stats.detailed else None
+    failed = False
+    try:
+        callback(data)
+    except Exception:
+        failed = True
+        traceback.print_exc()
+    if stats is not None:
+        stats.called(None if start is None else time.perf_counter() - start, failed)
+
+class _Dispatcher(object):
+    # stats is set by the topic the dispatcher delivers for
+    keyed       = False
+    inline      = False
+    dropped     = 0
+    threads     = 0
+    queue_depth = 0
+    stats       = None
+
+    def submit(self, key, callback, data):
+        raise NotImplementedError("You must make an instance of a subclass that implements this method")
+
+    def close(self):
+        pass
+
+class _ThreadDispatcher(_Dispatcher):
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def submit(self, key, callback, data):
+        if self.stats is not None:
+            self.stats.add('threads_started')
+        with self._lock:
+            self.threads += 1
+        threading.Thread(target=self._run, args=(callback, data)).start()
+
+    def _run(self, callback, data):
+        try:
+            _run_callback(callback, data, self.stats)
+        finally:
+            with self._lock:
+                self.threads -= 1
+
+class _InlineDispatcher(_Dispatcher):
+    inline = True
+
+    def submit(self, key, callback, data):
+        _run_callback(callback, data, self.stats)
+
+class _WorkerDispatcher(_Dispatcher):
+    def __init__(self, workers, queue_size, overflow):
+        self.keyed   = workers > 1
+        self.threads = workers
+        self._queues = [_BoundedQueue(queue_size, overflow) for _ in range(workers)]
+        for queue in self._queues:
+            worker = threading.Thread(target=self._work, args=(queue,))
+            worker.daemon = True
+            worker.start()
+
+    @property
+    def dropped(self):
+        return sum(queue.dropped for queue in self._queues)
+
+    @property
+    def queue_depth(self):
+        return sum(len(queue) for queue in self._queues)
+
+    def submit(self, key, callback, data):
+        queues = self._queues
+        queue = queues[hash(key) % len(queues)] if self.keyed else queues[0]
+        if queue.put((callback, data)) and self.stats is not None:
+            self.stats.add('dropped')
+
+    def _work(self, queue):
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            _run_callback(item[0], item[1], self.stats)
+
+    def close(self):
+        # queued samples are still delivered, then the workers exit
+        self.threads = 0
+        for queue in self._queues:
+            queue.close()
+
+class _ConflatingDispatcher(_Dispatcher):
+    # One thread delivers the newest pending sample of every instance, and of
+    # every callback of the instance, with the instances in the order they
+    # first became pending. A newer sample replaces the pending one in place,
+    # so an instance updated faster than the thread delivers still gets its
+    # turn. The samples of an instance stay in the order of their latest
+    # arrival, so that updates and disposals are delivered in order. Unkeyed
+    # types have one instance.
+    keyed   = True
+    threads = 1
+
+    def __init__(self):
+        self._pending = collections.OrderedDict()
+        self._lock    = threading.Lock()
+        self._ready   = threading.Condition(self._lock)
+        self._closed  = False
+        worker = threading.Thread(target=self._work)
+        worker.daemon = True
+        worker.start()
+
+    @property
+    def queue_depth(self):
+        with self._lock:
+            return sum(len(events) for events in self._pending.values())
+
+    def submit(self, key, callback, data):
+        # latency tracking wraps the callback per sample
+        target = getattr(callback, '__wrapped__', callback)
+        conflated = False
+        with self._lock:
+            events = self._pending.get(key)
+            if events is None:
+                events = self._pending[key] = []
+            if events and events[-1][0] == target:
+                events[-1] = (target, callback, data)
+                conflated = True
+            else:
+                for i, event in enumerate(events):
+                    if event[0] == target:
+                        del events[i]
+                        conflated = True
+                        break
+                events.append((target, callback, data))
+            self._ready.notify()
+        if conflated and self.stats is not None:
+            self.stats.add('conflated')
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    if self._closed:
+                        return
+                    self._ready.wait()
+                key, events = next(iter(self._pending.items()))
+                target, callback, data = events.pop(0)
+                if not events:
+                    del self._pending[key]
+            _run_callback(callback, data, self.stats)
+
+    def close(self):
+        # pending samples are still delivered, then the thread exits
+        with self._lock:
+            self.threads = 0
+            self._closed = True
+            self._ready.notify_all()
+
+class _Batcher(object):
+    # collects decoded samples into lists: one per take, or up to max_samples
+    # per list, or for at most max_latency seconds across takes. Batches are
+    # taken and handed on under _deliver, so the receive thread and the timer
+    # cannot deliver them out of order.
+    def __init__(self, flush, max_samples=None, max_latency=None, stats=None):
+        if max_samples is not None and max_samples < 1:
+            raise ValueError('max_samples must be at least 1')
+        self._flush       = flush
+        self._max_samples = max_samples
+        self._max_latency = max_latency
+        self._stats       = stats
+        self._pending     = []
+        self._timer       = None
+        self._lock        = threading.Lock()
+        self._deliver     = threading.Lock()
+        self._closed      = False
+
+    def add(self, data):
+        with self._deliver:
+            with self._lock:
+                self._pending.append(data)
+                if self._max_samples is None or len(self._pending) < self._max_samples:
+                    return
+                batch = self._take_pending()
+            self._flush(batch)
+
+    def end_of_take(self):
+        with self._deliver:
+            with self._lock:
+                if not self._pending:
+                    return
+                if self._max_latency is not None:
+                    if self._timer is None and not self._closed:
+                        self._timer = threading.Timer(self._max_latency, self._expire)
+                        self._timer.daemon = True
+                        self._timer.start()
+                    return
+                batch = self._take_pending()
+            self._flush(batch)
+
+    def _expire(self):
+        with self._deliver:
+            with self._lock:
+                self._timer = None
+                if not self._pending or self._closed:
+                    return
+                batch = self._take_pending()
+            self._flush(batch)
+
+    def _take_pending(self):
+        batch, self._pending = self._pending, []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def close(self):
+        # samples that have not been delivered yet are discarded and counted as dropped
+        with self._lock:
+            self._closed = True
+            discarded = len(self._take_pending())
+        if discarded and self._stats is not None:
+            self._stats.add('dropped', discarded)
+
+def _make_dispatcher(mode, workers, queue_size, overflow):
+    if mode == 'thread':
+        return _ThreadDispatcher()
+    elif mode == 'inline':
+        return _InlineDispatcher()
+    elif mode == 'ordered':
+        return _WorkerDispatcher(1, queue_size, overflow)
+    elif mode == 'pool':
+        if workers < 1:
+            raise ValueError('a pool needs at least one worker')
+        return _WorkerDispatcher(workers, queue_size, overflow)
+    elif mode == 'conflate':
+        return _ConflatingDispatcher()
+    else:
+        raise ValueError("dispatch must be one of 'thread', 'inline', 'ordered', 'pool' or 'conflate'")
+
+class _PublishQueue(object):
+    # Samples published asynchronously wait here for the topic's writer
+    # thread, which writes everything queued in one `_write_many'. The thread
+    # holds the topic only while writing, so the topic can still be collected.
+    # Failed samples are printed and kept in the topic's `_publish_errors'.
+    def __init__(self, topic, queue_size, overflow):
+        self._queue   = _BoundedQueue(queue_size, overflow)
+        self._stats   = topic._stats
+        self._errors  = topic._publish_errors
+        self._pending = 0
+        self._idle    = threading.Condition()
+        thread = threading.Thread(target=self._run, args=(weakref.ref(topic),))
+        thread.daemon = True
+        thread.start()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, data, handle):
+        with self._idle:
+            self._pending += 1
+        stats = self._stats
+        dropped = self._queue.put((data, handle, time.perf_counter() if stats.detailed else None))
+        if dropped or stats.detailed:
+            stats.queued(len(self._queue), dropped)
+        if dropped:
+            self._done(dropped)
+
+    def _run(self, topic_ref):
+        while True:
+            items = self._queue.get_all()
+            topic = topic_ref() if items is not None else None
+            if topic is None:
+                return
+            try:
+                try:
+                    result = topic._write_many([item[0] for item in items], _DynamicDataWriter_write,
+                                               'samples_published', False, [item[1] for item in items])
+                except Exception as e:
+                    # e.g. the writer could not be created; none of the items were written
+                    self._stats.add('write_errors', len(items))
+                    errors = [(i, e) for i in range(len(items))]
+                    traceback.print_exception(type(e), e, e.__traceback__)
+                else:
+                    errors = result.errors
+                    for i, e in errors:
+                        traceback.print_exception(type(e), e, e.__traceback__)
+                del topic
+                now = time.perf_counter()
+                self._stats.dequeued([now - item[2] for item in items if item[2] is not None])
+                for i, e in errors:
+                    self._errors.append((items[i][0], e))
+            finally:
+                # flush() must return even if something above failed
+                self._done(len(items))
+
+    def _done(self, count):
+        with self._idle:
+            self._pending -= count
+            if not self._pending:
+                self._idle.notify_all()
+
+    def flush(self, timeout=None):
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+    def close(self):
+        # queued samples are still written, then the thread exits
+        self._queue.close()
+
+# Runtime statistics
+#
+# Every topic counts the samples passing through it and keeps histograms of
+# take sizes, timings and queue depths. Recording only adds to counters under
+# the topic's lock; percentiles are worked out when `stats()' is called.
+
+class _Histogram(object):
+    # log-linear buckets: every power of two from 2**min_exponent up to
+    # 2**max_exponent is split into sub_buckets equal parts, so the memory
+    # used is fixed. Percentiles report the upper bound of their bucket, which
+    # is at most 1/sub_buckets above the recorded value (clamped to the
+    # recorded minimum and maximum). Values outside the range land in the end
+    # buckets.
+    def __init__(self, sub_buckets=8, min_exponent=-30, max_exponent=33):
+        self._sub_buckets  = sub_buckets
+        self._min_exponent = min_exponent
+        self._size         = (max_exponent - min_exponent) * sub_buckets
+        self.reset()
+
+    def reset(self):
+        self.count   = 0
+        self.total   = 0
+        self.min     = None
+        self.max     = None
+        self.zeros   = 0
+        self.buckets = [0] * self._size
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            index = (exponent - self._min_exponent) * self._sub_buckets + int((mantissa - 0.5) * 2 * self._sub_buckets)
+            self.buckets[min(max(index, 0), self._size - 1)] += 1
+        else:
+            self.zeros += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.zeros += other.zeros
+        for index, count in enumerate(other.buckets):
+            if count:
+                self.buckets[index] += count
+
+    def _upper_bound(self, index):
+        exponent, sub_bucket = divmod(index, self._sub_buckets)
+        return math.ldexp(0.5 + (sub_bucket + 1) / (2.0 * self._sub_buckets), exponent + self._min_exponent)
+
+    def _nonempty(self):
+        # (upper bound, count) of every non-empty bucket, in order
+        result = [(0, self.zeros)] if self.zeros else []
+        result.extend((self._upper_bound(index), count) for index, count in enumerate(self.buckets) if count)
+        return result
+
+    def percentile(self, fraction):
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(fraction * self.count)))
+        seen = 0
+        for upper, count in self._nonempty():
+            seen += count
+            if seen >= rank:
+                return max(min(upper, self.max), self.min)
+        return self.max
+
+    def dump(self, out, scale=1.0):
+        # the percentile distribution, in the layout used by HdrHistogram
+        out.write('%12s %14s %10s\n' % ('Value', 'Percentile', 'TotalCount'))
+        seen = 0
+        for upper, count in self._nonempty():
+            seen += count
+            out.write('%12.3f %14.12f %10d\n' % (min(upper, self.max) * scale, float(seen) / self.count, seen))
+        if self.count:
+            out.write('#[Mean = %.3f, Max = %.3f, Total count = %d]\n'
+                      % (self.total / self.count * scale, self.max * scale, self.count))
+
+    def snapshot(self):
+        buckets = self._nonempty()
+        return {
+            'count':   self.count,
+            'sum':     self.total,
+            'mean':    self.total / self.count if self.count else None,
+            'min':     self.min,
+            'max':     self.max,
+            'p50':     self.percentile(0.5),
+            'p90':     self.percentile(0.9),
+            'p99':     self.percentile(0.99),
+            'buckets': buckets,
+        }
+
+class _Stats(object):
+    # Counters are always kept. Histograms, and the clock readings they need,
+    # are only recorded when detailed is set by `enable'; they are allocated
+    # the first time it is, and kept when it is cleared again.
+    counters   = ('takes', 'samples_taken', 'samples_published', 'samples_disposed', 'write_errors',
+                  'callbacks', 'callback_errors', 'dropped', 'threads_started',
+                  'samples_lost', 'samples_rejected', 'deadlines_missed', 'publish_dropped',
+                  'samples_unregistered', 'conflated')
+    histograms = ('samples_per_take', 'decode_time', 'encode_time', 'publish_latency', 'queue_depth',
+                  'callback_time', 'publish_queue_depth', 'publish_queue_time')
+
+    def __init__(self, detailed=False):
+        self._lock       = threading.Lock()
+        self.detailed    = False
+        self._allocated  = False
+        self.reset()
+        self.enable(detailed)
+
+    def enable(self, detailed=True):
+        with self._lock:
+            if detailed:
+                self._allocate()
+            self.detailed = detailed
+
+    def _allocate(self):
+        if not self._allocated:
+            for name in self.histograms:
+                setattr(self, name, _Histogram())
+            self._allocated = True
+
+    def reset(self):
+        with self._lock:
+            for name in self.counters:
+                setattr(self, name, 0)
+            if self._allocated:
+                for name in self.histograms:
+                    getattr(self, name).reset()
+
+    def add(self, counter, count=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + count)
+
+    def taken(self, count, decode_times=None, queue_depth=None):
+        with self._lock:
+            self.takes += 1
+            self.samples_taken += count
+            if self.detailed:
+                self.samples_per_take.record(count)
+                record = self.decode_time.record
+                for elapsed in decode_times or ():
+                    record(elapsed)
+                if queue_depth is not None:
+                    self.queue_depth.record(queue_depth)
+
+    def written(self, counter, count, encode_times=None, latencies=None):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + count)
+            for elapsed in encode_times or ():
+                self.encode_time.record(elapsed)
+            for elapsed in latencies or ():
+                self.publish_latency.record(elapsed)
+
+    def queued(self, depth, dropped):
+        with self._lock:
+            if self.detailed:
+                self.publish_queue_depth.record(depth)
+            self.publish_dropped += dropped
+
+    def dequeued(self, queue_times):
+        with self._lock:
+            for elapsed in queue_times:
+                self.publish_queue_time.record(elapsed)
+
+    def called(self, elapsed, failed):
+        with self._lock:
+            self.callbacks += 1
+            if failed:
+                self.callback_errors += 1
+            if elapsed is not None:
+                self.callback_time.record(elapsed)
+
+    def merge(self, other):
+        with other._lock:
+            for name in self.counters:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+            if other._allocated:
+                self._allocate()
+                for name in self.histograms:
+                    getattr(self, name).merge(getattr(other, name))
+
+    def snapshot(self):
+        with self._lock:
+            result = dict((name, getattr(self, name)) for name in self.counters)
+            if self._allocated:
+                result.update((name, getattr(self, name).snapshot()) for name in self.histograms)
+        if not self._allocated:
+            # an empty histogram without buckets reports the same snapshot
+            result.update((name, _Histogram(max_exponent=-30).snapshot()) for name in self.histograms)
+        return result
+
+class _LatencyTracker(object):
+    # 'transport' is reception - source timestamp, 'dispatch' callback start -
+    # reception and 'callback' the time spent in the callback. 128 sub-buckets
+    # keep the percentiles within 1/128 (under 0.8%) of the recorded latencies.
+    histograms = ('transport', 'dispatch', 'callback')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        for name in self.histograms:
+            setattr(self, name, _Histogram(128))
+
+    def reset(self):
+        with self._lock:
+            for name in self.histograms:
+                getattr(self, name).reset()
+
+    def received(self, info):
+        # returns the reception time, in seconds since the epoch
+        source    = info.source_timestamp.sec + info.source_timestamp.nanosec * 1e-9
+        reception = info.reception_timestamp.sec + info.reception_timestamp.nanosec * 1e-9
+        with self._lock:
+            self.transport.record(reception - source)
+        return reception
+
+    def timed(self, callback, reception):
+        def timed_callback(data):
+            started = time.time()
+            start   = time.perf_counter()
+            try:
+                callback(data)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.dispatch.record(started - reception)
+                    self.callback.record(elapsed)
+        timed_callback.__wrapped__ = callback
+        return timed_callback
+
+    def snapshot(self):
+        with self._lock:
+            return dict((name, getattr(self, name).snapshot()) for name in self.histograms)
+
+    def dump(self, out):
+        with self._lock:
+            for name in self.histograms:
+                out.write('%s latency (milliseconds)\n' % name)
+                getattr(self, name).dump(out, 1e3)
+                out.write('\n')
+
+# Sample pool
+#
+# Native samples for publish and dispose, created by the type support and reused
+# instead of being created and deleted around every write. Returned samples are
+# reset to the default instance by copying a template sample over them.
+
+class _SamplePool(object):
+    def __init__(self, support, size):
+        self.size     = size
+        self.hits     = 0
+        self.misses   = 0
+        self._support = support
+        self._free    = []
+        self._lock    = threading.Lock()
+        self.template = support.create_data()
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                self.hits += 1
+                return self._free.pop()
+            self.misses += 1
+        return self._support.create_data()
+
+    def release(self, sample):
+        _DynamicData_copy(sample, self.template)
+        with self._lock:
+            if len(self._free) < self.size:
+                self._free.append(sample)
+                return
+        self._support.delete_data(sample)
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            surplus, self._free = self._free[size:], self._free[:size]
+        for sample in surplus:
+            self._support.delete_data(sample)
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.size, 'available': len(self._free), 'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        self.resize(0)
+        self._support.delete_data(self.template)
+        self.template = None
+
+class _InstanceCache(object):
+    # Handles of registered instances, with the data they were registered
+    # with, by the values of their key members, least recently used first.
+    # put and resize return the (handle, data) pairs they evict, which the
+    # topic unregisters unless `set_instance_cache_size' says otherwise.
+    def __init__(self, size):
+        self.size       = size
+        self.unregister = True
+        self._handles   = collections.OrderedDict()
+        self._lock      = threading.Lock()
+
+    def __len__(self):
+        return len(self._handles)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is None:
+                return None
+            self._handles.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, handle, data):
+        with self._lock:
+            self._handles[key] = (handle, data)
+            self._handles.move_to_end(key)
+            return self._evict()
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._handles.pop(key, None)
+            return entry[0] if entry is not None else None
+
+    def resize(self, size):
+        with self._lock:
+            self.size = size
+            return self._evict()
+
+    def _evict(self):
+        evicted = []
+        while len(self._handles) > self.size:
+            evicted.append(self._handles.popitem(last=False)[1])
+        return evicted
+
+class _LastValueCache(object):
+    # The newest sample of every live instance by the values of its key
+    # members, least recently updated first. The instance handle of each entry
+    # is kept so that disposals are applied without decoding the key.
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl      = ttl
+        self._entries = collections.OrderedDict()
+        self._keys    = {}
+        self._lock    = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, handle, key, sample):
+        with self._lock:
+            entries = self._entries
+            entries[key] = (sample, time.monotonic(), handle)
+            entries.move_to_end(key)
+            self._keys[handle] = key
+            if self.max_size is not None and len(entries) > self.max_size:
+                self._keys.pop(entries.popitem(last=False)[1][2], None)
+
+    def remove(self, handle):
+        with self._lock:
+            key = self._keys.pop(handle, None)
+            if key is not None:
+                del self._entries[key]
+
+    def _expire(self):
+        # entries are in update order, so the expired ones are at the front
+        if self.ttl is None:
+            return
+        entries  = self._entries
+        deadline = time.monotonic() - self.ttl
+        while entries:
+            key, (_, updated, handle) = next(iter(entries.items()))
+            if updated >= deadline:
+                return
+            del entries[key]
+            self._keys.pop(handle, None)
+
+    def get(self, key):
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def snapshot(self):
+        with self._lock:
+            self._expire()
+            return dict((key, entry[0]) for key, entry in self._entries.items())
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k if isinstance(k, bytes) else k.encode(), _hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(x) for x in value)
+    if isinstance(value, str):
+        return value.encode()
+    return value
+
+# Asyncio streams
+#
+# All streams of a DDS instance are served by one thread waiting on a WaitSet
+# that holds the status condition of every streamed reader plus a guard
+# condition used to attach and detach readers. Taken samples are handed to the
+# stream's event loop a batch at a time. The thread never waits for a consumer:
+# a stream whose queue is full drops samples or fails on its own, so one slow
+# consumer cannot hold up the other streams.
+
+class _StreamEnd(object):
+    pass
+
+_stream_overflow_policies = ('drop_oldest', 'drop_newest', 'error')
+
+class _StreamSink(object):
+    def __init__(self, topic, queue_size, overflow, loop):
+        if overflow not in _stream_overflow_policies:
+            raise ValueError('overflow must be one of %s' % ', '.join(_stream_overflow_policies))
+        self.topic    = topic
+        self.queue    = asyncio.Queue(queue_size)
+        self.overflow = overflow
+        self.loop     = loop
+        self.error    = None
+        self.closed   = False
+
+    def put(self, samples):
+        try:
+            self.loop.call_soon_threadsafe(self._enqueue, samples)
+        except RuntimeError:
+            self.closed = True
+
+    def fail(self, error):
+        try:
+            self.loop.call_soon_threadsafe(self._end, error)
+        except RuntimeError:
+            self.closed = True
+
+    def _end(self, error):
+        # runs in the event loop; the samples already queued are still consumed
+        queue = self.queue
+        if self.error is not None:
+            return
+        self.error = error
+        if queue.full():
+            queue.get_nowait()
+            self.topic._stats.add('dropped', 1)
+        queue.put_nowait(_StreamEnd)
+
+    def _enqueue(self, samples):
+        # runs in the event loop
+        queue   = self.queue
+        dropped = 0
+        if self.error is not None:
+            # the stream has ended, so these samples are never delivered
+            self.topic._stats.add('dropped', len(samples))
+            return
+        for i, sample in enumerate(samples):
+            if queue.full():
+                if self.overflow == 'drop_newest':
+                    dropped += 1
+                    continue
+                elif self.overflow == 'drop_oldest':
+                    dropped += 1
+                    queue.get_nowait()
+                else:
+                    self.error = Error('the stream fell more than %d samples behind' % queue.maxsize)
+                    dropped += queue.qsize() + len(samples) - i
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(_StreamEnd)
+                    break
+            queue.put_nowait(sample)
+        if dropped:
+            self.topic._stats.add('dropped', dropped)
+
+class _StreamPump(object):
+    def __init__(self):
+        self._lock     = threading.Lock()
+        self._requests = collections.deque()
+        self._readers  = {}
+        self._waitset  = DDSFunc.WaitSet_new()
+        self._guard    = DDSFunc.GuardCondition_new()
+        self._waitset.attach_condition(ctypes.cast(self._guard, ctypes.POINTER(DDSType.Condition)))
+
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def add(self, sink):
+        self._request(self._attach, sink)
+
+    def remove(self, sink):
+        self._request(self._detach, sink)
+
+    def close(self):
+        self._request(None, None)
+
+    def _request(self, operation, sink):
+        with self._lock:
+            self._requests.append((operation, sink))
+        self._guard.set_trigger_value(True)
+
+    def _attach(self, sink):
+        # a ReadCondition per reader, owned by the pump; the reader's
+        # StatusCondition is left to the WaitSet of `take' and `read'
+        reader = sink.topic._reader
+        for condition, sinks in self._readers.values():
+            if sinks[0].topic._reader is reader:
+                sinks.append(sink)
+                return
+        read_condition = DDSFunc.DataReader_create_readcondition(
+            reader, DDS_NOT_READ_SAMPLE_STATE, _ANY_VIEW_STATE, _ANY_INSTANCE_STATE)
+        condition = ctypes.cast(read_condition, ctypes.POINTER(DDSType.Condition))
+        self._waitset.attach_condition(condition)
+        self._readers[ctypes.cast(condition, ctypes.c_void_p).value] = (read_condition, [sink])
+
+    def _detach(self, sink):
+        for address, (read_condition, sinks) in list(self._readers.items()):
+            if sink in sinks:
+                sinks.remove(sink)
+                if not sinks:
+                    self._release(sink.topic, read_condition)
+                    del self._readers[address]
+                return
+
+    def _release(self, topic, read_condition):
+        self._waitset.detach_condition(ctypes.cast(read_condition, ctypes.POINTER(DDSType.Condition)))
+        DDSFunc.DataReader_delete_readcondition(topic._reader, read_condition)
+
+    def _run(self):
+        condition_seq = DDSType.ConditionSeq()
+        duration = DDSType.Duration_t(DDS_DURATION_INFINITE_SEC, DDS_DURATION_INFINITE_NSEC)
+
+        while True:
+            condition_seq.initialize()
+            try:
+                self._waitset.wait(ctypes.byref(condition_seq), ctypes.byref(duration))
+                active = [ctypes.cast(condition_seq.get(i), ctypes.c_void_p).value
+                          for i in range(condition_seq.get_length())]
+            finally:
+                condition_seq.finalize()
+
+            self._guard.set_trigger_value(False)
+            if not self._process_requests():
+                return
+            for address in active:
+                if address in self._readers:
+                    self._deliver(self._readers[address][1])
+
+    def _process_requests(self):
+        with self._lock:
+            requests = list(self._requests)
+            self._requests.clear()
+        for operation, sink in requests:
+            if operation is None:
+                for read_condition, sinks in self._readers.values():
+                    self._release(sinks[0].topic, read_condition)
+                self._readers.clear()
+                self._waitset.detach_condition(ctypes.cast(self._guard, ctypes.POINTER(DDSType.Condition)))
+                DDSFunc.GuardCondition_delete(self._guard)
+                DDSFunc.WaitSet_delete(self._waitset)
+                return False
+            operation(sink)
+        return True
+
+    def _deliver(self, sinks):
+        live = [sink for sink in sinks if not sink.closed]
+        if not live:
+            return
+        # _pull_lock is not taken: it is held by `take' and `read' while they
+        # wait, which would hold up the streams of every other topic
+        topic = live[0].topic
+        try:
+            samples = topic._pull_available(_DynamicDataReader_take, _ANY_SAMPLE_STATE, DDS_LENGTH_UNLIMITED)
+        except Exception as e:
+            # the samples stay in the reader and the condition stays triggered,
+            # so the streams of the reader end with the error instead
+            for sink in list(sinks):
+                sink.fail(e)
+                self._detach(sink)
+            return
+        for sink in live if samples else ():
+            sink.put(samples)
+
+class _Stream(object):
+    def __init__(self, pump, sink):
+        self._pump = pump
+        self._sink = sink
+        pump.add(sink)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._sink.closed:
+            raise StopAsyncIteration
+        sample = await self._sink.queue.get()
+        if sample is _StreamEnd:
+            if self._sink.error is not None:
+                raise self._sink.error
+            raise StopAsyncIteration
+        return sample
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+
+        """
+        Stops the stream. Samples still queued are discarded.
+        """
+
+        if not self._sink.closed:
+            self._sink.closed = True
+            self._pump.remove(self._sink)
+            if self._sink.queue.empty():
+                self._sink.queue.put_nowait(_StreamEnd)
+
+    def __del__(self):
+        if not self._sink.closed:
+            self._sink.closed = True
+            self._pump.remove(self._sink)
+
+# Reader statuses that can be watched with `TopicSuper.watch_status': the status
+# mask, the stats counter, the DataReader_get_<status>_status function, the
+# status struct and the names of its last_reason values
+_reader_statuses = {
+    'sample_lost':     (DDS_SAMPLE_LOST_STATUS, 'samples_lost', 'sample_lost',
+                        DDSType.SampleLostStatus, _sample_lost_reasons),
+    'sample_rejected': (DDS_SAMPLE_REJECTED_STATUS, 'samples_rejected', 'sample_rejected',
+                        DDSType.SampleRejectedStatus, _sample_rejected_reasons),
+    'deadline_missed': (DDS_REQUESTED_DEADLINE_MISSED_STATUS, 'deadlines_missed', 'requested_deadline_missed',
+                        DDSType.RequestedDeadlineMissedStatus, None),
+}
+
+def _status_dict(status, reasons):
+    result = {'total_count': status.total_count, 'total_count_change': status.total_count_change}
+    if reasons is not None:
+        result['last_reason'] = reasons.get(status.last_reason, status.last_reason)
+    if hasattr(status, 'last_instance_handle'):
+        handle = status.last_instance_handle
+        result['last_instance_handle'] = bytes(handle.keyHash_value) if handle.isValid else None
+    return result
+
 _outside_refs = set()
 _refs = set()
-_filtered_topic_refs = {}
+
+class _TopicResources(object):
+    # The native entities of a topic, created as they are needed and deleted
+    # when the topic is garbage collected. Deliberately holds no reference to
+    # the topic itself. The filtered topics of a topic are deleted first.
+    def __init__(self, dds, type_name):
+        self.dds       = dds
+        self.type_name = type_name
+        self.topic     = None
+        self.writer    = None
+        self.reader    = None
+        self.pool      = None
+        self.publish_queue = None
+        self.waitsets  = []
+        self.filtered  = []
+        self.closed    = False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        dds = self.dds
+
+        if self.publish_queue is not None:
+            self.publish_queue.close()
+        for resources in self.filtered:
+            resources.close()
+        for ws, read_condition in self.waitsets:
+            ws.detach_condition(ctypes.cast(read_condition, ctypes.POINTER(DDSType.Condition)))
+            DDSFunc.WaitSet_delete(ws)
+            DDSFunc.DataReader_delete_readcondition(self.reader, read_condition)
+        if self.writer is not None:
+            dds._publisher.delete_datawriter(self.writer)
+        if self.reader is not None:
+            dds._subscriber.delete_datareader(self.reader)
+        if type(self.topic) is ctypes.POINTER(DDSType.Topic):
+            dds._participant.delete_topic(self.topic)
+        elif self.topic is not None:
+            dds._participant.delete_contentfilteredtopic(self.topic)
+        if self.pool is not None:
+            self.pool.clear()
+        dds._release_type_support(self.type_name)
 
 class TopicSuper(object):
     def __init__(self, dds, name, data_type, related_topic=None, filter_expression=None, _base_topic=None):
@@ -793,45 +2475,48 @@ class TopicSuper(object):
         self._filter_expression = filter_expression
         self._data_seq = None
         self._info_seq = None
+        self._default_instance = None
         self._base_topic = _base_topic  # This is to prevent the base topic getting garbage collected for filtered topic.
 
-        self._support = support = DDSFunc.DynamicDataTypeSupport_new(self.data_type._get_typecode(),
-                                    get('DYNAMIC_DATA_TYPE_PROPERTY_DEFAULT', DDSType.DynamicDataTypeProperty_t))
-        self._type_name = self.data_type._get_typecode().name(ex())
-        self._support.register_type(self._dds._participant, self._type_name)
-
-        self._topic  = topic      = self._create_topic()
-        self._writer = writer     = self._create_writer()
-        self._dyn_narrowed_writer = DDSFunc.DynamicDataWriter_narrow(self._writer)
+        # the type support is shared by all topics of this type; the writer and
+        # the reader are only created by the first publish and subscribe (or take)
+        support, self._type_name = self._dds._acquire_type_support(self.data_type)
+        self._resources = resources = _TopicResources(self._dds, self._type_name)
+        self._plan = _type_plan(self.data_type._get_typecode(), self._dds._array_format, self._dds._octet_format)
+        self._pool = resources.pool = _SamplePool(support, self._dds._sample_pool_size)
+
+        self._topic  = resources.topic = self._create_topic()
+        self._writer = None
+        self._reader = None
+        self._dyn_narrowed_writer = None
+        self._dyn_narrowed_reader = None
+        self._endpoint_lock       = threading.Lock()
+        self._endpoint_profile    = None
+        self._publish_queue       = None
+        self._publish_errors      = collections.deque(maxlen=100)
+        self._cache               = None
         self._listener            = None
 
-        self._reader = reader = self._dds._subscriber.create_datareader(
-            self._topic.as_topicdescription(),
-            get('DATAREADER_QOS_DEFAULT', DDSType.DataReaderQos),
-            self._listener,
-            0,
-        )
-        self._dyn_narrowed_reader = DDSFunc.DynamicDataReader_narrow(self._reader)
-
         self._data_available_callback = None
         self._instance_revoked_cb     = None
         self._liveliness_lost_cb      = None
-
-        if name not in _filtered_topic_refs: _filtered_topic_refs[name] = []
+        self._stats                   = _Stats(dds._detailed_stats)
+        self._latency                 = None
+        self._status_callbacks        = {}
+        self._dispatcher              = _ThreadDispatcher()
+        self._dispatcher.stats        = self._stats
+        self._batcher                 = None
+        self._sample_format           = 'dict'
+        self._sample_plan             = self._plan
+
+        self._pull_lock = threading.Lock()
+        self._pulled    = False
+        self._streamed  = False
+        self._waitset   = resources.waitsets
 
         def _cleanup(ref):
-            if type(topic) is ctypes.POINTER(DDSType.Topic):
-                dds._publisher.delete_datawriter(writer)
-                dds._subscriber.delete_datareader(reader)
-                for ft in _filtered_topic_refs[name]:
-                    dds._publisher.delete_datawriter(ft._writer)
-                    dds._subscriber.delete_datareader(ft._reader)
-                    dds._participant.delete_contentfilteredtopic(ft._topic)
-                dds._participant.delete_topic(topic)
-                support.unregister_type(dds._participant, data_type._get_typecode().name(ex()))
-                support.delete()
-                del _filtered_topic_refs[name]
-                _refs.remove(ref)
+            resources.close()
+            _refs.remove(ref)
 
         def get_keys():
             keys = []
@@ -843,6 +2528,7 @@ class TopicSuper(object):
             return keys
 
         self._keys = get_keys()
+        self._instances = _InstanceCache(1024)
 
         _refs.add(weakref.ref(self, _cleanup))
 
@@ -852,12 +2538,78 @@ class TopicSuper(object):
     def _create_writer(self):
         raise NotImplementedError("You must make an instance of a subclass that implements this method")
 
-    def _enable_listener(self):
-        assert self._listener is None
-        self._cfunctype_data_available = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.POINTER(DDSType.DataReader))(self._on_data_available)
-        self._listener = DDSType.DataReaderListener(on_data_available=self._cfunctype_data_available)
-        self._reader.set_listener(self._listener, DATA_AVAILABLE_STATUS)
-        _outside_refs.add(self) # really want self._listener, but this does the same thing
+    def _get_writer(self):
+        writer = self._dyn_narrowed_writer
+        if writer is None:
+            with self._endpoint_lock:
+                if self._dyn_narrowed_writer is None:
+                    self._writer = self._resources.writer = self._create_writer()
+                    self._dyn_narrowed_writer = DDSFunc.DynamicDataWriter_narrow(self._writer)
+            writer = self._dyn_narrowed_writer
+        return writer
+
+    def _profile(self):
+        # the QoS library and profile of the endpoints, (None, None) for the defaults
+        if self._base_topic is not None:
+            return self._base_topic._profile()
+        if self._endpoint_profile is not None:
+            return self._endpoint_profile
+        return self._dds._endpoint_qos
+
+    def _create_reader(self):
+        library, profile = self._profile()
+        if profile is not None:
+            return self._dds._subscriber.create_datareader_with_profile(
+                self._topic.as_topicdescription(),
+                library.encode(),
+                profile.encode(),
+                None,
+                0,
+            )
+        return self._dds._subscriber.create_datareader(
+            self._topic.as_topicdescription(),
+            get('DATAREADER_QOS_DEFAULT', DDSType.DataReaderQos),
+            None,
+            0,
+        )
+
+    def _get_reader(self):
+        reader = self._dyn_narrowed_reader
+        if reader is None:
+            with self._endpoint_lock:
+                if self._dyn_narrowed_reader is None:
+                    self._reader = self._resources.reader = self._create_reader()
+                    self._dyn_narrowed_reader = DDSFunc.DynamicDataReader_narrow(self._reader)
+            reader = self._dyn_narrowed_reader
+        return reader
+
+    def _update_listener(self):
+        # the listener handles every status; the mask selects the ones that are
+        # currently wanted
+        mask = DATA_AVAILABLE_STATUS if self._data_available_callback or self._cache is not None else 0
+        for name in self._status_callbacks:
+            mask |= _reader_statuses[name][0]
+
+        if not mask:
+            if self._listener is not None:
+                self._disable_listener()
+            return
+
+        if self._listener is None:
+            fields = dict(DDSType.DataReaderListener._fields_)
+            self._cfunctype_data_available = fields['on_data_available'](self._on_data_available)
+            self._cfunctype_sample_lost    = fields['on_sample_lost'](self._on_sample_lost)
+            self._cfunctype_sample_rejected = fields['on_sample_rejected'](self._on_sample_rejected)
+            self._cfunctype_deadline_missed = fields['on_requested_deadline_missed'](self._on_deadline_missed)
+            self._listener = DDSType.DataReaderListener(
+                on_data_available=self._cfunctype_data_available,
+                on_sample_lost=self._cfunctype_sample_lost,
+                on_sample_rejected=self._cfunctype_sample_rejected,
+                on_requested_deadline_missed=self._cfunctype_deadline_missed,
+            )
+            _outside_refs.add(self) # really want self._listener, but this does the same thing
+        self._get_reader()
+        self._reader.set_listener(self._listener, mask)
 
     def _on_liveliness_changed(self, listener_data, reader, status):
         print("\nstatus.alive_count:", status.alive_count,
@@ -874,9 +2626,88 @@ class TopicSuper(object):
 
     def add_data_available_callback(self, cb):
         '''Warning: callback is called back in another thread!'''
-        if not self._data_available_callback:
-            self._enable_listener()
+        enable = not self._data_available_callback
         self._data_available_callback = cb
+        if enable:
+            self._update_listener()
+
+    def _on_sample_lost(self, listener_data, reader, status):
+        self._status_changed('sample_lost', status.contents)
+
+    def _on_sample_rejected(self, listener_data, reader, status):
+        self._status_changed('sample_rejected', status.contents)
+
+    def _on_deadline_missed(self, listener_data, reader, status):
+        self._status_changed('deadline_missed', status.contents)
+
+    def _status_changed(self, name, status):
+        mask, counter, function, status_type, reasons = _reader_statuses[name]
+        result = _status_dict(status, reasons)
+        if not result['total_count_change']:
+            return
+        self._stats.add(counter, result['total_count_change'])
+        callback = self._status_callbacks.get(name)
+        if callback is not None:
+            self._dispatcher.submit(None, callback, result)
+
+    def watch_status(self, status, callback=None):
+
+        """
+        Starts reporting a reader status that otherwise goes unnoticed: samples
+        lost before they reached the reader ('sample_lost'), samples the reader
+        rejected because a resource limit was reached ('sample_rejected'), or a
+        deadline missed by an instance ('deadline_missed'). Occurrences are
+        counted in `stats' ('samples_lost', 'samples_rejected',
+        'deadlines_missed') and passed to the optional callback as a dictionary
+        with the status' 'total_count', 'total_count_change', 'last_reason'
+        (lost and rejected samples) and 'last_instance_handle' (rejected
+        samples and missed deadlines). Callbacks run like the data available
+        callback, see the dispatch option of `subscribe'.
+
+        Parameters:
+            status   (String)   'sample_lost', 'sample_rejected' or 'deadline_missed'
+            callback (function) Optional. Called with the status dictionary.
+        """
+
+        if status not in _reader_statuses:
+            raise ValueError('status must be one of %s' % ', '.join(sorted(_reader_statuses)))
+        self._status_callbacks[status] = callback
+        self._update_listener()
+
+    def unwatch_status(self, status):
+
+        """
+        Stops reporting a status enabled with `watch_status'.
+
+        Parameters:
+            status (String) 'sample_lost', 'sample_rejected' or 'deadline_missed'
+        """
+
+        if self._status_callbacks.pop(status, False) is not False:
+            self._update_listener()
+
+    def get_status(self, status):
+
+        """
+        Reads a reader status directly, whether or not it is watched, and
+        returns it as a dictionary in the format described in `watch_status'.
+        'total_count_change' counts the occurrences since the status was last
+        read or reported.
+
+        Parameters:
+            status (String) 'sample_lost', 'sample_rejected' or 'deadline_missed'
+        """
+
+        if status not in _reader_statuses:
+            raise ValueError('status must be one of %s' % ', '.join(sorted(_reader_statuses)))
+        mask, counter, function, status_type, reasons = _reader_statuses[status]
+        result = status_type()
+        self._get_reader()
+        getattr(DDSFunc, 'DataReader_get_%s_status' % function)(self._reader, ctypes.byref(result))
+        result = _status_dict(result, reasons)
+        if result['total_count_change']:
+            self._stats.add(counter, result['total_count_change'])
+        return result
 
     def unsubscribe(self, topic=None):
 
@@ -892,8 +2723,33 @@ class TopicSuper(object):
         topic._data_available_callback = None
         topic._instance_revoked_cb     = None
         topic._liveliness_lost_cb      = None
-        if topic._listener:
-            topic._disable_listener()
+        topic._update_listener()
+        topic._set_dispatcher(_ThreadDispatcher())
+        topic._set_batcher(None)
+        topic._set_sample_format('dict')
+
+    def _set_dispatcher(self, dispatcher):
+        dispatcher.stats = self._stats
+        previous, self._dispatcher = self._dispatcher, dispatcher
+        previous.close()
+
+    def _set_batcher(self, batcher):
+        previous, self._batcher = self._batcher, batcher
+        if previous is not None:
+            previous.close()
+
+    def _set_sample_format(self, sample_format):
+        self._sample_format = sample_format
+        if sample_format == 'record':
+            self._sample_plan = _type_plan(self.data_type._get_typecode(), self._dds._array_format,
+                                           self._dds._octet_format, record=True)
+        else:
+            self._sample_plan = self._plan
+
+    def _submit_batch(self, batch):
+        callback = self._data_available_callback
+        if callback is not None:
+            self._dispatcher.submit(None, callback, batch)
 
     def _on_data_available(self, listener_data, datareader):
         if not self._data_seq:
@@ -902,70 +2758,492 @@ class TopicSuper(object):
         if not self._info_seq:
             self._info_seq = DDSType.SampleInfoSeq()
         self._info_seq.initialize()
+        views = None
+
+        reader       = self._dyn_narrowed_reader
+        data_seq     = self._data_seq
+        info_seq     = self._info_seq
+        decode_times = [] if self._stats.detailed else None
 
         try:
-            self._dyn_narrowed_reader.take(
-                ctypes.byref(self._data_seq),
-                ctypes.byref(self._info_seq),
+            _DynamicDataReader_take(
+                reader,
+                ctypes.byref(data_seq),
+                ctypes.byref(info_seq),
                 DDS_LENGTH_UNLIMITED,
-                get('ANY_SAMPLE_STATE', DDS_SampleStateMask),
-                get('ANY_VIEW_STATE', DDS_ViewStateMask),
-                get('ANY_INSTANCE_STATE', DDS_InstanceStateMask)
+                _ANY_SAMPLE_STATE,
+                _ANY_VIEW_STATE,
+                _ANY_INSTANCE_STATE
             )
 
-            for i in range(self._data_seq.get_length()):
-                info = self._info_seq.get_reference(i).contents
-                sample = self._data_seq.get_reference(i)
+            dispatcher = self._dispatcher
+            batcher    = self._batcher
+            latency    = self._latency
+            cache      = self._cache
+            key = None
+
+            # views read the loaned samples unless they are handed to another thread
+            views = [] if self._sample_format == 'view' else None
+            materialize = not dispatcher.inline or batcher is not None or cache is not None
+
+            # the instance state is that of the instance when it is taken, so
+            # every sample of a disposed instance reports the disposal; it is
+            # acted on at the last sample of the instance in this take
+            last = None
+
+            count = _DynamicDataSeq_get_length(data_seq)
+            for i in range(count):
+                info = _SampleInfoSeq_get_reference(info_seq, i).contents
+                sample = _DynamicDataSeq_get_reference(data_seq, i)
+
+                if dispatcher.keyed or cache is not None:
+                    key = bytes(info.instance_handle.keyHash_value)
+
+                if info.valid_data and self._data_available_callback:
+                    data = self._decode(sample, views, materialize, decode_times)
+                    if cache is not None:
+                        cache.update(key, self._instance_key(data), data)
+                    if self._send_topic_info:
+                        data = {'name': self._type_name, 'data': data, 'keys': self._keys}
+
+                    callback = self._data_available_callback
+                    if latency is not None:
+                        reception = latency.received(info)
+                        if batcher is None:
+                            callback = latency.timed(callback, reception)
+
+                    if batcher is not None:
+                        batcher.add(data)
+                    else:
+                        dispatcher.submit(key, callback, data)
 
-                # calling the callbacks in a separate thread. This may cause performance issues.
+                elif info.valid_data and cache is not None:
+                    data = self._decode(sample, views, materialize, decode_times)
+                    cache.update(key, self._instance_key(data), data)
+
+                if info.instance_state == DDS_ALIVE_INSTANCE_STATE:
+                    continue
+                if last is None:
+                    last = self._last_sample_of_instances(info_seq, count)
+                if last[bytes(info.instance_handle.keyHash_value)] != i:
+                    continue
+
+                if cache is not None:
+                    cache.remove(key)
 
                 if info.instance_state == DDS_NOT_ALIVE_DISPOSED_INSTANCE_STATE and self._instance_revoked_cb:
-                    self._dyn_narrowed_reader.get_key_value(sample, ctypes.byref(info.instance_handle))
-                    data = unpack_dd(sample)
+                    _DynamicDataReader_get_key_value(reader, sample, ctypes.byref(info.instance_handle))
+                    data = self._decode(sample, views, materialize, decode_times)
                     if self._send_topic_info:
                         data = {'name': self._type_name, 'data': data, 'keys': self._keys}
 
-                    threading.Thread(target=self._instance_revoked_cb, args=(data,)).start()
+                    dispatcher.submit(key, self._instance_revoked_cb, data)
 
                 if info.instance_state == DDS_NOT_ALIVE_NO_WRITERS_INSTANCE_STATE and self._liveliness_lost_cb:
-                    self._dyn_narrowed_reader.get_key_value(sample, ctypes.byref(info.instance_handle))
-                    data = unpack_dd(sample)
+                    _DynamicDataReader_get_key_value(reader, sample, ctypes.byref(info.instance_handle))
+                    data = self._decode(sample, views, materialize, decode_times)
                     if self._send_topic_info:
                         data = {'name': self._type_name, 'data': data, 'keys': self._keys}
 
-                    threading.Thread(target=self._liveliness_lost_cb, args=(data,)).start()
+                    dispatcher.submit(key, self._liveliness_lost_cb, data)
 
-                if info.instance_state == DDS_ALIVE_INSTANCE_STATE and info.valid_data and self._data_available_callback:
-                    data = unpack_dd(sample)
-                    if self._send_topic_info:
-                        data = {'name': self._type_name, 'data': data, 'keys': self._keys}
+            if batcher is not None:
+                batcher.end_of_take()
 
-                    threading.Thread(target=self._data_available_callback, args=(data,)).start()
+            # the queue depth is only sampled here for its histogram; `stats'
+            # reads the current length itself
+            self._stats.taken(count, decode_times, dispatcher.queue_depth if decode_times is not None else None)
 
         except NoDataError:
             return
 
         finally:
-            self._dyn_narrowed_reader.return_loan(ctypes.byref(self._data_seq), ctypes.byref(self._info_seq))
-            self._data_seq.finalize()
-            self._info_seq.finalize()
+            _DynamicDataReader_return_loan(reader, ctypes.byref(data_seq), ctypes.byref(info_seq))
+            data_seq.finalize()
+            info_seq.finalize()
+            if views:
+                for view in views:
+                    view._release()
+
+    @staticmethod
+    def _last_sample_of_instances(info_seq, count):
+        # the index of the last sample of every instance in a take
+        last = {}
+        for i in range(count):
+            last[bytes(_SampleInfoSeq_get_reference(info_seq, i).contents.instance_handle.keyHash_value)] = i
+        return last
+
+    def _decode(self, sample, views, materialize, decode_times):
+        # decode_times is None unless the topic records histograms
+        start = time.perf_counter() if decode_times is not None else None
+        if views is None:
+            data = self._sample_plan.decode(sample)
+        else:
+            data = SampleView(self._plan, sample)
+            if materialize:
+                data.materialize()
+            else:
+                views.append(data)
+        if start is not None:
+            decode_times.append(time.perf_counter() - start)
+        return data
 
     def _generate_instance(self):
-        sample = self._support.create_data()
-        instance = unpack_dd(sample)
-        self._support.delete_data(sample)
-        return instance
+        if self._default_instance is None:
+            self._default_instance = _freeze(self._plan.decode(self._pool.template))
+        return _thaw(self._default_instance)
 
-    def _update(self, obj, data):
-        for k, v in data.items():
-            if isinstance(v, collections.Mapping):
-                r = self._update(obj.get(k, {}), v)
-                obj[k] = r
-            else:
-                obj[k] = data[k]
-        return obj
+    def take(self, max_samples=None, timeout=None):
+
+        """
+        Removes received samples from the reader and returns them as a list of
+        dictionaries, for consumers that prefer to pull data at their own pace
+        instead of subscribing with a callback. Instance disposals and
+        liveliness changes are not returned.
+
+        Parameters:
+            max_samples (Integer) Return at most this many samples (default: all).
+            timeout     (Float)   Seconds to wait when no data is available.
+                                  None waits until data arrives, 0 does not wait.
+                                  An empty list is returned when it expires.
+        """
 
-    def publish(self, data):
+        return self._pull(_DynamicDataReader_take, _ANY_SAMPLE_STATE, max_samples, timeout)
+
+    def read(self, max_samples=None, timeout=None):
+
+        """
+        Like `take', but leaves the samples in the reader. Only samples that
+        have not been read before are returned.
+
+        Parameters:
+            max_samples (Integer) Return at most this many samples (default: all).
+            timeout     (Float)   Seconds to wait when no data is available.
+                                  None waits until data arrives, 0 does not wait.
+        """
+
+        return self._pull(_DynamicDataReader_read, DDS_NOT_READ_SAMPLE_STATE, max_samples, timeout)
+
+    def _pull(self, operation, sample_states, max_samples, timeout):
+        # the cache's listener takes every sample, so pulling would never see any
+        if self._cache is not None:
+            raise Error('take and read cannot be used while the cache is enabled')
+        self._pulled = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        length   = DDS_LENGTH_UNLIMITED if max_samples is None else max_samples
+        self._get_reader()
+
+        with self._pull_lock:
+            while True:
+                samples = self._pull_available(operation, sample_states, length)
+                if samples:
+                    return samples
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return samples
+                if not self._wait_for_data(remaining):
+                    return samples
+
+    def _pull_available(self, operation, sample_states, length):
+        # also used by the stream pump, which never waits
+        reader   = self._dyn_narrowed_reader
+        data_seq = DDSType.DynamicDataSeq()
+        info_seq = DDSType.SampleInfoSeq()
+        data_seq.initialize()
+        info_seq.initialize()
+        try:
+            operation(
+                reader,
+                ctypes.byref(data_seq),
+                ctypes.byref(info_seq),
+                length,
+                sample_states,
+                _ANY_VIEW_STATE,
+                _ANY_INSTANCE_STATE
+            )
+        except NoDataError:
+            return []
+        else:
+            try:
+                decode  = self._plan.decode
+                clock   = time.perf_counter
+                count   = _DynamicDataSeq_get_length(data_seq)
+                samples = []
+                decode_times = [] if self._stats.detailed else None
+                for i in range(count):
+                    if _SampleInfoSeq_get_reference(info_seq, i).contents.valid_data:
+                        if decode_times is None:
+                            samples.append(decode(_DynamicDataSeq_get_reference(data_seq, i)))
+                            continue
+                        start = clock()
+                        samples.append(decode(_DynamicDataSeq_get_reference(data_seq, i)))
+                        decode_times.append(clock() - start)
+                self._stats.taken(count, decode_times)
+                return samples
+            finally:
+                _DynamicDataReader_return_loan(reader, ctypes.byref(data_seq), ctypes.byref(info_seq))
+        finally:
+            data_seq.finalize()
+            info_seq.finalize()
+
+    def _wait_for_data(self, timeout):
+        # a ReadCondition of its own rather than the reader's StatusCondition,
+        # which the stream pump waits on as well
+        if not self._waitset:
+            ws = DDSFunc.WaitSet_new()
+            read_condition = DDSFunc.DataReader_create_readcondition(
+                self._reader, DDS_NOT_READ_SAMPLE_STATE, _ANY_VIEW_STATE, _ANY_INSTANCE_STATE)
+            ws.attach_condition(ctypes.cast(read_condition, ctypes.POINTER(DDSType.Condition)))
+            self._waitset.append((ws, read_condition))
+        ws = self._waitset[0][0]
+
+        if timeout is None:
+            duration = DDSType.Duration_t(DDS_DURATION_INFINITE_SEC, DDS_DURATION_INFINITE_NSEC)
+        else:
+            duration = DDSType.Duration_t(int(timeout), int((timeout - int(timeout)) * 1e9))
+
+        condition_seq = DDSType.ConditionSeq()
+        condition_seq.initialize()
+        try:
+            ws.wait(ctypes.byref(condition_seq), ctypes.byref(duration))
+        except WaitTimeoutError:
+            return False
+        finally:
+            condition_seq.finalize()
+        return True
+
+    def stream(self, queue_size=1024, overflow='drop_oldest'):
+
+        """
+        Returns an asynchronous iterator over the samples received on this topic,
+        for use with `async for'. Must be called with the event loop running.
+        Samples are taken from the reader by a background thread shared by all
+        streams of the DDS instance, which never waits for a consumer. At most
+        `queue_size' samples are queued for the consumer; when it falls further
+        behind, `overflow' decides what happens. Dropped samples are counted in
+        `stats'. If taking the samples fails, the iteration raises the error.
+        Call `close()' on the stream (or use it with `async with') to stop.
+        Streams cannot be used on a topic with the cache enabled.
+
+        Parameters:
+            queue_size (Integer) The maximum number of samples waiting to be consumed.
+            overflow   (String)  What happens to a sample that arrives when the queue is full
+                                 (defaults to 'drop_oldest'):
+                                 'drop_oldest' - the oldest queued sample is discarded
+                                 'drop_newest' - the new sample is discarded
+                                 'error'       - the queued samples are discarded and the
+                                                 iteration raises Error
+        """
+
+        loop = asyncio.get_running_loop()
+        # the cache's listener takes every sample, so the stream would never see any
+        if self._cache is not None:
+            raise Error('streams cannot be used while the cache is enabled')
+        self._streamed = True
+        self._get_reader()
+        sink = _StreamSink(self, queue_size, overflow, loop)
+        return _Stream(self._dds._get_stream_pump(), sink)
+
+    def set_sample_pool_size(self, size):
+
+        """
+        Sets how many native samples this topic keeps for reuse by `publish'
+        and `dispose'. A size of 0 disables pooling.
+
+        Parameters:
+            size (Integer) The maximum number of pooled samples.
+        """
+
+        self._pool.resize(size)
+
+    def sample_pool_stats(self):
+
+        """
+        Returns the sample pool counters as a dictionary with the keys 'size',
+        'available', 'hits' (samples reused) and 'misses' (samples created).
+        """
+
+        return self._pool.stats()
+
+    def stats(self):
+
+        """
+        Returns a snapshot of this topic's runtime statistics as a dictionary.
+        Counters ('takes', 'samples_taken', 'samples_published', 'samples_disposed',
+        'samples_unregistered', 'write_errors', 'callbacks', 'callback_errors',
+        'dropped', 'conflated', 'threads_started', 'publish_dropped') count events
+        since the topic was created or `reset_stats' was called. Histograms
+        ('samples_per_take', 'decode_time', 'encode_time', 'publish_latency',
+        'queue_depth', 'callback_time', 'publish_queue_depth',
+        'publish_queue_time') are only recorded after `enable_stats' and are
+        dictionaries with 'count', 'sum', 'mean', 'min', 'max', the 'p50', 'p90'
+        and 'p99' percentiles and the non-empty 'buckets' as (upper bound,
+        count) pairs. Times are in seconds. 'callback_threads' and 'queue_length' are the
+        current number of callback threads and of queued samples,
+        'publish_queue_length' the number of samples waiting to be published
+        asynchronously, 'cache_size' the number of instances in the cache of
+        `enable_cache', and 'sample_pool' holds the `sample_pool_stats'.
+
+        Samples received by a filtered subscription are counted by the topic
+        returned from `subscribe'.
+        """
+
+        result = self._stats.snapshot()
+        result['callback_threads'] = self._dispatcher.threads
+        result['queue_length']     = self._dispatcher.queue_depth
+        result['publish_queue_length'] = len(self._publish_queue) if self._publish_queue is not None else 0
+        result['cache_size']       = len(self._cache) if self._cache is not None else 0
+        result['sample_pool']      = self._pool.stats()
+        return result
+
+    def enable_stats(self, enabled=True):
+
+        """
+        Starts (or stops) recording the histograms reported by `stats'. Counters
+        are always kept; the histograms cost a few clock readings per sample and
+        callback, so they are off unless enabled here or with `DDS.enable_stats',
+        and their memory is only allocated the first time they are enabled.
+
+        Parameters:
+            enabled (Boolean) Optional. False stops recording histograms (defaults to True)
+        """
+
+        self._stats.enable(enabled)
+
+    def reset_stats(self):
+
+        """
+        Clears the counters and histograms reported by `stats'.
+        """
+
+        self._stats.reset()
+        if self._latency is not None:
+            self._latency.reset()
+
+    def track_latency(self, enabled=True):
+
+        """
+        Starts (or stops) measuring the latency of the samples delivered to the
+        data available callback, using the timestamps DDS attaches to every
+        sample. Three latencies are recorded: 'transport' from the writer's
+        source timestamp to the reception timestamp, 'dispatch' from reception
+        to the start of the callback, and 'callback', the time spent in the
+        callback. Transport latency across hosts is only meaningful with
+        synchronized clocks. For batch subscriptions only the transport latency
+        is recorded. Enabling it again starts over.
+
+        Parameters:
+            enabled (Boolean) Optional. False stops measuring (defaults to True)
+        """
+
+        self._latency = _LatencyTracker() if enabled else None
+
+    def latency_stats(self):
+
+        """
+        Returns the latencies measured since `track_latency' was called, as a
+        dictionary mapping 'transport', 'dispatch' and 'callback' to histograms
+        in the format of `stats' (in seconds), or None if latency is not being
+        tracked.
+        """
+
+        return None if self._latency is None else self._latency.snapshot()
+
+    def dump_latency(self, out=None):
+
+        """
+        Writes the percentile distribution of each measured latency, in
+        milliseconds, in the text format of HdrHistogram.
+
+        Parameters:
+            out (file) Optional. Where to write (defaults to sys.stdout)
+        """
+
+        if self._latency is None:
+            raise Error('latency is not being tracked, call track_latency() first')
+        self._latency.dump(out or sys.stdout)
+
+    def enable_cache(self, max_size=None, ttl=None):
+
+        """
+        Keeps the newest sample of every instance received by this topic, for
+        lookup with `latest' and `snapshot'. The cache is updated as samples are
+        received, whether or not the topic is subscribed to, and instances are
+        removed when they are disposed or lose all their writers. Cached samples
+        are the ones passed to the callback (in the subscription's sample
+        format) and must not be modified. Enabling it again starts over.
+
+        The cache takes every sample from the reader as it arrives, so it
+        cannot be combined with `take', `read' or `stream': enabling it on a
+        topic that has been pulled from or streamed raises Error, and so do
+        `take', `read' and `stream' while it is enabled.
+
+        Parameters:
+            max_size (Integer) Optional. The most instances kept; the least recently
+                               updated ones are removed first (defaults to no limit)
+            ttl      (Float)   Optional. Seconds after which an instance that has not
+                               been updated is removed (defaults to no limit)
+        """
+
+        if self._pulled:
+            raise Error('the cache cannot be enabled on a topic consumed with take or read')
+        if self._streamed:
+            raise Error('the cache cannot be enabled on a topic consumed with a stream')
+        self._cache = _LastValueCache(max_size, ttl)
+        self._update_listener()
+
+    def disable_cache(self):
+
+        """
+        Stops caching received samples and empties the cache.
+        """
+
+        self._cache = None
+        self._update_listener()
+
+    def latest(self, key):
+
+        """
+        Returns the newest sample of an instance from the cache enabled with
+        `enable_cache', or None if the instance is not in the cache.
+
+        Parameters:
+            key (Dict, tuple or value) The key members of the instance as a dictionary,
+                                       the tuple of key member values in the order of
+                                       the type, or the value of the only key member.
+        """
+
+        if self._cache is None:
+            raise Error('the cache is not enabled, call enable_cache() first')
+        if isinstance(key, collections.abc.Mapping) or hasattr(key, '_asdict'):
+            key = self._instance_key(key)
+        else:
+            key = _hashable(key if isinstance(key, tuple) else (key,))
+        return self._cache.get(key)
+
+    def snapshot(self):
+
+        """
+        Returns the cache enabled with `enable_cache' as a dictionary mapping
+        the tuple of key member values of every cached instance to its newest
+        sample. String keys are bytes.
+        """
+
+        if self._cache is None:
+            raise Error('the cache is not enabled, call enable_cache() first')
+        return self._cache.snapshot()
+
+    def _instance_key(self, data):
+        # the key member values of data, which may be keyed by str or bytes
+        if isinstance(data, tuple):
+            data = dict(self._plan.record_items(data))
+        try:
+            return tuple(_hashable(data[name] if name in data else data[bytes.decode(name)]) for name in self._keys)
+        except KeyError as e:
+            raise ValueError('the key member %s is missing' % e)
+
+    def publish(self, data, handle=None):
 
         """
         Publishes an instance of this topic on the DDS bus with the provided data.
@@ -973,48 +3251,262 @@ class TopicSuper(object):
         in the topic. If the provided data is sparse, a full instance of the topic
         will be published and the non-specified fields will receive default values.
 
+        With `set_publish_queue' enabled the data is queued and written by the
+        topic's writer thread, and must not be changed afterwards.
+
+        Parameters:
+            data   (Dict)             the data to publish on the bus.
+            handle (InstanceHandle_t) Optional. The handle of the instance, from
+                                      `register_instance', which saves DDS working
+                                      it out from the key members
+        """
+
+        if self._publish_queue is not None:
+            self._publish_queue.put(data, handle)
+        else:
+            self._send(data, handle)
+
+    def set_publish_queue(self, enabled=True, queue_size=1024, overflow='block', timeout=None):
+
+        """
+        Makes `publish' queue the data and return at once. A writer thread of
+        this topic encodes and writes the queued samples in order, so the caller
+        is not held up by the write, e.g. when a reliable writer waits for room
+        in its send window. Samples the thread fails to write are printed,
+        counted in `stats' and returned by `publish_errors'. `publish_many' and
+        `dispose' first wait for the queue to empty, so samples stay in order.
+
+        Disabling the queue, or enabling it again with other settings, first
+        waits for the current queue to empty. If that takes longer than
+        `timeout', Error is raised and the current queue stays in use.
+
+        Parameters:
+            enabled    (Boolean) Optional. False goes back to writing in `publish' (defaults to True)
+            queue_size (Integer) Optional. The most samples waiting to be written (defaults to 1024)
+            overflow   (String)  Optional. What `publish' does when the queue is full:
+                                 'block' waits for room, 'drop_oldest' or 'drop_newest'
+                                 discard a sample (defaults to 'block')
+            timeout    (Float)   Optional. The most seconds to wait for the current queue
+                                 to empty (defaults to no limit)
+        """
+
+        queue = self._publish_queue
+        if queue is not None:
+            if not queue.flush(timeout):
+                raise Error('the publish queue did not empty before the timeout')
+            queue.close()
+        queue = _PublishQueue(self, queue_size, overflow) if enabled else None
+        self._publish_queue = self._resources.publish_queue = queue
+
+    def publish_errors(self):
+
+        """
+        Returns the samples that the writer thread of `set_publish_queue' failed
+        to write since the last call, oldest first. Only the last 100 are kept;
+        every failure is counted as a write error in `stats'.
+
+        Returns:
+            errors ([tuple]) A (data, exception) pair for every sample that failed.
+        """
+
+        errors = []
+        while True:
+            try:
+                errors.append(self._publish_errors.popleft())
+            except IndexError:
+                return errors
+
+    def flush(self, timeout=None):
+
+        """
+        Waits until the samples queued by `publish' have been written.
+
         Parameters:
-            data (Dict) the data to publish on the bus.
+            timeout (Float) Optional. The most seconds to wait (defaults to no limit)
+
+        Returns:
+            flushed (Boolean) False if samples were still queued when the timeout expired.
         """
 
-        instance = self._update(self._generate_instance(), data)
-        self._send(instance)
+        queue = self._publish_queue
+        return queue is None or queue.flush(timeout)
+
+    async def publish_async(self, data, handle=None):
 
-    def _send(self, msg):
-        sample = self._support.create_data()
+        """
+        Coroutine version of `publish' that runs the write in the event loop's
+        default executor, so a write blocked by flow control does not stall the
+        loop.
+
+        Parameters:
+            data   (Dict)             the data to publish on the bus.
+            handle (InstanceHandle_t) Optional. The handle of the instance, from
+                                      `register_instance'
+        """
+
+        await asyncio.get_running_loop().run_in_executor(None, self.publish, data, handle)
+
+    def publish_many(self, samples, stop_on_error=False):
+
+        """
+        Publishes a batch of instances of this topic, in order. Each entry is
+        treated like the data passed to `publish' (it may be sparse). The batch
+        may be any iterable, including a generator; it is consumed lazily, and
+        one native sample is reused for the whole batch.
+
+        Parameters:
+            samples       (Iterable) The data to publish, one dictionary per instance.
+            stop_on_error (Boolean)  Optional. Stop at the first sample that fails to encode or
+                                     write instead of recording the error and carrying on
+                                     (defaults to False)
+
+        Returns:
+            result (BatchResult) The number of samples written, the time it took and the
+                                 (index, exception) pairs of the samples that failed.
+        """
+
+        self.flush()
+        return self._write_many(samples, _DynamicDataWriter_write, 'samples_published', stop_on_error)
+
+    def _write_many(self, samples, write, counter, stop_on_error, handles=None):
+        result = BatchResult()
+        plan   = self._plan
+        pool   = self._pool
+        writer = self._get_writer()
+        stats  = self._stats
+        clock  = time.perf_counter
+        sample = pool.acquire()
+        start  = clock()
+        encode_times = [] if stats.detailed else None
+        latencies    = [] if stats.detailed else None
 
         try:
-            write_into_dd(msg, sample)
-            self._dyn_narrowed_writer.write(sample, DDS_HANDLE_NIL)
+            for i, data in enumerate(samples):
+                try:
+                    if encode_times is None:
+                        plan.merge(data, sample)
+                    else:
+                        begin = clock()
+                        plan.merge(data, sample)
+                        encoded = clock()
+                    handle = handles[i] if handles is not None else None
+                    write(writer, sample, DDS_HANDLE_NIL if handle is None else handle)
+                    result.count += 1
+                    if encode_times is not None:
+                        encode_times.append(encoded - begin)
+                        latencies.append(clock() - begin)
+                except Exception as e:
+                    result.errors.append((i, e))
+                    if stop_on_error:
+                        break
+                finally:
+                    _DynamicData_copy(sample, pool.template)
         finally:
-            self._support.delete_data(sample)
+            result.elapsed = clock() - start
+            pool.release(sample)
+            stats.written(counter, result.count, encode_times, latencies)
+            if result.errors:
+                stats.add('write_errors', len(result.errors))
+
+        return result
+
+    def _send(self, msg, handle=None):
+        self._write(msg, _DynamicDataWriter_write, 'samples_published', handle)
+
+    def _write(self, data, write, counter, handle=None):
+        # pooled samples hold the default instance, so only the members
+        # present in data need to be written
+        stats  = self._stats
+        if not stats.detailed:
+            writer = self._get_writer()
+            sample = self._pool.acquire()
+            try:
+                self._plan.merge(data, sample)
+                write(writer, sample, DDS_HANDLE_NIL if handle is None else handle)
+            except Exception:
+                stats.add('write_errors')
+                raise
+            finally:
+                self._pool.release(sample)
+            stats.add(counter)
+            return
+
+        start  = time.perf_counter()
+        writer = self._get_writer()
+        sample = self._pool.acquire()
+
+        try:
+            begin = time.perf_counter()
+            self._plan.merge(data, sample)
+            encoded = time.perf_counter()
+            write(writer, sample, DDS_HANDLE_NIL if handle is None else handle)
+        except Exception:
+            stats.add('write_errors')
+            raise
+        finally:
+            self._pool.release(sample)
+        stats.written(counter, 1, (encoded - begin,), (time.perf_counter() - start,))
 
 class FilteredTopic(TopicSuper):
-    def __init__(self, dds, name, data_type, related_topic, filter_expression, base_topic):
+    def __init__(self, dds, name, data_type, related_topic, filter_expression, base_topic, filter_parameters=None):
+        self._filter_parameters = filter_parameters or []
         super(FilteredTopic, self).__init__(dds, name, data_type, related_topic, filter_expression, base_topic)
 
-    def _create_writer(self):
-        return self._dds._publisher.create_datawriter(
-            self._related_topic,
-            get('DATAWRITER_QOS_DEFAULT', DDSType.DataWriterQos),
-            None,
-            0,
-        )
+    def _get_writer(self):
+        # samples published through a filtered subscription go out on the
+        # writer of the topic it filters
+        return self._base_topic._get_writer()
 
     def _create_topic(self):
         self.filter_name = str(uuid.uuid4())
-        self._filter_params = DDSType.StringSeq()
-        ## calling initialize or from_array causes a segfault on windows. There doesn't seem to be any problem with not making these calls ...
-        # self._filter_params.initialize()
-        # self._filter_params.from_array((ctypes.c_char_p * 0)(), 0)
-        # DDSFunc.StringSeq_from_array(self._filter_params, (ctypes.c_char_p * 0)(), 0)  ## TODO: add in full support for parameterized filters
-
-        return self._dds._participant.create_contentfilteredtopic(
-            self.filter_name,
-            self._related_topic,
-            self._filter_expression,
-            self._filter_params
-        )
+        expression = self._filter_expression
+        params = self._filter_parameter_seq(self._filter_parameters)
+        try:
+            return self._dds._participant.create_contentfilteredtopic(
+                self.filter_name.encode(),
+                self._related_topic,
+                expression.encode() if isinstance(expression, str) else expression,
+                params
+            )
+        finally:
+            params.finalize()
+
+    @staticmethod
+    def _filter_parameter_seq(parameters):
+        # DDS copies the parameters, so the sequence only lives for one call;
+        # from_array is skipped for an empty list, the initialized sequence
+        # is passed as it is
+        values = [p if isinstance(p, bytes) else str(p).encode() for p in parameters]
+        params = DDSType.StringSeq()
+        params.initialize()
+        if values:
+            try:
+                DDSFunc.StringSeq_from_array(params, (ctypes.c_char_p * len(values))(*values), len(values))
+            except:
+                params.finalize()
+                raise
+        return params
+
+    def set_filter_parameters(self, parameters):
+
+        """
+        Replaces the parameters of the filter expression (%0, %1, ...) in place.
+        The subscription keeps its reader and callbacks, so changing what it
+        receives is cheap and does not cause a new discovery.
+
+        Parameters:
+            parameters ([String]) The new parameter values, one per parameter of the
+                                  expression. Values are inserted as written, so
+                                  string values must be quoted, e.g. "'device_7'".
+                                  Numbers may be passed as they are.
+        """
+
+        params = self._filter_parameter_seq(parameters)
+        try:
+            self._topic.set_expression_parameters(params)
+        finally:
+            params.finalize()
+        self._filter_parameters = list(parameters)
 
 class Topic(TopicSuper):
     def __init__(self, dds, name, data_type):
@@ -1022,6 +3514,15 @@ class Topic(TopicSuper):
         self._filtered_topics = {}
 
     def _create_writer(self):
+        library, profile = self._profile()
+        if profile is not None:
+            return self._dds._publisher.create_datawriter_with_profile(
+                self._topic,
+                library.encode(),
+                profile.encode(),
+                None,
+                0,
+            )
         return self._dds._publisher.create_datawriter(
             self._topic,
             get('DATAWRITER_QOS_DEFAULT', DDSType.DataWriterQos),
@@ -1029,6 +3530,32 @@ class Topic(TopicSuper):
             0,
         )
 
+    def set_qos(self, qos_library=None, qos_profile=None, qos=None):
+
+        """
+        Selects the QoS of this topic's DataWriter and DataReader: a profile
+        from the loaded QoS libraries (by default the one given to `DDS' with
+        endpoint_qos=True, if any), optionally adjusted by a `Qos' object. The endpoints are created
+        by the first publish and subscribe, so this must be called before
+        either. Filtered subscriptions use the QoS of the topic they filter.
+
+        Parameters:
+            qos_library (String) Optional. The QoS library of the profile
+            qos_profile (String) Optional. The QoS profile to use
+            qos         (Qos)    Optional. Settings that override the profile
+        """
+
+        if self._writer is not None or self._reader is not None:
+            raise Error('the QoS must be set before the topic publishes or subscribes')
+        if (qos_library is None) != (qos_profile is None):
+            raise ValueError('qos_library and qos_profile must be given together')
+        if qos_profile is None:
+            qos_library, qos_profile = self._dds._endpoint_qos
+        if qos is not None:
+            base_name = '%s::%s' % (qos_library, qos_profile) if qos_profile is not None else None
+            qos_library, qos_profile = _load_qos_profile(qos, base_name)
+        self._endpoint_profile = (qos_library, qos_profile)
+
     def _create_topic(self):
         return self._dds._participant.create_topic(
             self.name.encode(),
@@ -1039,7 +3566,9 @@ class Topic(TopicSuper):
         )
 
 
-    def subscribe(self, data_available_callback, instance_revoked_cb=None, liveliness_lost_cb=None, filter_expression=None, _send_topic_info=False):
+    def subscribe(self, data_available_callback, instance_revoked_cb=None, liveliness_lost_cb=None, filter_expression=None,
+                  filter_parameters=None, dispatch='thread', workers=4, queue_size=1024, overflow='block',
+                  batch=False, max_samples=None, max_latency=None, sample_format='dict', _send_topic_info=False):
 
         """
         Makes a DDS subscription for this topic with the provided callback.
@@ -1050,9 +3579,6 @@ class Topic(TopicSuper):
         To cancel a subscription, you call `unsubscribe' with a `topic' argument. This
         method returns the topic instance for this purpose.
 
-        NOTE: currently filter parameters are not supported. Only provide filters
-              without parameters!
-
         Parameters:
             data_available_callback  (function) Required. This function will be called with a
                                                 dictionary containing the topic (name:value) pairs
@@ -1065,6 +3591,51 @@ class Topic(TopicSuper):
 
             filter_expression        (String)   Optional. The filter expression
 
+            filter_parameters        ([String]) Optional. Values for the parameters of the filter expression
+                                                (%0, %1, ...). They can be changed later with
+                                                `set_filter_parameters' on the returned topic.
+
+            dispatch                 (String)   Optional. How callbacks are run (defaults to 'thread'):
+                                                'thread'  - in a new thread per sample
+                                                'inline'  - in the middleware's receive thread
+                                                'ordered' - in a single dispatcher thread, in arrival order
+                                                'pool'    - in a pool of `workers' threads, in order per instance
+                                                'conflate' - in a single dispatcher thread, with only the newest
+                                                            pending sample of each instance kept; samples
+                                                            replaced before delivery are counted as
+                                                            'conflated' in `stats'
+
+            workers                  (Integer)  Optional. The number of threads for the 'pool' dispatch mode
+                                                (defaults to 4)
+
+            queue_size               (Integer)  Optional. The maximum number of samples waiting for an 'ordered'
+                                                or 'pool' worker (defaults to 1024, 0 means unbounded)
+
+            overflow                 (String)   Optional. What happens to a sample that arrives when the queue
+                                                is full (defaults to 'block'):
+                                                'block'       - the receive thread waits for room
+                                                'drop_oldest' - the oldest queued sample is discarded
+                                                'drop_newest' - the new sample is discarded
+
+            batch                    (Boolean)  Optional. If True, data_available_callback is called with a
+                                                list of samples, once per batch of received samples, instead
+                                                of once per sample (defaults to False)
+
+            max_samples              (Integer)  Optional. The maximum number of samples in a batch
+
+            max_latency              (Float)    Optional. If given, batches are collected across receptions
+                                                for up to this many seconds (or until max_samples is reached)
+                                                before they are delivered. Otherwise every batch of received
+                                                samples is delivered right away.
+
+            sample_format            (String)   Optional. How samples are passed to the callbacks
+                                                (defaults to 'dict'):
+                                                'dict' - fully decoded dictionaries
+                                                'view' - a read-only SampleView that decodes members
+                                                         when they are first accessed
+                                                'record' - a namedtuple generated for the type, with
+                                                         attribute access and `_asdict()'
+
         Returns:
             topic (Topic or ContentFilteredTopic) The topic to pass to `unsubscribe' if desired.
 
@@ -1072,23 +3643,44 @@ class Topic(TopicSuper):
         """
 
 
+        if not batch and (max_samples is not None or max_latency is not None):
+            raise ValueError('max_samples and max_latency only apply to batch subscriptions')
+        if batch and dispatch == 'conflate':
+            raise ValueError("batch subscriptions cannot use dispatch='conflate'")
+        if sample_format not in ('dict', 'view', 'record'):
+            raise ValueError("sample_format must be 'dict', 'view' or 'record'")
+        if filter_parameters and not filter_expression:
+            raise ValueError('filter_parameters need a filter_expression')
+
+        dispatcher = _make_dispatcher(dispatch, workers, queue_size, overflow)
+
         if filter_expression:
-            filtered_topic = FilteredTopic(self._dds, self.name, self.data_type, self._topic, filter_expression, self)
+            filtered_topic = FilteredTopic(self._dds, self.name, self.data_type, self._topic, filter_expression, self,
+                                           filter_parameters)
+            filtered_topic.enable_stats(self._stats.detailed)
+            filtered_topic._set_dispatcher(dispatcher)
+            if batch:
+                filtered_topic._set_batcher(_Batcher(filtered_topic._submit_batch, max_samples, max_latency,
+                                                     filtered_topic._stats))
             filtered_topic._instance_revoked_cb = instance_revoked_cb
             filtered_topic._liveliness_lost_cb  = liveliness_lost_cb
             filtered_topic._send_topic_info     = _send_topic_info
+            filtered_topic._set_sample_format(sample_format)
             filtered_topic.add_data_available_callback(data_available_callback)
             self._filtered_topics[filtered_topic.filter_name] = filtered_topic
-            _filtered_topic_refs[self.name].append(filtered_topic)
+            self._resources.filtered.append(filtered_topic._resources)
             return filtered_topic
         else:
+            self._set_dispatcher(dispatcher)
+            self._set_batcher(_Batcher(self._submit_batch, max_samples, max_latency, self._stats) if batch else None)
             self._send_topic_info     = _send_topic_info
+            self._set_sample_format(sample_format)
             self._instance_revoked_cb = instance_revoked_cb
             self._liveliness_lost_cb  = liveliness_lost_cb
             self.add_data_available_callback(data_available_callback)
             return self
 
-    def dispose(self, data):
+    def dispose(self, data, handle=None):
 
         """
         Disposes a message instance. The provided message must have the 'key'
@@ -1096,17 +3688,289 @@ class Topic(TopicSuper):
         keys will be disposed.
 
         Parameters:
-            data (Dict) The provided message.
+            data   (Dict)             The provided message.
+            handle (InstanceHandle_t) Optional. The handle of the instance, from `register_instance'
+        """
+
+        self.flush()
+        self._write(data, _DynamicDataWriter_dispose, 'samples_disposed', handle)
+
+    def register_instance(self, keys):
+
+        """
+        Registers the instance with the given key values with the DataWriter and
+        returns its handle. Passing the handle to `publish', `dispose' and
+        `unregister' saves DDS hashing the key members on every write, which adds
+        up when many keyed instances are updated at a high rate. Handles are
+        cached by key values, so registering an instance again is a dictionary
+        lookup; the cache keeps the most recently used `set_instance_cache_size'
+        handles and unregisters the instances it evicts.
+
+        Parameters:
+            keys (Dict) The key members of the instance (other members are ignored).
+
+        Returns:
+            handle (InstanceHandle_t) The handle of the instance.
+        """
+
+        key = self._instance_key(keys)
+        handle = self._instances.get(key)
+        if handle is None:
+            writer = self._get_writer()
+            sample = self._pool.acquire()
+            try:
+                self._plan.merge(keys, sample)
+                handle = _DynamicDataWriter_register_instance(writer, sample)
+            finally:
+                self._pool.release(sample)
+            if not handle.isValid:
+                raise Error('could not register the instance')
+            self._unregister_evicted(self._instances.put(key, handle, keys))
+        return handle
+
+    def _unregister_evicted(self, evicted):
+        if not evicted or not self._instances.unregister:
+            return
+        # queued samples may still use the handles
+        self.flush()
+        for handle, data in evicted:
+            self._write(data, _DynamicDataWriter_unregister_instance, 'samples_unregistered', handle)
+
+    def unregister(self, data, handle=None):
+
+        """
+        Tells DDS this writer will not update an instance any more. Subscribers
+        see the instance lose its writers once no writer has it registered. The
+        cached handle of the instance is forgotten.
+
+        Parameters:
+            data   (Dict)             The key members of the instance.
+            handle (InstanceHandle_t) Optional. The handle of the instance, from `register_instance'
         """
 
-        instance = self._update(self._generate_instance(), data)
-        sample   = self._support.create_data()
+        self.flush()
+        self._instances.pop(self._instance_key(data))
+        self._write(data, _DynamicDataWriter_unregister_instance, 'samples_unregistered', handle)
 
+    def set_instance_cache_size(self, size, unregister=True):
+
+        """
+        Sets how many instance handles `register_instance' keeps (defaults to
+        1024). The least recently used handles are evicted first, including
+        those evicted right away when the cache shrinks. An evicted instance
+        is unregistered, as by `unregister', so the writer does not keep
+        resources for it; its handle must not be used any more. With
+        unregister=False evicted instances stay registered, which DDS keeps
+        track of until the writer is deleted, and only their handles are
+        forgotten; writing them without a handle still works.
+
+        Parameters:
+            size       (Integer) The maximum number of cached handles.
+            unregister (Boolean) Optional. Unregister the instances of evicted handles
+                                 (defaults to True)
+        """
+
+        self._instances.unregister = unregister
+        self._unregister_evicted(self._instances.resize(size))
+
+    def dispose_many(self, samples, stop_on_error=False):
+
+        """
+        Disposes a batch of message instances, in order. Each entry is treated
+        like the message passed to `dispose'. See `publish_many' for the handling
+        of the batch and the result.
+
+        Parameters:
+            samples       (Iterable) The messages, one dictionary per instance.
+            stop_on_error (Boolean)  Optional. Stop at the first failing message (defaults to False)
+
+        Returns:
+            result (BatchResult)
+        """
+
+        self.flush()
+        return self._write_many(samples, _DynamicDataWriter_dispose, 'samples_disposed', stop_on_error)
+
+class BatchResult(object):
+    """
+    The outcome of `Topic.publish_many' or `Topic.dispose_many'.
+
+    Attributes:
+        count   (Integer) The number of samples written.
+        elapsed (Float)   The time taken by the whole batch, in seconds.
+        errors  ([tuple]) An (index, exception) pair for every sample that failed.
+    """
+    def __init__(self):
+        self.count   = 0
+        self.elapsed = 0.0
+        self.errors  = []
+
+    def __repr__(self):
+        return '<BatchResult count=%d errors=%d elapsed=%.6fs>' % (self.count, len(self.errors), self.elapsed)
+
+class Qos(object):
+    """
+    QoS settings for the DataWriter and DataReader of a topic, applied with
+    `Topic.set_qos'. Only the settings that are given override the profile
+    they are based on (or the defaults of DDS). They are turned into an XML
+    QoS profile that is loaded into DDS.
+
+    Parameters:
+        reliability       (String)  'reliable' or 'best_effort'
+        history_depth     (Integer) Keep the last this many samples of every instance
+        keep_all          (Boolean) Keep all samples instead, up to the resource limits
+        durability        (String)  'volatile' or 'transient_local'
+        publish_mode      (String)  'synchronous' or 'asynchronous' (samples are sent by
+                                    a DDS thread instead of inside `publish')
+        batch_max_samples (Integer) Enables writer batching with at most this many samples
+                                    in a batch
+        batch_max_bytes   (Integer) Enables writer batching with at most this many bytes
+                                    of sample data in a batch
+        batch_flush_delay (Float)   Seconds after which an incomplete batch is sent
+                                    (by default only full batches are sent)
+    """
+
+    _kinds = {
+        'reliability':  {'reliable': 'RELIABLE_RELIABILITY_QOS', 'best_effort': 'BEST_EFFORT_RELIABILITY_QOS'},
+        'durability':   {'volatile': 'VOLATILE_DURABILITY_QOS', 'transient_local': 'TRANSIENT_LOCAL_DURABILITY_QOS'},
+        'publish_mode': {'synchronous': 'SYNCHRONOUS_PUBLISH_MODE_QOS', 'asynchronous': 'ASYNCHRONOUS_PUBLISH_MODE_QOS'},
+    }
+
+    def __init__(self, reliability=None, history_depth=None, keep_all=False, durability=None, publish_mode=None,
+                 batch_max_samples=None, batch_max_bytes=None, batch_flush_delay=None):
+        for policy, value in (('reliability', reliability), ('durability', durability), ('publish_mode', publish_mode)):
+            if value is not None and value not in self._kinds[policy]:
+                raise ValueError('%s must be one of %s' % (policy, ', '.join(sorted(self._kinds[policy]))))
+        if keep_all and history_depth is not None:
+            raise ValueError('history_depth does not apply with keep_all')
+        self.reliability       = reliability
+        self.history_depth     = history_depth
+        self.keep_all          = keep_all
+        self.durability        = durability
+        self.publish_mode      = publish_mode
+        self.batch_max_samples = batch_max_samples
+        self.batch_max_bytes   = batch_max_bytes
+        self.batch_flush_delay = batch_flush_delay
+
+    def __repr__(self):
+        settings = ('%s=%r' % (k, v) for k, v in sorted(self.__dict__.items()) if v not in (None, False))
+        return 'Qos(%s)' % ', '.join(settings)
+
+    def _policies(self, writer):
+        xml = []
+        if self.reliability is not None:
+            xml.append('<reliability><kind>%s</kind></reliability>' % self._kinds['reliability'][self.reliability])
+        if self.keep_all:
+            xml.append('<history><kind>KEEP_ALL_HISTORY_QOS</kind></history>')
+        elif self.history_depth is not None:
+            xml.append('<history><kind>KEEP_LAST_HISTORY_QOS</kind><depth>%d</depth></history>' % self.history_depth)
+        if self.durability is not None:
+            xml.append('<durability><kind>%s</kind></durability>' % self._kinds['durability'][self.durability])
+        if writer and self.publish_mode is not None:
+            xml.append('<publish_mode><kind>%s</kind></publish_mode>' % self._kinds['publish_mode'][self.publish_mode])
+        if writer and (self.batch_max_samples is not None or self.batch_max_bytes is not None):
+            xml.append('<batch><enable>true</enable>')
+            if self.batch_max_samples is not None:
+                xml.append('<max_samples>%d</max_samples>' % self.batch_max_samples)
+            if self.batch_max_bytes is not None:
+                xml.append('<max_data_bytes>%d</max_data_bytes>' % self.batch_max_bytes)
+            if self.batch_flush_delay is not None:
+                xml.append('<max_flush_delay><sec>%d</sec><nanosec>%d</nanosec></max_flush_delay>'
+                           % (int(self.batch_flush_delay), int(self.batch_flush_delay % 1 * 1e9)))
+            xml.append('</batch>')
+        return ''.join(xml)
+
+# Qos objects become profiles of the 'pyDDS' QoS library. The library is handed
+# to DDS as a str:// URL appended to NDDS_QOS_PROFILES, and the profiles are
+# reloaded whenever one is added. Identical settings share a profile.
+
+_qos_library        = 'pyDDS'
+_qos_profile_names  = collections.OrderedDict()
+_qos_lock           = threading.Lock()
+_user_qos_profiles  = os.environ.get('NDDS_QOS_PROFILES')
+
+def _load_qos_profile(qos, base_name):
+    key = (qos._policies(True), qos._policies(False), base_name)
+    with _qos_lock:
+        name = _qos_profile_names.get(key)
+        if name is None:
+            name = _qos_profile_names[key] = 'profile_%d' % len(_qos_profile_names)
+            profiles = ''.join(
+                "<qos_profile name='%s'%s><datawriter_qos>%s</datawriter_qos><datareader_qos>%s</datareader_qos></qos_profile>"
+                % (n, " base_name='%s'" % b if b else '', w, r) for (w, r, b), n in _qos_profile_names.items())
+            xml = "<dds><qos_library name='%s'>%s</qos_library></dds>" % (_qos_library, profiles)
+            os.environ['NDDS_QOS_PROFILES'] = ';'.join([url for url in [_user_qos_profiles] if url] + ['str://"%s"' % xml])
+            DDSFunc.DomainParticipantFactory_get_instance().reload_profiles()
+    return _qos_library, name
+
+class SampleView(collections.abc.Mapping):
+    """
+    A read-only mapping over a received sample, passed to the callbacks of a
+    subscription made with sample_format='view'. Members are decoded when they
+    are first accessed and then cached, so a callback only pays for the members
+    it looks at. Like decoded samples, views are keyed by member name (as bytes
+    or str).
+
+    With the 'inline' dispatch mode a view reads the loaned sample directly and
+    is only usable during the callback unless `materialize' is called. Views
+    passed to other threads are materialized before they are delivered.
+    """
+    def __init__(self, plan, dd):
+        self._plan   = plan
+        self._dd     = dd
+        self._values = {}
+        self._owned  = False
+
+    def __getitem__(self, key):
+        member = self._plan._by_key.get(key)
+        if member is None:
+            raise KeyError(key)
         try:
-            write_into_dd(instance, sample)
-            self._dyn_narrowed_writer.dispose(sample, DDS_HANDLE_NIL)
-        finally:
-            self._support.delete_data(sample)
+            return self._values[member.name]
+        except KeyError:
+            pass
+        if self._dd is None:
+            raise Error('the sample is no longer loaned, call materialize() to keep a view')
+        value = self._values[member.name] = member.read(self._dd, member.name, DDS_DYNAMIC_DATA_MEMBER_ID_UNSPECIFIED)
+        return value
+
+    def __contains__(self, key):
+        # without decoding the member, which the inherited version would do
+        return key in self._plan._by_key
+
+    def __iter__(self):
+        return (member.name for member in self._plan.members)
+
+    def __len__(self):
+        return len(self._plan.members)
+
+    def __repr__(self):
+        return '<SampleView %s>' % bytes.decode(self._plan.name)
+
+    def materialize(self):
+
+        """
+        Copies the sample so that the view stays usable after the reader loan
+        has been returned. Returns the view.
+        """
+
+        if not self._owned:
+            if self._dd is None:
+                raise Error('the sample is no longer loaned')
+            copy = DDSFunc.DynamicData_new(self._plan.tc, _DYNAMIC_DATA_PROPERTY_DEFAULT)
+            try:
+                DDSFunc.DynamicData_copy(copy, self._dd)
+            except:
+                DDSFunc.DynamicData_delete(copy)
+                raise
+            self._dd    = copy
+            self._owned = True
+            weakref.finalize(self, DDSFunc.DynamicData_delete, copy)
+        return self
+
+    def _release(self):
+        if not self._owned:
+            self._dd = None
 
 def subscribe_to_all_topics(topic_libraries, data_available_callback, instance_revoked_cb=None, liveliness_lost_cb=None, domain_id=0):
     """
@@ -1143,19 +4007,38 @@ class DDS(object):
     The main DDS interface.
 
     Parameters:
-        topic_libraries ([String]) The list of topic libraries. If there is only one topic library,
-                                   you may pass just the name instead of a list.
-        qos_library     (String)   The name of the QOS library to use (Optional)
-        qos_profile     (String)   The name of the QOS profile to use (Optional)
-        domain_id       (Integer)  The DDS domain ID (defaults to 0)
+        topic_libraries  ([String]) The list of topic libraries. If there is only one topic library,
+                                    you may pass just the name instead of a list.
+        qos_library      (String)   The name of the QOS library to use (Optional)
+        qos_profile      (String)   The name of the QOS profile to use (Optional)
+        endpoint_qos     (Boolean)  Also create every DataWriter and DataReader with the QoS
+                                    profile instead of only the participant (defaults to False)
+        domain_id        (Integer)  The DDS domain ID (defaults to 0)
+        sample_pool_size (Integer)  The number of native samples each topic keeps for reuse
+                                    when publishing (defaults to 4)
+        array_format     (String)   How received sequences and arrays of numbers are returned:
+                                    'list' (default), 'array' (array.array, except that booleans
+                                    are still a list of bool) or 'numpy'
+        octet_format     (String)   Return sequences and arrays of octets as 'bytes' or as a
+                                    'memoryview' instead (Optional)
     """
-    def __init__(self, topic_libraries, qos_library=None, qos_profile=None, domain_id=0,
-                 _get_all=False, _all_data_available_cb=None, _all_ir_cb=None, _all_ll_cb=None):
+    def __init__(self, topic_libraries, qos_library=None, qos_profile=None, domain_id=0, sample_pool_size=4,
+                 array_format='list', octet_format=None, endpoint_qos=False, _get_all=False, _all_data_available_cb=None, _all_ir_cb=None, _all_ll_cb=None):
 
         self._data_seq      = None
         self._info_seq      = None
         self._condition_seq = None
         self._initialized   = False
+        self._sample_pool_size = sample_pool_size
+        self._detailed_stats   = False
+        _check_array_format(array_format, octet_format)
+        self._array_format  = array_format
+        self._octet_format  = octet_format
+        self._stream_pumps  = stream_pumps = []
+        self._stream_lock   = threading.Lock()
+        self._type_supports = {}
+        self._type_lock     = threading.Lock()
+        self._endpoint_qos  = (qos_library, qos_profile) if endpoint_qos and qos_library and qos_profile else (None, None)
 
         if type(topic_libraries) != list:
             topic_libraries = [topic_libraries]
@@ -1201,6 +4084,8 @@ class DDS(object):
             self._topics = Library(map(libname, topic_libraries))
 
         def _cleanup(ref):
+            for pump in stream_pumps:
+                pump.close()
             participant.delete_subscriber(subscriber)
             participant.delete_publisher(publisher)
 
@@ -1230,9 +4115,9 @@ class DDS(object):
             ctypes.byref(self._data_seq),
             ctypes.byref(self._info_seq),
             DDS_LENGTH_UNLIMITED,
-            get('ANY_SAMPLE_STATE', DDS_SampleStateMask),
-            get('ANY_VIEW_STATE', DDS_ViewStateMask),
-            get('ANY_INSTANCE_STATE', DDS_InstanceStateMask)
+            _ANY_SAMPLE_STATE,
+            _ANY_VIEW_STATE,
+            _ANY_INSTANCE_STATE
         )
 
         for i in range(self._data_seq.get_length()):
@@ -1283,6 +4168,92 @@ class DDS(object):
                 self._data_seq.finalize()
 
 
+    def stats(self):
+
+        """
+        Returns a snapshot of the runtime statistics of this DDS instance as a
+        dictionary: 'topics' maps the name of every open topic to its
+        `Topic.stats', 'totals' adds up the counters and histograms of all
+        topics (filtered subscriptions included), and 'threads' and
+        'stream_threads' are the number of threads in the process and of
+        threads serving asyncio streams.
+        """
+
+        topics = dict(self._open_topics.items())
+        totals = _Stats()
+        callback_threads = queue_length = 0
+        for topic in topics.values():
+            for t in [topic] + list(topic._filtered_topics.values()):
+                totals.merge(t._stats)
+                callback_threads += t._dispatcher.threads
+                queue_length     += t._dispatcher.queue_depth
+
+        totals = totals.snapshot()
+        totals['callback_threads'] = callback_threads
+        totals['queue_length']     = queue_length
+        return {
+            'topics':         dict((name, topic.stats()) for name, topic in topics.items()),
+            'totals':         totals,
+            'threads':        threading.active_count(),
+            'stream_threads': len(self._stream_pumps),
+        }
+
+    def enable_stats(self, enabled=True):
+
+        """
+        Starts (or stops) recording histograms on every open topic and on the
+        topics opened later, see `Topic.enable_stats'.
+
+        Parameters:
+            enabled (Boolean) Optional. False stops recording histograms (defaults to True)
+        """
+
+        self._detailed_stats = enabled
+        for topic in list(self._open_topics.values()):
+            for t in [topic] + list(topic._filtered_topics.values()):
+                t.enable_stats(enabled)
+
+    def reset_stats(self):
+
+        """
+        Clears the statistics of every open topic, see `stats'.
+        """
+
+        for topic in list(self._open_topics.values()):
+            for t in [topic] + list(topic._filtered_topics.values()):
+                t.reset_stats()
+
+    def _acquire_type_support(self, data_type):
+        # a type is registered with the participant once, by the first topic of
+        # that type, and unregistered when the last of them is deleted
+        tc = data_type._get_typecode()
+        type_name = tc.name(ex())
+        with self._type_lock:
+            entry = self._type_supports.get(type_name)
+            if entry is None:
+                support = DDSFunc.DynamicDataTypeSupport_new(tc, get('DYNAMIC_DATA_TYPE_PROPERTY_DEFAULT',
+                                                                     DDSType.DynamicDataTypeProperty_t))
+                support.register_type(self._participant, type_name)
+                entry = self._type_supports[type_name] = [support, 0]
+            entry[1] += 1
+            return entry[0], type_name
+
+    def _release_type_support(self, type_name):
+        with self._type_lock:
+            entry = self._type_supports[type_name]
+            entry[1] -= 1
+            if entry[1]:
+                return
+            del self._type_supports[type_name]
+        entry[0].unregister_type(self._participant, type_name)
+        entry[0].delete()
+
+    def _get_stream_pump(self):
+        with self._stream_lock:
+            if not self._stream_pumps:
+                self._stream_pumps.append(_StreamPump())
+            return self._stream_pumps[0]
+
     def get_topic(self, qualified_name, sep='.'):
 
         """
@@ -1336,7 +4307,7 @@ class LibraryType(object):
 
 class Library(object):
     def __init__(self, so_paths):
-        self._libs = list(map(ctypes.CDLL, so_paths))
+        self._libs = list(map(_load_library, so_paths))
 
     def __getattr__(self, attr):
         res = LibraryType(self._libs, attr)
@@ -0,0 +1,1933 @@
+"""
+Pure-Python, in-process stand-in for the parts of the RTI Connext C API
+(nddsc / nddscore) that dds.py binds through ctypes.
+
+Select it by setting the environment variable PYDDS_BACKEND=fake before
+importing dds. Topic types are described in Python and registered under
+a library name, which is then used exactly like a compiled rtiddsgen
+library:
+
+    import dds_fake as fake
+
+    fake.register_library('my_topics', [
+        fake.struct('my::dds::my_custom_topic', [
+            ('name', fake.string(), fake.KEY),
+            ('value', fake.string()),
+            ('mode', fake.enum('my::dds::my_enum', ['mode_1', 'mode_2'])),
+        ]),
+    ])
+
+    import dds
+    topic = dds.DDS('my_topics').get_topic('my.dds.my_custom_topic')
+
+A library that has not been registered yet is imported as a Python module of
+the same name, which is expected to register it, so a module `my_topics.py'
+on sys.path can stand in for `libmy_topics.so'.
+
+All participants in the same process and domain share one bus. Writes are
+delivered synchronously into reader caches and listeners are called from a
+per-domain receive thread, like the middleware's own receive threads.
+"""
+
+from __future__ import print_function
+
+import collections
+import ctypes
+import fnmatch
+import hashlib
+import importlib
+import queue
+import re
+import threading
+import time
+
+RETCODE_OK                   = 0
+RETCODE_ERROR                = 1
+RETCODE_UNSUPPORTED          = 2
+RETCODE_BAD_PARAMETER        = 3
+RETCODE_PRECONDITION_NOT_MET = 4
+RETCODE_OUT_OF_RESOURCES     = 5
+RETCODE_TIMEOUT              = 10
+RETCODE_NO_DATA              = 11
+
+EX_BAD_KIND        = 6
+EX_BOUNDS          = 7
+EX_BAD_MEMBER_NAME = 9
+
+SAMPLE_READ     = 1
+SAMPLE_NOT_READ = 2
+VIEW_NEW        = 1
+VIEW_NOT_NEW    = 2
+ALIVE                = 1
+NOT_ALIVE_DISPOSED   = 2
+NOT_ALIVE_NO_WRITERS = 4
+
+DATA_AVAILABLE_STATUS           = 1 << 10
+REQUESTED_DEADLINE_MISSED_STATUS = 1 << 2
+SAMPLE_LOST_STATUS              = 1 << 7
+SAMPLE_REJECTED_STATUS          = 1 << 8
+
+DURATION_INFINITE = 2**31 - 1
+
+KEY = 'key'
+
+# TypeCodes
+
+class _K(object):
+    NULL = 0; SHORT = 1; LONG = 2; USHORT = 3; ULONG = 4; FLOAT = 5; DOUBLE = 6
+    BOOLEAN = 7; CHAR = 8; OCTET = 9; STRUCT = 10; UNION = 11; ENUM = 12
+    STRING = 13; SEQUENCE = 14; ARRAY = 15; ALIAS = 16; LONGLONG = 17
+    ULONGLONG = 18; LONGDOUBLE = 19; WCHAR = 20; WSTRING = 21
+
+_primitive_ctypes = {
+    _K.SHORT:     ctypes.c_int16,
+    _K.LONG:      ctypes.c_int32,
+    _K.USHORT:    ctypes.c_uint16,
+    _K.ULONG:     ctypes.c_uint32,
+    _K.LONGLONG:  ctypes.c_int64,
+    _K.ULONGLONG: ctypes.c_uint64,
+    _K.FLOAT:     ctypes.c_float,
+    _K.DOUBLE:    ctypes.c_double,
+    _K.BOOLEAN:   ctypes.c_bool,
+    _K.OCTET:     ctypes.c_ubyte,
+    _K.CHAR:      ctypes.c_char,
+    _K.WCHAR:     ctypes.c_wchar,
+}
+
+_accessor_kinds = {
+    'short': _K.SHORT, 'long': _K.LONG, 'ushort': _K.USHORT, 'ulong': _K.ULONG,
+    'longlong': _K.LONGLONG, 'ulonglong': _K.ULONGLONG, 'float': _K.FLOAT,
+    'double': _K.DOUBLE, 'boolean': _K.BOOLEAN, 'octet': _K.OCTET,
+    'char': _K.CHAR, 'wchar': _K.WCHAR,
+}
+
+
+class TypeCode(object):
+    def __init__(self, kind, name=b'', members=(), content=None, length=0):
+        self.kind = kind
+        self.name = name.encode() if isinstance(name, str) else name
+        self.members = list(members)  # (name, TypeCode, is_key)
+        self.content = content
+        self.length = length
+        self._index = dict((m[0], i) for i, m in enumerate(self.members))
+
+    def find(self, name):
+        if isinstance(name, str):
+            name = name.encode()
+        return self._index.get(name)
+
+    def default(self):
+        kind = self.kind
+        if kind == _K.STRUCT:
+            return _Value(self, [m[1].default() for m in self.members])
+        if kind == _K.SEQUENCE:
+            return _Value(self, [])
+        if kind == _K.ARRAY:
+            return _Value(self, [self.content.default() for _ in range(self.length)])
+        if kind == _K.STRING:
+            return b''
+        if kind == _K.WSTRING:
+            return u''
+        if kind == _K.ENUM:
+            return 0
+        if kind == _K.CHAR:
+            return b'\x00'
+        if kind == _K.WCHAR:
+            return u'\x00'
+        if kind == _K.BOOLEAN:
+            return False
+        if kind in (_K.FLOAT, _K.DOUBLE):
+            return 0.0
+        return 0
+
+    def __repr__(self):
+        return 'TypeCode(%d, %r)' % (self.kind, self.name)
+
+
+def _primitive(kind):
+    return TypeCode(kind)
+
+SHORT     = _primitive(_K.SHORT)
+LONG      = _primitive(_K.LONG)
+USHORT    = _primitive(_K.USHORT)
+ULONG     = _primitive(_K.ULONG)
+LONGLONG  = _primitive(_K.LONGLONG)
+ULONGLONG = _primitive(_K.ULONGLONG)
+FLOAT     = _primitive(_K.FLOAT)
+DOUBLE    = _primitive(_K.DOUBLE)
+BOOLEAN   = _primitive(_K.BOOLEAN)
+OCTET     = _primitive(_K.OCTET)
+CHAR      = _primitive(_K.CHAR)
+WCHAR     = _primitive(_K.WCHAR)
+
+
+def string(bound=255):
+    return TypeCode(_K.STRING, length=bound)
+
+def wstring(bound=255):
+    return TypeCode(_K.WSTRING, length=bound)
+
+def sequence(content, bound=100):
+    return TypeCode(_K.SEQUENCE, content=content, length=bound)
+
+def array(content, length):
+    return TypeCode(_K.ARRAY, content=content, length=length)
+
+def enum(name, labels):
+    return TypeCode(_K.ENUM, name, [(l.encode() if isinstance(l, str) else l, None, False) for l in labels])
+
+def struct(name, members):
+    """
+    members is a list of (name, TypeCode) or (name, TypeCode, KEY) tuples.
+    """
+    return TypeCode(_K.STRUCT, name, [
+        (m[0].encode() if isinstance(m[0], str) else m[0], m[1], len(m) > 2 and m[2] == KEY)
+        for m in members
+    ])
+
+
+class _Value(object):
+    __slots__ = ('tc', 'items')
+
+    def __init__(self, tc, items):
+        self.tc = tc
+        self.items = items
+
+    def copy(self):
+        return _Value(self.tc, [x.copy() if isinstance(x, _Value) else x for x in self.items])
+
+    def index(self, name, member_id):
+        tc = self.tc
+        if tc.kind == _K.STRUCT:
+            i = tc.find(name) if name else (member_id - 1 if member_id else None)
+            if i is None or not 0 <= i < len(tc.members):
+                raise _Ret(RETCODE_BAD_PARAMETER)
+            return i, tc.members[i][1]
+        if name or member_id < 1:
+            raise _Ret(RETCODE_BAD_PARAMETER)
+        i = member_id - 1
+        if tc.kind == _K.ARRAY:
+            if i >= tc.length:
+                raise _Ret(RETCODE_BAD_PARAMETER)
+        elif i >= len(self.items):
+            if tc.length and i >= tc.length:
+                raise _Ret(RETCODE_OUT_OF_RESOURCES)
+            self.items.extend(tc.content.default() for _ in range(i + 1 - len(self.items)))
+        return i, tc.content
+
+    def peek(self, name, member_id):
+        # like index() but never grows a sequence
+        if self.tc.kind == _K.SEQUENCE and not name and member_id > len(self.items):
+            raise _Ret(RETCODE_NO_DATA)
+        return self.index(name, member_id)
+
+    def field(self, path):
+        value, tc = self, self.tc
+        for part in path:
+            i = value.tc.find(part)
+            if i is None:
+                raise KeyError(part)
+            tc = value.tc.members[i][1]
+            value = value.items[i]
+        if tc.kind == _K.ENUM:
+            return tc.members[value][0].decode()
+        if isinstance(value, bytes):
+            return value.decode()
+        return value
+
+    def key(self):
+        tc = self.tc
+        if tc.kind != _K.STRUCT:
+            return ()
+        return tuple(_freeze(v) for (name, mtc, is_key), v in zip(tc.members, self.items) if is_key)
+
+
+def _freeze(v):
+    if isinstance(v, _Value):
+        return tuple(_freeze(x) for x in v.items)
+    return v
+
+
+class _Ret(Exception):
+    def __init__(self, code):
+        self.code = code
+
+# Handles: every entity is handed out as a pointer to a small native buffer so
+# that it behaves like a real C object (identity, casts, NULL checks).
+
+_registry = {}
+_CArgObject = type(ctypes.byref(ctypes.c_int()))
+
+
+def _address(x):
+    if x is None:
+        return None
+    if isinstance(x, _CArgObject):
+        return ctypes.addressof(x._obj)
+    if isinstance(x, (ctypes._Pointer, ctypes.c_void_p)):
+        return ctypes.cast(x, ctypes.c_void_p).value
+    if isinstance(x, int):
+        return x
+    return ctypes.addressof(x)
+
+
+def _deref(x):
+    if isinstance(x, _CArgObject):
+        return x._obj
+    if isinstance(x, ctypes._Pointer):
+        return x.contents
+    return x
+
+
+def _lookup(x):
+    addr = _address(x)
+    if not addr:
+        return None
+    entry = _registry.get(addr)
+    return entry[1] if entry is not None else None
+
+
+class _Entity(object):
+    _holder = None
+
+    def address(self, ctype=None):
+        if self._holder is None:
+            if ctype is not None and ctypes.sizeof(ctype) >= ctypes.sizeof(ctypes.c_void_p):
+                holder = ctype()
+                for field in getattr(ctype, '_fields_', ()):
+                    if field[0] == '_as_TopicDescription':
+                        setattr(holder, field[0], ctypes.cast(ctypes.addressof(holder), field[1]))
+            else:
+                holder = ctypes.create_string_buffer(16)
+            self._holder = holder
+            _registry[ctypes.addressof(holder)] = (holder, self)
+        return ctypes.addressof(self._holder)
+
+    def pointer(self, restype):
+        return ctypes.cast(ctypes.c_void_p(self.address(restype._type_)), restype)
+
+    def release(self):
+        if self._holder is not None:
+            _registry.pop(ctypes.addressof(self._holder), None)
+
+
+class _TypeCodeEntity(_Entity):
+    _by_tc = {}
+
+    def __init__(self, tc):
+        self.tc = tc
+
+    @classmethod
+    def of(cls, tc):
+        entity = cls._by_tc.get(id(tc))
+        if entity is None:
+            entity = cls._by_tc[id(tc)] = cls(tc)
+            entity._keep = tc
+        return entity
+
+
+def _tc(x):
+    entity = _lookup(x)
+    return entity.tc if entity is not None else None
+
+# Function objects. dds.py sets errcheck/restype/argtypes on these exactly as
+# it would on a ctypes foreign function.
+
+class _Function(object):
+    def __init__(self, name, impl):
+        self.__name__ = name
+        self._impl = impl
+        self._typed = getattr(impl, '_typed', False)
+        self.errcheck = None
+        self.restype = ctypes.c_int
+        self.argtypes = None
+
+    def __call__(self, *args):
+        # like a C function, surplus arguments are ignored by the callee
+        impl_args = args if self.argtypes is None else args[:len(self.argtypes)]
+        if self._typed:
+            result = self._impl(self.restype, *impl_args)
+        else:
+            result = self._impl(*impl_args)
+        if isinstance(result, _Entity):
+            result = result.pointer(self.restype)
+        elif result is None and isinstance(self.restype, type) and issubclass(self.restype, ctypes._Pointer):
+            result = self.restype()
+        if self.errcheck is not None:
+            return self.errcheck(result, self, args)
+        return result
+
+
+def _typed(f):
+    f._typed = True
+    return f
+
+
+def _retcode(f):
+    def wrapper(*args):
+        try:
+            result = f(*args)
+        except _Ret as e:
+            return e.code
+        return RETCODE_OK if result is None else result
+    wrapper.__name__ = f.__name__
+    return wrapper
+
+
+def _exc(f):
+    # TypeCode functions report errors through their trailing ex argument
+    def wrapper(*args):
+        try:
+            return f(*args[:-1])
+        except _Ret as e:
+            _deref(args[-1]).value = e.code
+    wrapper.__name__ = f.__name__
+    return wrapper
+
+
+_api = {}
+
+def _export(name):
+    def register(f):
+        _api[name] = f
+        return f
+    return register
+
+# Global bus state
+
+_lock = threading.RLock()
+_changed = threading.Condition(_lock)
+_domains = {}
+_string_seqs = {}
+_loans = {}
+
+
+class _Domain(object):
+    def __init__(self, domain_id):
+        self.domain_id = domain_id
+        self.participants = []
+        self.writers = []
+        self.readers = []
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._idle = threading.Condition(threading.Lock())
+        self._pending = 0
+
+    def start(self):
+        # never called with the bus lock held: the garbage collector may run
+        # in the new thread before start() returns, and the finalizers of dds
+        # topics delete entities, which takes the bus lock
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='fake-dds-receive-%d' % self.domain_id)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def notify(self, reader, status, *args):
+        with self._idle:
+            self._pending += 1
+        self._queue.put((reader, status, args))
+
+    def _run(self):
+        while True:
+            reader, status, args = self._queue.get()
+            try:
+                reader.call_listener(status, *args)
+            finally:
+                with self._idle:
+                    self._pending -= 1
+                    self._idle.notify_all()
+
+    def drain(self, timeout):
+        deadline = time.time() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+
+def _domain(domain_id):
+    with _lock:
+        if domain_id not in _domains:
+            _domains[domain_id] = _Domain(domain_id)
+        domain = _domains[domain_id]
+    domain.start()
+    return domain
+
+
+def drain(timeout=5.0):
+    """
+    Waits until every listener callback queued so far has returned.
+    """
+    deadline = time.time() + timeout
+    for domain in list(_domains.values()):
+        if not domain.drain(max(0, deadline - time.time())):
+            return False
+    return True
+
+# Type libraries
+
+_libraries = {}
+
+def register_library(name, typecodes):
+    """
+    Makes the given struct TypeCodes loadable as if they were compiled into
+    a topic library called `name' (e.g. `dds.DDS(name)').
+    """
+    _libraries[name] = dict((tc.name.decode().replace('::', '_'), tc) for tc in typecodes)
+
+
+class _TypeLibrary(object):
+    def __init__(self, types):
+        self._types = types
+
+    def __getattr__(self, attr):
+        if attr.endswith('_get_typecode') and attr[:-len('_get_typecode')] in self._types:
+            tc = self._types[attr[:-len('_get_typecode')]]
+            f = _Function(attr, lambda: _TypeCodeEntity.of(tc))
+            setattr(self, attr, f)
+            return f
+        raise AttributeError(attr)
+
+
+def _library_name(path):
+    name = path.rsplit('/', 1)[-1]
+    for suffix in ('.so', '.dylib', '.dll'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    if name not in _libraries and name.startswith('lib'):
+        name = name[3:]
+    return name
+
+
+def load_library(path, mode=0):
+    name = _library_name(path)
+    if name in ('nddsc', 'nddscore'):
+        return _lib
+    if name not in _libraries:
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            if e.name != name:
+                raise
+    if name not in _libraries:
+        raise OSError('%s: no such fake topic library' % path)
+    return _TypeLibrary(_libraries[name])
+
+# Constants exported as symbols
+
+_constants = {}
+
+def _constant(name, value):
+    _constants[name] = value
+
+for _name in ('ANY_SAMPLE_STATE', 'ANY_VIEW_STATE', 'ANY_INSTANCE_STATE'):
+    _constant(_name, ctypes.c_uint32(0xffff))
+_constant('NOT_READ_SAMPLE_STATE', ctypes.c_uint32(SAMPLE_NOT_READ))
+_constant('READ_SAMPLE_STATE', ctypes.c_uint32(SAMPLE_READ))
+_constant('ALIVE_INSTANCE_STATE', ctypes.c_uint32(ALIVE))
+for _name in ('PARTICIPANT_QOS_DEFAULT', 'PUBLISHER_QOS_DEFAULT', 'SUBSCRIBER_QOS_DEFAULT',
+              'TOPIC_QOS_DEFAULT', 'DATAWRITER_QOS_DEFAULT', 'DATAREADER_QOS_DEFAULT',
+              'DYNAMIC_DATA_PROPERTY_DEFAULT', 'DYNAMIC_DATA_TYPE_PROPERTY_DEFAULT',
+              'DATAWRITER_QOS_USE_TOPIC_QOS', 'DATAREADER_QOS_USE_TOPIC_QOS'):
+    _constant(_name, (ctypes.c_char * 64)())
+
+
+def _unsupported(name):
+    def call(*args):
+        raise NotImplementedError('%s is not implemented by the fake backend' % name)
+    return call
+
+
+class _Library(object):
+    def __getattr__(self, attr):
+        if not attr.startswith('DDS_'):
+            raise AttributeError(attr)
+        name = attr[4:]
+        if name in _constants:
+            result = ctypes.pointer(_constants[name])
+        elif name in _api:
+            result = _Function(attr, _api[name])
+        else:
+            result = _Function(attr, _unsupported(attr))
+        setattr(self, attr, result)
+        return result
+
+_lib = _Library()
+
+# Entities
+
+class _Factory(_Entity):
+    pass
+
+_factory = _Factory()
+
+
+class _Participant(_Entity):
+    def __init__(self, domain_id):
+        self.domain = _domain(domain_id)
+        self.types = {}
+        self.topics = {}
+        self.builtin_subscriber = _Subscriber(self, builtin=True)
+        self.publication_reader = _BuiltinReader(self)
+        self.builtin_subscriber.readers.append(self.publication_reader)
+        for writer in self.domain.writers:
+            self.publication_reader.discover(writer)
+
+
+class _Publisher(_Entity):
+    def __init__(self, participant):
+        self.participant = participant
+        self.writers = []
+
+
+class _Subscriber(_Entity):
+    def __init__(self, participant, builtin=False):
+        self.participant = participant
+        self.builtin = builtin
+        self.readers = []
+
+
+class _TopicEntity(_Entity):
+    def __init__(self, participant, name, type_name):
+        self.participant = participant
+        self.name = name
+        self.type_name = type_name
+        self.filter = None
+
+    @property
+    def topic(self):
+        return self
+
+
+class _ContentFilteredTopic(_Entity):
+    def __init__(self, participant, name, related, expression, parameters):
+        self.participant = participant
+        self.name = name
+        self.related = related
+        self.type_name = related.type_name
+        self.expression = expression
+        self.parameters = list(parameters)
+        self.filter = _Filter(expression)
+
+    @property
+    def topic(self):
+        return self.related
+
+    def matches(self, value):
+        return self.filter.evaluate(value, self.parameters)
+
+
+class _Condition(_Entity):
+    def triggered(self):
+        return False
+
+
+class _StatusCondition(_Condition):
+    def __init__(self, entity):
+        self.entity = entity
+        self.enabled = 0
+
+    def triggered(self):
+        return bool(self.entity.status_changes & self.enabled)
+
+
+class _ReadCondition(_Condition):
+    def __init__(self, reader, sample_states):
+        self.reader = reader
+        self.sample_states = sample_states
+
+    def triggered(self):
+        return any((SAMPLE_READ if s['read'] else SAMPLE_NOT_READ) & self.sample_states for s in self.reader.samples)
+
+
+class _GuardCondition(_Condition):
+    def __init__(self):
+        self.value = False
+
+    def triggered(self):
+        return self.value
+
+
+class _WaitSet(_Entity):
+    def __init__(self):
+        self.conditions = []
+
+
+class _Writer(_Entity):
+    def __init__(self, publisher, topic, profile=None):
+        self.publisher = publisher
+        self.topic = topic
+        self.profile = profile
+        self.domain = publisher.participant.domain
+        self.instances = {}
+        self.status_changes = 0
+        self.condition = None
+
+    def matched_readers(self):
+        return [r for r in self.domain.readers if r.topic.topic.name == self.topic.name]
+
+    def deliver(self, value, handle, instance_state, valid_data):
+        now = time.time()
+        for reader in self.matched_readers():
+            reader.receive(self, value, handle, instance_state, valid_data, now)
+
+
+class _Reader(_Entity):
+    def __init__(self, subscriber, topic, listener, mask, profile=None):
+        self.subscriber = subscriber
+        self.topic = topic
+        self.profile = profile
+        self.domain = subscriber.participant.domain
+        self.listener = listener
+        self.mask = mask
+        self.samples = collections.deque()
+        self.instances = {}
+        self.status_changes = 0
+        self.condition = None
+        self.read_conditions = []
+        self.max_samples = None
+        self.statuses = {
+            SAMPLE_LOST_STATUS: [0, 0, 0],
+            SAMPLE_REJECTED_STATUS: [0, 0, 0],
+            REQUESTED_DEADLINE_MISSED_STATUS: [0, 0, 0],
+        }
+
+    def receive(self, writer, value, handle, instance_state, valid_data, now):
+        if valid_data and self.topic.filter is not None and not self.topic.matches(value):
+            return
+        if self.max_samples is not None and len(self.samples) >= self.max_samples:
+            self.raise_status(SAMPLE_REJECTED_STATUS, 2)
+            return
+        instance = self.instances.get(handle)
+        if instance is None:
+            instance = self.instances[handle] = {'key': value.copy(), 'state': ALIVE, 'new': True, 'writers': set()}
+        elif valid_data:
+            instance['key'] = value.copy()
+        instance['state'] = instance_state
+        if instance_state == ALIVE:
+            instance['writers'].add(writer)
+        else:
+            instance['writers'].discard(writer)
+        self.samples.append({
+            'value': value.copy() if valid_data else value.tc.default(),
+            'handle': handle,
+            'view_state': VIEW_NEW if instance['new'] else VIEW_NOT_NEW,
+            'valid_data': valid_data,
+            'source_timestamp': now,
+            'reception_timestamp': time.time(),
+            'read': False,
+        })
+        instance['new'] = False
+        self.status_changes |= DATA_AVAILABLE_STATUS
+        _changed.notify_all()
+        if self.listener is not None and self.mask & DATA_AVAILABLE_STATUS:
+            self.domain.notify(self, DATA_AVAILABLE_STATUS)
+
+    def raise_status(self, status, reason=0, handle=None):
+        counters = self.statuses[status]
+        counters[0] += 1
+        counters[1] += 1
+        counters[2] = reason
+        self.status_changes |= status
+        _changed.notify_all()
+        if self.listener is not None and self.mask & status:
+            self.domain.notify(self, status)
+
+    def call_listener(self, status, *args):
+        listener = self.listener
+        if listener is None or not self.mask & status:
+            return
+        reader = self.pointer(self._reader_type)
+        if status == DATA_AVAILABLE_STATUS:
+            if listener.on_data_available:
+                listener.on_data_available(None, reader)
+            return
+        field, status_type = _status_listeners[status]
+        callback = getattr(listener, field)
+        if callback:
+            struct = _status_struct(status_type, self.take_status(status))
+            callback(None, reader, ctypes.pointer(struct))
+
+    def take_status(self, status):
+        counters = self.statuses[status]
+        result = list(counters)
+        counters[1] = 0
+        self.status_changes &= ~status
+        return result
+
+
+_status_listeners = {
+    SAMPLE_LOST_STATUS:               ('on_sample_lost', 'SampleLostStatus'),
+    SAMPLE_REJECTED_STATUS:           ('on_sample_rejected', 'SampleRejectedStatus'),
+    REQUESTED_DEADLINE_MISSED_STATUS: ('on_requested_deadline_missed', 'RequestedDeadlineMissedStatus'),
+}
+
+
+def _status_struct(type_name, counters):
+    import sys
+    status_type = getattr(sys.modules['dds'].DDSType, type_name)
+    struct = status_type()
+    names = [f[0] for f in status_type._fields_]
+    struct.total_count = counters[0]
+    struct.total_count_change = counters[1]
+    if 'last_reason' in names:
+        struct.last_reason = counters[2]
+    return struct
+
+
+class _BuiltinReader(_Entity):
+    def __init__(self, participant):
+        self.participant = participant
+        self.samples = collections.deque()
+        self.status_changes = 0
+        self.condition = None
+
+    def discover(self, writer):
+        with _lock:
+            self.samples.append({
+                'topic_name': writer.topic.name,
+                'type_name': writer.topic.type_name,
+            })
+            self.status_changes |= DATA_AVAILABLE_STATUS
+            _changed.notify_all()
+
+
+class _DynamicDataTypeSupport(_Entity):
+    def __init__(self, tc):
+        self.tc = tc
+
+
+class _DynamicData(_Entity):
+    def __init__(self, tc, value=None):
+        self.tc = tc
+        self.value = value if value is not None or tc is None else tc.default()
+        self.bound = None
+
+# Filters
+
+_filter_token = re.compile(r"\s*(?:(\d+\.\d*|\.\d+|\d+)|('(?:[^']*)')|(%\d+)|(<>|!=|<=|>=|=|<|>)|([(),])|([A-Za-z_][\w.]*))")
+
+
+class _Filter(object):
+    def __init__(self, expression):
+        if isinstance(expression, bytes):
+            expression = expression.decode()
+        self.expression = expression
+        self.tokens = self._tokenize(expression)
+        self.pos = 0
+        self.tree = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError('bad filter expression: %r' % expression)
+
+    def _tokenize(self, expression):
+        tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            m = _filter_token.match(expression, pos)
+            if not m:
+                raise ValueError('bad filter expression: %r' % expression)
+            pos = m.end()
+            number, text, param, op, punct, ident = m.groups()
+            if number is not None:
+                tokens.append(('lit', float(number) if '.' in number else int(number)))
+            elif text is not None:
+                tokens.append(('lit', text[1:-1]))
+            elif param is not None:
+                tokens.append(('param', int(param[1:])))
+            elif op is not None:
+                tokens.append(('op', op))
+            elif punct is not None:
+                tokens.append(('punct', punct))
+            elif ident.upper() in ('AND', 'OR', 'NOT', 'MATCH', 'LIKE'):
+                tokens.append(('kw', ident.upper()))
+            else:
+                tokens.append(('field', ident))
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def _or(self):
+        node = self._and()
+        while self._peek() == ('kw', 'OR'):
+            self._next()
+            node = ('or', node, self._and())
+        return node
+
+    def _and(self):
+        node = self._not()
+        while self._peek() == ('kw', 'AND'):
+            self._next()
+            node = ('and', node, self._not())
+        return node
+
+    def _not(self):
+        if self._peek() == ('kw', 'NOT'):
+            self._next()
+            return ('not', self._not())
+        if self._peek() == ('punct', '('):
+            self._next()
+            node = self._or()
+            if self._next() != ('punct', ')'):
+                raise ValueError('bad filter expression: %r' % self.expression)
+            return node
+        left = self._operand()
+        kind, op = self._next()
+        if kind not in ('op', 'kw') or op in ('AND', 'OR', 'NOT'):
+            raise ValueError('bad filter expression: %r' % self.expression)
+        return ('cmp', op, left, self._operand())
+
+    def _operand(self):
+        kind, value = self._next()
+        if kind not in ('lit', 'param', 'field'):
+            raise ValueError('bad filter expression: %r' % self.expression)
+        return (kind, value)
+
+    def evaluate(self, value, parameters):
+        return self._eval(self.tree, value, parameters)
+
+    def _operand_value(self, operand, value, parameters):
+        kind, x = operand
+        if kind == 'field':
+            return value.field(x.split('.'))
+        if kind == 'param':
+            param = parameters[x]
+            param = param.decode() if isinstance(param, bytes) else param
+            if len(param) > 1 and param[0] == param[-1] == "'":
+                return param[1:-1]
+            try:
+                return int(param)
+            except ValueError:
+                try:
+                    return float(param)
+                except ValueError:
+                    return param
+        return x
+
+    def _eval(self, node, value, parameters):
+        if node[0] == 'or':
+            return self._eval(node[1], value, parameters) or self._eval(node[2], value, parameters)
+        if node[0] == 'and':
+            return self._eval(node[1], value, parameters) and self._eval(node[2], value, parameters)
+        if node[0] == 'not':
+            return not self._eval(node[1], value, parameters)
+        op = node[1]
+        left = self._operand_value(node[2], value, parameters)
+        right = self._operand_value(node[3], value, parameters)
+        if op in ('MATCH', 'LIKE'):
+            pattern = str(right).replace('%', '*').replace('_', '?') if op == 'LIKE' else str(right)
+            return any(fnmatch.fnmatchcase(str(left), p.strip()) for p in pattern.split(','))
+        if isinstance(left, str) != isinstance(right, str):
+            left, right = str(left), str(right)
+        return {
+            '=': left == right, '<>': left != right, '!=': left != right,
+            '<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right,
+        }[op]
+
+# Helpers for the C API
+
+def _name(x):
+    if x is None:
+        return None
+    return x.encode() if isinstance(x, str) else x
+
+
+def _text(x):
+    return x.decode() if isinstance(x, bytes) else x
+
+
+def _set_length(seq, items):
+    seq = _deref(seq)
+    seq._length = len(items)
+    seq._maximum = max(seq._maximum, len(items))
+
+
+def _now_parts(t):
+    sec = int(t)
+    return sec, int((t - sec) * 1e9)
+
+
+def _instance_hash(tc, key):
+    h = ctypes.c_byte * 16
+    digest = hashlib.md5(repr((tc.name, key)).encode()).digest()
+    return h(*[b - 256 if b > 127 else b for b in digest])
+
+
+def _handle_bytes(handle):
+    handle = _deref(handle)
+    if handle is None or not handle.isValid:
+        return None
+    return bytes(bytearray(b & 0xff for b in handle.keyHash_value))
+
+
+def _string_seq(seq):
+    return _string_seqs.get(_address(seq), [])
+
+# DomainParticipantFactory
+
+@_export('DomainParticipantFactory_get_instance')
+def _factory_get_instance():
+    return _factory
+
+@_export('DomainParticipantFactory_set_default_participant_qos_with_profile')
+@_retcode
+def _factory_set_default_qos(factory, library, profile):
+    _factory.profile = (library, profile)
+
+@_export('DomainParticipantFactory_reload_profiles')
+@_retcode
+def _factory_reload_profiles(factory):
+    pass
+
+@_export('DomainParticipantFactory_create_participant')
+def _create_participant(factory, domain_id, qos, listener, mask):
+    participant = _Participant(domain_id)
+    with _lock:
+        participant.domain.participants.append(participant)
+    return participant
+
+@_export('DomainParticipantFactory_create_participant_with_profile')
+def _create_participant_with_profile(factory, domain_id, library, profile, listener, mask):
+    return _create_participant(factory, domain_id, None, listener, mask)
+
+@_export('DomainParticipantFactory_delete_participant')
+@_retcode
+def _delete_participant(factory, participant):
+    participant = _lookup(participant)
+    with _lock:
+        if participant in participant.domain.participants:
+            participant.domain.participants.remove(participant)
+    participant.release()
+
+@_export('DomainParticipant_set_default_library')
+@_retcode
+def _participant_set_default_library(participant, library):
+    pass
+
+@_export('DomainParticipant_set_default_profile')
+@_retcode
+def _participant_set_default_profile(participant, library, profile):
+    pass
+
+@_export('Entity_enable')
+@_retcode
+def _entity_enable(entity):
+    pass
+
+# DomainParticipant
+
+@_export('DomainParticipant_create_publisher')
+def _create_publisher(participant, qos, listener, mask):
+    return _Publisher(_lookup(participant))
+
+@_export('DomainParticipant_create_publisher_with_profile')
+def _create_publisher_with_profile(participant, library, profile, listener, mask):
+    return _Publisher(_lookup(participant))
+
+@_export('DomainParticipant_delete_publisher')
+@_retcode
+def _delete_publisher(participant, publisher):
+    publisher = _lookup(publisher)
+    if publisher.writers:
+        raise _Ret(RETCODE_PRECONDITION_NOT_MET)
+    publisher.release()
+
+@_export('DomainParticipant_create_subscriber')
+def _create_subscriber(participant, qos, listener, mask):
+    return _Subscriber(_lookup(participant))
+
+@_export('DomainParticipant_create_subscriber_with_profile')
+def _create_subscriber_with_profile(participant, library, profile, listener, mask):
+    return _Subscriber(_lookup(participant))
+
+@_export('DomainParticipant_delete_subscriber')
+@_retcode
+def _delete_subscriber(participant, subscriber):
+    subscriber = _lookup(subscriber)
+    if subscriber.readers:
+        raise _Ret(RETCODE_PRECONDITION_NOT_MET)
+    subscriber.release()
+
+@_export('DomainParticipant_create_topic')
+def _create_topic(participant, name, type_name, qos, listener, mask):
+    participant = _lookup(participant)
+    name, type_name = _name(name), _name(type_name)
+    if type_name not in participant.types:
+        return None
+    if name in participant.topics:
+        return None
+    topic = participant.topics[name] = _TopicEntity(participant, name, type_name)
+    return topic
+
+@_export('DomainParticipant_create_topic_with_profile')
+def _create_topic_with_profile(participant, name, type_name, library, profile, listener, mask):
+    return _create_topic(participant, name, type_name, None, listener, mask)
+
+@_export('DomainParticipant_delete_topic')
+@_retcode
+def _delete_topic(participant, topic):
+    participant, topic = _lookup(participant), _lookup(topic)
+    participant.topics.pop(topic.name, None)
+    topic.release()
+
+@_export('DomainParticipant_create_contentfilteredtopic')
+def _create_contentfilteredtopic(participant, name, related, expression, parameters):
+    participant = _lookup(participant)
+    try:
+        return _ContentFilteredTopic(participant, _name(name), _lookup(related), expression, _string_seq(parameters))
+    except ValueError:
+        return None
+
+@_export('DomainParticipant_delete_contentfilteredtopic')
+@_retcode
+def _delete_contentfilteredtopic(participant, topic):
+    _lookup(topic).release()
+
+@_export('DomainParticipant_get_builtin_subscriber')
+def _get_builtin_subscriber(participant):
+    return _lookup(participant).builtin_subscriber
+
+@_export('ContentFilteredTopic_set_expression_parameters')
+@_retcode
+def _cft_set_expression_parameters(topic, parameters):
+    with _lock:
+        topic = _lookup(topic)
+        params = _string_seq(parameters)
+        if len(params) < max([t[1] + 1 for t in topic.filter.tokens if t[0] == 'param'] or [0]):
+            raise _Ret(RETCODE_BAD_PARAMETER)
+        topic.parameters = list(params)
+
+@_export('ContentFilteredTopic_get_expression_parameters')
+@_retcode
+def _cft_get_expression_parameters(topic, parameters):
+    _string_seqs[_address(parameters)] = list(_lookup(topic).parameters)
+    _set_length(parameters, _lookup(topic).parameters)
+
+# Publisher / Subscriber
+
+def _create_writer(publisher, topic, profile):
+    publisher = _lookup(publisher)
+    topic = _lookup(topic)
+    writer = _Writer(publisher, topic, profile)
+    with _lock:
+        publisher.writers.append(writer)
+        writer.domain.writers.append(writer)
+        for participant in writer.domain.participants:
+            participant.publication_reader.discover(writer)
+    return writer
+
+@_export('Publisher_create_datawriter')
+def _publisher_create_datawriter(publisher, topic, qos, listener, mask):
+    return _create_writer(publisher, topic, None)
+
+@_export('Publisher_create_datawriter_with_profile')
+def _publisher_create_datawriter_with_profile(publisher, topic, library, profile, listener, mask):
+    return _create_writer(publisher, topic, (_name(library), _name(profile)))
+
+@_export('Publisher_delete_datawriter')
+@_retcode
+def _publisher_delete_datawriter(publisher, writer):
+    publisher, writer = _lookup(publisher), _lookup(writer)
+    with _lock:
+        for handle, key in list(writer.instances.items()):
+            _unregister(writer, key, handle)
+        publisher.writers.remove(writer)
+        writer.domain.writers.remove(writer)
+    writer.release()
+
+
+def _create_reader(subscriber, topic, listener, mask, profile):
+    subscriber = _lookup(subscriber)
+    reader = _Reader(subscriber, _lookup(topic), listener, mask, profile)
+    reader._reader_type = None
+    with _lock:
+        subscriber.readers.append(reader)
+        reader.domain.readers.append(reader)
+    return reader
+
+@_export('Subscriber_create_datareader')
+@_typed
+def _subscriber_create_datareader(restype, subscriber, topic, qos, listener, mask):
+    reader = _create_reader(subscriber, topic, _deref(listener) if listener else None, mask, None)
+    reader._reader_type = restype
+    return reader
+
+@_export('Subscriber_create_datareader_with_profile')
+@_typed
+def _subscriber_create_datareader_with_profile(restype, subscriber, topic, library, profile, listener, mask):
+    reader = _create_reader(subscriber, topic, _deref(listener) if listener else None, mask, (_name(library), _name(profile)))
+    reader._reader_type = restype
+    return reader
+
+@_export('Subscriber_delete_datareader')
+@_retcode
+def _subscriber_delete_datareader(subscriber, reader):
+    subscriber, reader = _lookup(subscriber), _lookup(reader)
+    with _lock:
+        if reader.read_conditions:
+            raise _Ret(RETCODE_PRECONDITION_NOT_MET)
+        subscriber.readers.remove(reader)
+        reader.domain.readers.remove(reader)
+        reader.listener = None
+    reader.release()
+
+@_export('Subscriber_lookup_datareader')
+def _subscriber_lookup_datareader(subscriber, topic_name):
+    subscriber = _lookup(subscriber)
+    if subscriber.builtin and _name(topic_name) == b'DCPSPublication':
+        return subscriber.participant.publication_reader
+    for reader in subscriber.readers:
+        if reader.topic.name == _name(topic_name):
+            return reader
+    return None
+
+@_export('DataReader_set_listener')
+@_retcode
+def _datareader_set_listener(reader, listener, mask):
+    reader = _lookup(reader)
+    with _lock:
+        reader.listener = _deref(listener) if listener else None
+        reader.mask = mask if listener else 0
+
+
+def _get_status(status):
+    @_retcode
+    def get(reader, out):
+        with _lock:
+            counters = _lookup(reader).take_status(status)
+        out = _deref(out)
+        out.total_count = counters[0]
+        out.total_count_change = counters[1]
+        if 'last_reason' in [f[0] for f in type(out)._fields_]:
+            out.last_reason = counters[2]
+    return get
+
+_api['DataReader_get_sample_lost_status'] = _get_status(SAMPLE_LOST_STATUS)
+_api['DataReader_get_sample_rejected_status'] = _get_status(SAMPLE_REJECTED_STATUS)
+_api['DataReader_get_requested_deadline_missed_status'] = _get_status(REQUESTED_DEADLINE_MISSED_STATUS)
+
+# DynamicDataTypeSupport / DynamicData
+
+@_export('DynamicDataTypeSupport_new')
+def _typesupport_new(tc, props):
+    return _DynamicDataTypeSupport(_tc(tc))
+
+@_export('DynamicDataTypeSupport_delete')
+def _typesupport_delete(support):
+    _lookup(support).release()
+
+@_export('DynamicDataTypeSupport_register_type')
+@_retcode
+def _typesupport_register_type(support, participant, type_name):
+    support, participant = _lookup(support), _lookup(participant)
+    registered = participant.types.get(_name(type_name))
+    if registered is not None and registered[0] is not support.tc:
+        raise _Ret(RETCODE_PRECONDITION_NOT_MET)
+    participant.types[_name(type_name)] = (support.tc, (registered[1] if registered else 0) + 1)
+
+@_export('DynamicDataTypeSupport_unregister_type')
+@_retcode
+def _typesupport_unregister_type(support, participant, type_name):
+    participant = _lookup(participant)
+    tc, count = participant.types.get(_name(type_name), (None, 0))
+    if not count:
+        raise _Ret(RETCODE_BAD_PARAMETER)
+    if count == 1:
+        del participant.types[_name(type_name)]
+    else:
+        participant.types[_name(type_name)] = (tc, count - 1)
+
+@_export('DynamicDataTypeSupport_create_data')
+def _typesupport_create_data(support):
+    return _DynamicData(_lookup(support).tc)
+
+@_export('DynamicDataTypeSupport_delete_data')
+@_retcode
+def _typesupport_delete_data(support, data):
+    _lookup(data).release()
+
+@_export('DynamicDataTypeSupport_print_data')
+def _typesupport_print_data(support, data):
+    print(_lookup(data).value)
+
+@_export('DynamicData_new')
+def _dynamicdata_new(tc, props):
+    return _DynamicData(_tc(tc))
+
+@_export('DynamicData_delete')
+def _dynamicdata_delete(data):
+    _lookup(data).release()
+
+@_export('DynamicData_copy')
+@_retcode
+def _dynamicdata_copy(dst, src):
+    dst, src = _lookup(dst), _lookup(src)
+    if dst.tc is not src.tc:
+        raise _Ret(RETCODE_BAD_PARAMETER)
+    dst.value.items[:] = src.value.copy().items
+
+@_export('DynamicData_clear_all_members')
+@_retcode
+def _dynamicdata_clear_all_members(data):
+    data = _lookup(data)
+    data.value.items[:] = data.tc.default().items
+
+@_export('DynamicData_get_member_count')
+def _dynamicdata_get_member_count(data):
+    return len(_lookup(data).value.items)
+
+@_export('DynamicData_get_type')
+def _dynamicdata_get_type(data):
+    return _TypeCodeEntity.of(_lookup(data).tc)
+
+@_export('DynamicData_get_type_kind')
+def _dynamicdata_get_type_kind(data):
+    return _lookup(data).tc.kind
+
+@_export('DynamicData_get_member_type')
+@_retcode
+def _dynamicdata_get_member_type(data, out, name, member_id):
+    value = _lookup(data).value
+    i, tc = value.index(_name(name), member_id) if value.tc.kind == _K.STRUCT else (None, value.tc.content)
+    ctypes.c_void_p.from_address(ctypes.addressof(_deref(out))).value = _TypeCodeEntity.of(tc).address()
+
+@_export('DynamicData_bind_complex_member')
+@_retcode
+def _dynamicdata_bind_complex_member(data, inner, name, member_id):
+    data, inner = _lookup(data), _lookup(inner)
+    i, tc = data.value.index(_name(name), member_id)
+    child = data.value.items[i]
+    if not isinstance(child, _Value):
+        raise _Ret(RETCODE_BAD_PARAMETER)
+    inner.tc, inner.value, inner.parent = tc, child, data
+    data.bound = inner
+
+@_export('DynamicData_unbind_complex_member')
+@_retcode
+def _dynamicdata_unbind_complex_member(data, inner):
+    data, inner = _lookup(data), _lookup(inner)
+    if data.bound is not inner:
+        raise _Ret(RETCODE_PRECONDITION_NOT_MET)
+    inner.tc, inner.value, inner.parent = None, None, None
+    data.bound = None
+
+
+def _check_kind(tc, kind, getter):
+    if tc.kind == kind:
+        return
+    if tc.kind == _K.ENUM and kind in (_K.ULONG, _K.LONG):
+        return
+    raise _Ret(RETCODE_BAD_PARAMETER)
+
+
+def _getter(func_name, kind):
+    @_retcode
+    def get(data, out, name, member_id):
+        value = _lookup(data).value
+        i, tc = value.peek(_name(name), member_id)
+        _check_kind(tc, kind, True)
+        _deref(out).value = value.items[i]
+    get.__name__ = 'DynamicData_get_' + func_name
+    return get
+
+
+def _setter(func_name, kind, ctype):
+    @_retcode
+    def set(data, name, member_id, x):
+        value = _lookup(data).value
+        i, tc = value.index(_name(name), member_id)
+        _check_kind(tc, kind, False)
+        if tc.kind == _K.ENUM and not 0 <= x < len(tc.members):
+            raise _Ret(RETCODE_BAD_PARAMETER)
+        if isinstance(x, ctypes._SimpleCData):
+            x = x.value
+        value.items[i] = ctype(x).value
+    set.__name__ = 'DynamicData_set_' + func_name
+    return set
+
+
+def _array_getter(func_name, kind):
+    @_retcode
+    def get(data, out, length, name, member_id):
+        value = _lookup(data).value
+        i, tc = value.peek(_name(name), member_id)
+        if tc.kind not in (_K.SEQUENCE, _K.ARRAY) or tc.content.kind != kind:
+            raise _Ret(RETCODE_BAD_PARAMETER)
+        items = value.items[i].items
+        length = _deref(length)
+        if length.value < len(items):
+            raise _Ret(RETCODE_OUT_OF_RESOURCES)
+        for j, x in enumerate(items):
+            out[j] = x
+        length.value = len(items)
+    return get
+
+
+def _array_setter(func_name, kind, ctype):
+    @_retcode
+    def set(data, name, member_id, length, array):
+        value = _lookup(data).value
+        i, tc = value.index(_name(name), member_id)
+        if tc.kind not in (_K.SEQUENCE, _K.ARRAY) or tc.content.kind != kind:
+            raise _Ret(RETCODE_BAD_PARAMETER)
+        if tc.kind == _K.ARRAY and length != tc.length or tc.length and length > tc.length:
+            raise _Ret(RETCODE_BAD_PARAMETER)
+        array = ctypes.cast(array, ctypes.POINTER(ctype))
+        value.items[i].items[:] = [array[j] for j in range(length)]
+    return set
+
+
+for _func_name, _kind in _accessor_kinds.items():
+    _api['DynamicData_get_' + _func_name] = _getter(_func_name, _kind)
+    _api['DynamicData_set_' + _func_name] = _setter(_func_name, _kind, _primitive_ctypes[_kind])
+    _api['DynamicData_get_%s_array' % _func_name] = _array_getter(_func_name, _kind)
+    _api['DynamicData_set_%s_array' % _func_name] = _array_setter(_func_name, _kind, _primitive_ctypes[_kind])
+
+@_export('DynamicData_get_string')
+@_retcode
+def _dynamicdata_get_string(data, out, size, name, member_id):
+    value = _lookup(data).value
+    i, tc = value.peek(_name(name), member_id)
+    _check_kind(tc, _K.STRING, True)
+    _deref(out).value = value.items[i]
+
+@_export('DynamicData_get_wstring')
+@_retcode
+def _dynamicdata_get_wstring(data, out, size, name, member_id):
+    value = _lookup(data).value
+    i, tc = value.peek(_name(name), member_id)
+    _check_kind(tc, _K.WSTRING, True)
+    _deref(out).value = value.items[i]
+
+@_export('DynamicData_set_string')
+@_retcode
+def _dynamicdata_set_string(data, name, member_id, x):
+    value = _lookup(data).value
+    i, tc = value.index(_name(name), member_id)
+    _check_kind(tc, _K.STRING, False)
+    if not isinstance(x, bytes):
+        raise _Ret(RETCODE_BAD_PARAMETER)
+    if tc.length and len(x) > tc.length:
+        raise _Ret(RETCODE_BAD_PARAMETER)
+    value.items[i] = x
+
+@_export('DynamicData_set_wstring')
+@_retcode
+def _dynamicdata_set_wstring(data, name, member_id, x):
+    value = _lookup(data).value
+    i, tc = value.index(_name(name), member_id)
+    _check_kind(tc, _K.WSTRING, False)
+    value.items[i] = x
+
+# DynamicDataWriter
+
+@_export('DynamicDataWriter_narrow')
+def _writer_narrow(writer):
+    return _lookup(writer)
+
+
+def _write_handle(writer, value, handle):
+    key = handle and _handle_bytes(handle)
+    if key is not None:
+        if key not in writer.instances:
+            raise _Ret(RETCODE_BAD_PARAMETER)
+        if writer.instances[key] != value.key():
+            raise _Ret(RETCODE_PRECONDITION_NOT_MET)
+        return key
+    return bytes(bytearray(b & 0xff for b in _instance_hash(value.tc, value.key())))
+
+
+def _handle_struct(restype, key_bytes):
+    handle = restype()
+    handle.keyHash_value = (ctypes.c_byte * 16)(*[b - 256 if b > 127 else b for b in bytearray(key_bytes)])
+    handle.keyHash_length = 16
+    handle.isValid = 1
+    return handle
+
+@_export('DynamicDataWriter_write')
+@_retcode
+def _writer_write(writer, data, handle):
+    writer, data = _lookup(writer), _lookup(data)
+    with _lock:
+        key = _write_handle(writer, data.value, handle)
+        writer.instances.setdefault(key, data.value.key())
+        writer.deliver(data.value, key, ALIVE, True)
+
+@_export('DynamicDataWriter_dispose')
+@_retcode
+def _writer_dispose(writer, data, handle):
+    writer, data = _lookup(writer), _lookup(data)
+    with _lock:
+        key = _write_handle(writer, data.value, handle)
+        writer.deliver(data.value, key, NOT_ALIVE_DISPOSED, False)
+
+@_export('DynamicDataWriter_register_instance')
+@_typed
+def _writer_register_instance(restype, writer, data):
+    writer, data = _lookup(writer), _lookup(data)
+    with _lock:
+        key = _write_handle(writer, data.value, None)
+        writer.instances[key] = data.value.key()
+    return _handle_struct(restype, key)
+
+
+def _unregister(writer, key, handle):
+    value = None
+    for reader in writer.matched_readers():
+        instance = reader.instances.get(handle)
+        if instance is None or writer not in instance['writers']:
+            continue
+        instance['writers'].discard(writer)
+        if not instance['writers'] and instance['state'] == ALIVE:
+            reader.receive(writer, instance['key'], handle, NOT_ALIVE_NO_WRITERS, False, time.time())
+    writer.instances.pop(handle, None)
+
+@_export('DynamicDataWriter_unregister_instance')
+@_retcode
+def _writer_unregister_instance(writer, data, handle):
+    writer, data = _lookup(writer), _lookup(data)
+    with _lock:
+        key = _write_handle(writer, data.value, handle)
+        if key not in writer.instances:
+            raise _Ret(RETCODE_BAD_PARAMETER)
+        _unregister(writer, writer.instances[key], key)
+
+# DynamicDataReader
+
+@_export('DynamicDataReader_narrow')
+def _reader_narrow(reader):
+    return _lookup(reader)
+
+
+def _select(reader, max_samples, sample_states, take):
+    if isinstance(max_samples, ctypes._SimpleCData):
+        max_samples = max_samples.value
+    if isinstance(sample_states, ctypes._SimpleCData):
+        sample_states = sample_states.value
+    selected = []
+    remaining = collections.deque()
+    for sample in reader.samples:
+        state = SAMPLE_READ if sample['read'] else SAMPLE_NOT_READ
+        if (max_samples < 0 or len(selected) < max_samples) and state & sample_states:
+            selected.append(sample)
+            if not take:
+                remaining.append(sample)
+        else:
+            remaining.append(sample)
+    reader.samples = remaining
+    if not any(not s['read'] for s in remaining):
+        reader.status_changes &= ~DATA_AVAILABLE_STATUS
+    return selected
+
+
+def _loan(reader, data_seq, info_seq, max_samples, sample_states, take):
+    reader = _lookup(reader)
+    with _lock:
+        selected = _select(reader, max_samples, sample_states, take)
+        if not selected:
+            raise _Ret(RETCODE_NO_DATA)
+        loaned = []
+        for sample in selected:
+            # like RTI, the instance state is that of the instance when the
+            # sample is taken, not when it was received
+            info = dict(sample, instance_state=reader.instances[sample['handle']]['state'])
+            loaned.append((_DynamicData(sample['value'].tc, sample['value']), info))
+            sample['read'] = True
+        _loans[_address(data_seq)] = loaned
+        _loans[_address(info_seq)] = loaned
+        _set_length(data_seq, loaned)
+        _set_length(info_seq, loaned)
+
+@_export('DynamicDataReader_take')
+@_retcode
+def _reader_take(reader, data_seq, info_seq, max_samples, sample_states, view_states, instance_states):
+    _loan(reader, data_seq, info_seq, max_samples, sample_states, True)
+
+@_export('DynamicDataReader_read')
+@_retcode
+def _reader_read(reader, data_seq, info_seq, max_samples, sample_states, view_states, instance_states):
+    _loan(reader, data_seq, info_seq, max_samples, sample_states, False)
+
+@_export('DynamicDataReader_return_loan')
+@_retcode
+def _reader_return_loan(reader, data_seq, info_seq):
+    loaned = _loans.pop(_address(data_seq), [])
+    _loans.pop(_address(info_seq), None)
+    for data, info in loaned:
+        data.release()
+    _set_length(data_seq, [])
+    _set_length(info_seq, [])
+
+@_export('DynamicDataReader_get_key_value')
+@_retcode
+def _reader_get_key_value(reader, data, handle):
+    reader, data = _lookup(reader), _lookup(data)
+    instance = reader.instances.get(_handle_bytes(handle))
+    if instance is None:
+        raise _Ret(RETCODE_BAD_PARAMETER)
+    key = instance['key']
+    for i, (name, tc, is_key) in enumerate(key.tc.members):
+        if is_key:
+            x = key.items[i]
+            data.value.items[i] = x.copy() if isinstance(x, _Value) else x
+
+# TypeCode
+
+@_export('TypeCode_name')
+@_exc
+def _typecode_name(tc):
+    tc = _tc(tc)
+    if tc.kind not in (_K.STRUCT, _K.ENUM):
+        raise _Ret(EX_BAD_KIND)
+    return tc.name
+
+@_export('TypeCode_kind')
+@_exc
+def _typecode_kind(tc):
+    return _tc(tc).kind
+
+@_export('TypeCode_member_count')
+@_exc
+def _typecode_member_count(tc):
+    return len(_tc(tc).members)
+
+
+def _member(tc, i):
+    if isinstance(i, ctypes._SimpleCData):
+        i = i.value
+    tc = _tc(tc)
+    if tc.kind not in (_K.STRUCT, _K.ENUM):
+        raise _Ret(EX_BAD_KIND)
+    if not 0 <= i < len(tc.members):
+        raise _Ret(EX_BOUNDS)
+    return tc.members[i]
+
+@_export('TypeCode_member_name')
+@_exc
+def _typecode_member_name(tc, i):
+    return _member(tc, i)[0]
+
+@_export('TypeCode_member_type')
+@_exc
+def _typecode_member_type(tc, i):
+    return _TypeCodeEntity.of(_member(tc, i)[1])
+
+@_export('TypeCode_is_member_key')
+@_exc
+def _typecode_is_member_key(tc, i):
+    return _member(tc, i)[2]
+
+@_export('TypeCode_member_ordinal')
+@_exc
+def _typecode_member_ordinal(tc, i):
+    _member(tc, i)
+    return i
+
+@_export('TypeCode_find_member_by_name')
+@_exc
+def _typecode_find_member_by_name(tc, name):
+    i = _tc(tc).find(_name(name))
+    if i is None:
+        raise _Ret(EX_BAD_MEMBER_NAME)
+    return i
+
+@_export('TypeCode_content_type')
+@_exc
+def _typecode_content_type(tc):
+    tc = _tc(tc)
+    if tc.kind not in (_K.SEQUENCE, _K.ARRAY):
+        raise _Ret(EX_BAD_KIND)
+    return _TypeCodeEntity.of(tc.content)
+
+@_export('TypeCode_length')
+@_exc
+def _typecode_length(tc):
+    tc = _tc(tc)
+    if tc.kind not in (_K.SEQUENCE, _K.STRING, _K.WSTRING):
+        raise _Ret(EX_BAD_KIND)
+    return tc.length
+
+@_export('TypeCode_element_count')
+@_exc
+def _typecode_element_count(tc):
+    tc = _tc(tc)
+    if tc.kind != _K.ARRAY:
+        raise _Ret(EX_BAD_KIND)
+    return tc.length
+
+# Sequences
+
+def _seq_api(prefix, make):
+    def finalize(seq):
+        _loans.pop(_address(seq), None)
+        _string_seqs.pop(_address(seq), None)
+        return True
+    def get_length(seq):
+        return _deref(seq)._length
+    @_typed
+    def get_reference(restype, seq, i):
+        if isinstance(i, ctypes._SimpleCData):
+            i = i.value
+        return make(restype, _loans[_address(seq)], i)
+    _api[prefix + '_initialize'] = lambda seq: True
+    _api[prefix + '_finalize'] = finalize
+    _api[prefix + '_get_length'] = get_length
+    _api[prefix + '_get_reference'] = get_reference
+    _api[prefix + '_get'] = get_reference
+
+
+def _data_reference(restype, loaned, i):
+    return loaned[i][0]
+
+
+def _info_reference(restype, loaned, i):
+    info = loaned[i][1]
+    struct = info.get('struct')
+    if struct is None:
+        struct = info['struct'] = restype._type_()
+        struct.sample_state = SAMPLE_READ if info['read'] else SAMPLE_NOT_READ
+        struct.view_state = info['view_state']
+        struct.instance_state = info['instance_state']
+        struct.source_timestamp.sec, struct.source_timestamp.nanosec = _now_parts(info['source_timestamp'])
+        struct.reception_timestamp.sec, struct.reception_timestamp.nanosec = _now_parts(info['reception_timestamp'])
+        key = info['handle']
+        struct.instance_handle.keyHash_value = (ctypes.c_byte * 16)(*[b - 256 if b > 127 else b for b in bytearray(key)])
+        struct.instance_handle.keyHash_length = 16
+        struct.instance_handle.isValid = 1
+        struct.valid_data = info['valid_data']
+    return ctypes.pointer(struct)
+
+
+def _publication_reference(restype, loaned, i):
+    sample = loaned[i]
+    struct = sample.get('struct')
+    if struct is None:
+        struct = sample['struct'] = restype._type_()
+        struct.topic_name = sample['topic_name']
+        struct.type_name = sample['type_name']
+    return ctypes.pointer(struct)
+
+
+def _condition_reference(restype, loaned, i):
+    return loaned[i]
+
+
+def _handle_reference(restype, loaned, i):
+    return ctypes.pointer(loaned[i])
+
+_seq_api('DynamicDataSeq', _data_reference)
+_seq_api('SampleInfoSeq', _info_reference)
+_seq_api('PublicationBuiltinTopicDataSeq', _publication_reference)
+_seq_api('ConditionSeq', _condition_reference)
+_seq_api('InstanceHandleSeq', _handle_reference)
+
+@_export('StringSeq_initialize')
+def _stringseq_initialize(seq):
+    _string_seqs[_address(seq)] = []
+    return True
+
+@_export('StringSeq_finalize')
+def _stringseq_finalize(seq):
+    _string_seqs.pop(_address(seq), None)
+    return True
+
+@_export('StringSeq_from_array')
+def _stringseq_from_array(seq, array, length):
+    if isinstance(length, ctypes._SimpleCData):
+        length = length.value
+    if _address(seq) not in _string_seqs:
+        # the real function writes through the buffer of the sequence
+        raise RuntimeError('StringSeq_from_array on a sequence that was not initialized')
+    items = [array[i] for i in range(length)]
+    _string_seqs[_address(seq)] = items
+    _set_length(seq, items)
+    return True
+
+@_export('StringSeq_get_length')
+def _stringseq_get_length(seq):
+    return len(_string_seq(seq))
+
+@_export('String_free')
+def _string_free(s):
+    pass
+
+@_export('Wstring_free')
+def _wstring_free(s):
+    pass
+
+# Builtin topics
+
+@_export('PublicationBuiltinTopicDataDataReader_narrow')
+def _publication_reader_narrow(reader):
+    return _lookup(reader)
+
+@_export('PublicationBuiltinTopicDataDataReader_take')
+@_retcode
+def _publication_reader_take(reader, data_seq, info_seq, max_samples, sample_states, view_states, instance_states):
+    reader = _lookup(reader)
+    with _lock:
+        if not reader.samples:
+            raise _Ret(RETCODE_NO_DATA)
+        loaned = list(reader.samples)
+        reader.samples.clear()
+        reader.status_changes &= ~DATA_AVAILABLE_STATUS
+    _loans[_address(data_seq)] = loaned
+    _loans[_address(info_seq)] = [{'read': False, 'view_state': VIEW_NEW, 'instance_state': ALIVE,
+                                   'source_timestamp': 0, 'reception_timestamp': 0,
+                                   'handle': b'\0' * 16, 'valid_data': True} for _ in loaned]
+    _set_length(data_seq, loaned)
+    _set_length(info_seq, loaned)
+
+@_export('PublicationBuiltinTopicDataDataReader_return_loan')
+@_retcode
+def _publication_reader_return_loan(reader, data_seq, info_seq):
+    _loans.pop(_address(data_seq), None)
+    _loans.pop(_address(info_seq), None)
+    _set_length(data_seq, [])
+    _set_length(info_seq, [])
+
+# Conditions and WaitSets
+
+@_export('Entity_get_statuscondition')
+def _entity_get_statuscondition(entity):
+    entity = _lookup(entity)
+    with _lock:
+        if entity.condition is None:
+            entity.condition = _StatusCondition(entity)
+        return entity.condition
+
+@_export('StatusCondition_set_enabled_statuses')
+@_retcode
+def _statuscondition_set_enabled_statuses(condition, mask):
+    with _lock:
+        _lookup(condition).enabled = mask
+        _changed.notify_all()
+
+@_export('DataReader_create_readcondition')
+def _reader_create_readcondition(reader, sample_states, view_states, instance_states):
+    if isinstance(sample_states, ctypes._SimpleCData):
+        sample_states = sample_states.value
+    reader = _lookup(reader)
+    with _lock:
+        condition = _ReadCondition(reader, sample_states)
+        reader.read_conditions.append(condition)
+        return condition
+
+@_export('DataReader_delete_readcondition')
+@_retcode
+def _reader_delete_readcondition(reader, condition):
+    reader, condition = _lookup(reader), _lookup(condition)
+    with _lock:
+        if condition not in reader.read_conditions:
+            raise _Ret(RETCODE_PRECONDITION_NOT_MET)
+        reader.read_conditions.remove(condition)
+    condition.release()
+
+@_export('Condition_get_trigger_value')
+def _condition_get_trigger_value(condition):
+    with _lock:
+        return _lookup(condition).triggered()
+
+@_export('GuardCondition_new')
+def _guardcondition_new():
+    return _GuardCondition()
+
+@_export('GuardCondition_delete')
+@_retcode
+def _guardcondition_delete(condition):
+    _lookup(condition).release()
+
+@_export('GuardCondition_set_trigger_value')
+@_retcode
+def _guardcondition_set_trigger_value(condition, value):
+    with _lock:
+        _lookup(condition).value = bool(value)
+        _changed.notify_all()
+
+@_export('WaitSet_new')
+def _waitset_new():
+    return _WaitSet()
+
+@_export('WaitSet_delete')
+def _waitset_delete(waitset):
+    _lookup(waitset).release()
+
+@_export('WaitSet_attach_condition')
+@_retcode
+def _waitset_attach_condition(waitset, condition):
+    with _lock:
+        waitset, condition = _lookup(waitset), _lookup(condition)
+        if condition not in waitset.conditions:
+            waitset.conditions.append(condition)
+        _changed.notify_all()
+
+@_export('WaitSet_detach_condition')
+@_retcode
+def _waitset_detach_condition(waitset, condition):
+    with _lock:
+        waitset, condition = _lookup(waitset), _lookup(condition)
+        if condition not in waitset.conditions:
+            raise _Ret(RETCODE_PRECONDITION_NOT_MET)
+        waitset.conditions.remove(condition)
+
+@_export('WaitSet_wait')
+@_retcode
+def _waitset_wait(waitset, conditions, duration):
+    waitset = _lookup(waitset)
+    duration = _deref(duration)
+    if duration.sec == DURATION_INFINITE and duration.nanosec == DURATION_INFINITE:
+        deadline = None
+    else:
+        deadline = time.time() + duration.sec + duration.nanosec * 1e-9
+    with _lock:
+        while True:
+            active = [c for c in waitset.conditions if c.triggered()]
+            if active:
+                _loans[_address(conditions)] = active
+                _set_length(conditions, active)
+                return
+            if deadline is None:
+                _changed.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    _set_length(conditions, [])
+                    raise _Ret(RETCODE_TIMEOUT)
+                _changed.wait(remaining)
+
+# Test hooks
+
+def _readers(topic_name):
+    name = _name(topic_name)
+    return [r for d in _domains.values() for r in d.readers if r.topic.topic.name == name]
+
+
+def raise_status(topic_name, status, reason=0):
+    """
+    Simulates the middleware raising `status' (e.g. SAMPLE_LOST_STATUS) on
+    every reader of `topic_name'.
+    """
+    with _lock:
+        for reader in _readers(topic_name):
+            reader.raise_status(status, reason)
+
+
+def set_reader_limit(topic_name, max_samples):
+    """
+    Limits the reader caches of `topic_name' to `max_samples' samples;
+    further samples are rejected until the readers take.
+    """
+    with _lock:
+        for reader in _readers(topic_name):
+            reader.max_samples = max_samples
@@ -5,5 +5,5 @@ setup(name='dds',
       author='Stephen Harding',
       author_email='stharding@gmail.com',
       url='https://github.com/stharding/pyDDS',
-      py_modules=['dds'],
+      py_modules=['dds', 'dds_fake'],
 )
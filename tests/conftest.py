@@ -0,0 +1,86 @@
+"""
+The tests run against the pure-Python fake backend, which must be selected
+before dds is imported. Every test gets a `DDS' instance on a domain of its
+own, so samples published by one test never reach the readers of another.
+"""
+
+import itertools
+import os
+import sys
+import time
+
+import pytest
+
+os.environ['PYDDS_BACKEND'] = 'fake'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import dds_fake as fake
+
+Color = fake.enum('test::Color', ['RED', 'GREEN', 'BLUE'])
+Point = fake.struct('test::Point', [('x', fake.DOUBLE), ('y', fake.DOUBLE)])
+
+fake.register_library('test_types', [
+    fake.struct('test::Sample', [
+        ('id', fake.LONG, fake.KEY),
+        ('name', fake.string()),
+        ('color', Color),
+        ('pos', Point),
+        ('path', fake.sequence(Point, 10)),
+        ('values', fake.sequence(fake.FLOAT, 4096)),
+        ('matrix', fake.array(fake.DOUBLE, 4)),
+        ('blob', fake.sequence(fake.OCTET, 1 << 20)),
+        ('flag', fake.BOOLEAN),
+        ('colors', fake.sequence(Color, 8)),
+        ('u8', fake.OCTET),
+    ]),
+    fake.struct('test::Plain', [('value', fake.DOUBLE)]),
+    fake.struct('test::Arrays', [
+        ('flags', fake.sequence(fake.BOOLEAN, 8)),
+        ('counts', fake.sequence(fake.LONG, 8)),
+        ('blob', fake.sequence(fake.OCTET, 64)),
+    ]),
+    # member names that are Python keywords
+    fake.struct('test::Keywords', [
+        ('id', fake.LONG, fake.KEY),
+        ('def', fake.LONG),
+        ('class', fake.LONG),
+        ('inner', fake.struct('test::Inner', [('lambda', fake.LONG)])),
+    ]),
+])
+
+import dds
+
+_domain_ids = itertools.count(1)
+
+
+@pytest.fixture
+def make_participant():
+    def make(**kwargs):
+        return dds.DDS('test_types', domain_id=next(_domain_ids), **kwargs)
+    return make
+
+
+@pytest.fixture
+def participant(make_participant):
+    return make_participant()
+
+
+@pytest.fixture
+def sample_topic(participant):
+    return participant.get_topic('test.Sample')
+
+
+@pytest.fixture
+def plain_topic(participant):
+    return participant.get_topic('test.Plain')
+
+
+def wait_until(predicate, timeout=2.0):
+    # samples reach listeners on the fake's receive thread, and most dispatch
+    # modes hand them to other threads again
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
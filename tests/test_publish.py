@@ -0,0 +1,300 @@
+import os
+import threading
+import time
+
+import pytest
+
+import dds
+import dds_fake as fake
+
+from conftest import wait_until
+
+
+def test_sample_pool_reuses_samples(make_participant):
+    topic = make_participant(sample_pool_size=2).get_topic('test.Sample')
+    got = []
+    topic.subscribe(got.append, dispatch='inline')
+    topic.publish({'id': 1, 'path': [{'x': 1.0}, {'x': 2.0}], 'name': 'a'})
+    topic.publish({'id': 2})
+    assert wait_until(lambda: len(got) == 2)
+    # a reused sample does not keep the members of the previous one
+    assert got[1][b'path'] == []
+    assert got[1][b'name'] == b''
+    assert topic.sample_pool_stats()['hits'] >= 1
+
+    threads = [threading.Thread(target=lambda: [topic.publish({'id': 3}) for _ in range(50)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = topic.sample_pool_stats()
+    assert stats['size'] == 2
+    assert stats['available'] <= 2
+    assert stats['hits'] + stats['misses'] == 202
+
+
+def test_sample_pool_can_be_disabled(sample_topic):
+    sample_topic.set_sample_pool_size(0)
+    sample_topic.publish({'id': 1})
+    sample_topic.publish({'id': 2})
+    assert sample_topic.sample_pool_stats()['hits'] == 0
+
+
+def test_publish_many(sample_topic):
+    got = []
+    sample_topic.subscribe(got.append, dispatch='inline')
+
+    def samples():
+        for i in range(5):
+            yield {'id': i, 'name': 'n%d' % i} if i != 2 else {'id': i, 'color': 'NOPE'}
+
+    result = sample_topic.publish_many(samples())
+    assert result.count == 4
+    assert [index for index, error in result.errors] == [2]
+    assert isinstance(result.errors[0][1], ValueError)
+    assert wait_until(lambda: len(got) == 4)
+    assert [s[b'id'] for s in got] == [0, 1, 3, 4]
+
+
+def test_publish_many_can_stop_on_error(sample_topic):
+    result = sample_topic.publish_many([{'id': 1}, {'u8': -1}, {'id': 2}], stop_on_error=True)
+    assert result.count == 1
+    assert len(result.errors) == 1
+
+
+def test_dispose_many(sample_topic):
+    revoked = []
+    sample_topic.subscribe(lambda sample: None, instance_revoked_cb=lambda sample: revoked.append(sample[b'id']),
+                           dispatch='inline')
+    sample_topic.publish_many([{'id': i} for i in range(4)])
+    sample_topic.dispose_many([{'id': 1}, {'id': 3}])
+    assert wait_until(lambda: len(revoked) == 2)
+    assert revoked == [1, 3]
+
+
+def test_endpoints_are_created_on_first_use(sample_topic):
+    assert sample_topic._writer is None and sample_topic._reader is None
+    sample_topic.publish({'id': 1})
+    assert sample_topic._writer is not None and sample_topic._reader is None
+    sample_topic.take(timeout=0)
+    assert sample_topic._reader is not None
+
+
+def test_types_are_registered_once_per_participant(sample_topic):
+    # a filtered subscription is a topic of its own with the same type
+    sample_topic.subscribe(print, filter_expression='id > 1')
+    assert [count for support, count in sample_topic._dds._type_supports.values()] == [2]
+
+
+def test_publish_queue(sample_topic):
+    got = []
+    sample_topic.subscribe(lambda sample: got.append(sample[b'id']), dispatch='ordered')
+    sample_topic.set_publish_queue(queue_size=100)
+    for i in range(500):
+        sample_topic.publish({'id': i})
+    assert sample_topic.flush(5)
+    assert sample_topic.stats()['publish_queue_length'] == 0
+    assert wait_until(lambda: len(got) == 500)
+    assert got == list(range(500))
+    assert sample_topic.stats()['samples_published'] == 500
+
+
+def test_publish_queue_drops_when_full(sample_topic):
+    sample_topic.set_publish_queue(queue_size=10, overflow='drop_newest')
+    for i in range(1000):
+        sample_topic.publish({'id': i})
+    assert sample_topic.flush(5)
+    stats = sample_topic.stats()
+    assert stats['publish_dropped'] > 0
+    assert stats['samples_published'] + stats['publish_dropped'] == 1000
+
+
+def test_publish_queue_keeps_writer_errors(sample_topic):
+    sample_topic.set_publish_queue()
+    sample_topic.publish({'id': 'bad'})
+    sample_topic.publish({'id': 1})
+    assert sample_topic.flush(5)
+    errors = sample_topic.publish_errors()
+    assert len(errors) == 1
+    assert errors[0][0] == {'id': 'bad'}
+    assert isinstance(errors[0][1], TypeError)
+    assert sample_topic.stats()['write_errors'] == 1
+    # errors are returned once
+    assert sample_topic.publish_errors() == []
+
+
+def test_disabling_the_publish_queue_waits_for_it(sample_topic):
+    sample_topic.set_publish_queue()
+    write_many = sample_topic._write_many
+
+    def slow_write_many(*args):
+        time.sleep(0.3)
+        return write_many(*args)
+
+    sample_topic._write_many = slow_write_many
+    sample_topic.publish({'id': 1})
+    time.sleep(0.05)
+    sample_topic.publish({'id': 2})
+    with pytest.raises(dds.Error):
+        sample_topic.set_publish_queue(False, timeout=0.05)
+    # the queue is still in use after the timeout
+    assert sample_topic._publish_queue is not None
+    sample_topic.publish({'id': 3})
+
+    sample_topic.set_publish_queue(False, timeout=5)
+    assert sample_topic.stats()['samples_published'] == 3
+    assert sample_topic.flush(0)
+
+
+def test_register_instance(sample_topic):
+    events = []
+    sample_topic.subscribe(lambda sample: events.append(('data', sample[b'id'], sample[b'name'])),
+                           instance_revoked_cb=lambda sample: events.append(('disposed', sample[b'id'])),
+                           dispatch='ordered')
+    handle = sample_topic.register_instance({'id': 3})
+    assert handle.isValid
+    # handles are cached by key
+    assert sample_topic.register_instance({b'id': 3}) is handle
+
+    sample_topic.publish({'id': 3, 'name': 'x'}, handle=handle)
+    with pytest.raises(dds.Error):
+        sample_topic.publish({'id': 4}, handle=handle)
+    sample_topic.dispose({'id': 3}, handle=handle)
+    assert wait_until(lambda: len(events) == 2)
+    assert events == [('data', 3, b'x'), ('disposed', 3)]
+
+
+def test_register_instance_needs_the_keys(sample_topic):
+    with pytest.raises(ValueError):
+        sample_topic.register_instance({'name': 'x'})
+
+
+def test_unregister(sample_topic):
+    lost = []
+    sample_topic.subscribe(lambda sample: None, liveliness_lost_cb=lambda sample: lost.append(sample[b'id']),
+                           dispatch='inline')
+    handle = sample_topic.register_instance({'id': 5})
+    sample_topic.publish({'id': 5}, handle=handle)
+    sample_topic.unregister({'id': 5}, handle=handle)
+    assert wait_until(lambda: lost)
+    assert lost == [5]
+    assert (5,) not in sample_topic._instances._handles
+    assert sample_topic.stats()['samples_unregistered'] == 1
+
+
+def test_instance_cache_is_bounded(sample_topic):
+    lost = []
+    sample_topic.subscribe(lambda sample: None, liveliness_lost_cb=lambda sample: lost.append(sample[b'id']),
+                           dispatch='inline')
+    sample_topic.set_instance_cache_size(2)
+    for i in range(10):
+        sample_topic.publish({'id': i}, handle=sample_topic.register_instance({'id': i}))
+    assert len(sample_topic._instances) == 2
+    # evicted instances are unregistered
+    assert wait_until(lambda: len(lost) == 8)
+    assert lost == list(range(8))
+
+    sample_topic.set_instance_cache_size(1)
+    assert wait_until(lambda: len(lost) == 9)
+    assert lost[-1] == 8
+    assert sample_topic.stats()['samples_unregistered'] == 9
+
+
+def test_instance_cache_can_keep_evicted_instances(sample_topic):
+    sample_topic.set_instance_cache_size(2, unregister=False)
+    for i in range(10):
+        sample_topic.register_instance({'id': i})
+    assert len(sample_topic._instances) == 2
+    assert sample_topic.stats()['samples_unregistered'] == 0
+
+
+@pytest.fixture(autouse=True)
+def restore_qos_profiles(monkeypatch):
+    # QoS overrides rewrite NDDS_QOS_PROFILES for the whole process
+    if 'NDDS_QOS_PROFILES' in os.environ:
+        monkeypatch.setenv('NDDS_QOS_PROFILES', os.environ['NDDS_QOS_PROFILES'])
+    else:
+        monkeypatch.delenv('NDDS_QOS_PROFILES', raising=False)
+
+
+def _loaded_profiles():
+    return os.environ['NDDS_QOS_PROFILES']
+
+
+def test_qos_overrides(sample_topic):
+    sample_topic.set_qos(qos=dds.Qos(reliability='reliable', history_depth=5, publish_mode='asynchronous',
+                                     batch_max_samples=32, batch_flush_delay=0.01))
+    library, profile = sample_topic._endpoint_profile
+    assert library == 'pyDDS'
+    xml = _loaded_profiles()
+    assert xml.startswith('str://"<dds><qos_library name=\'pyDDS\'>')
+    assert "<qos_profile name='%s'>" % profile in xml
+    assert '<max_samples>32</max_samples>' in xml
+
+    sample_topic.publish({'id': 1})
+    sample_topic.take(timeout=0)
+    assert fake._lookup(sample_topic._writer).profile == (b'pyDDS', profile.encode())
+    assert fake._lookup(sample_topic._reader).profile == (b'pyDDS', profile.encode())
+
+    with pytest.raises(dds.Error):
+        sample_topic.set_qos(qos=dds.Qos(reliability='reliable'))
+
+
+def test_qos_overrides_keep_the_user_profiles(sample_topic, monkeypatch):
+    monkeypatch.setattr(dds, '_user_qos_profiles', 'file:///my_qos.xml')
+    sample_topic.set_qos(qos=dds.Qos(history_depth=7))
+    user, generated = _loaded_profiles().split(';', 1)
+    assert user == 'file:///my_qos.xml'
+    assert generated.startswith('str://"<dds><qos_library')
+
+
+def test_qos_overrides_are_shared(participant):
+    first = participant.get_topic('test.Sample')
+    second = participant.get_topic('test.Plain')
+    first.set_qos(qos=dds.Qos(history_depth=11))
+    second.set_qos(qos=dds.Qos(history_depth=11))
+    assert first._endpoint_profile == second._endpoint_profile
+
+
+def test_qos_profile_and_overrides(plain_topic):
+    plain_topic.set_qos('lib', 'prof', dds.Qos(keep_all=True))
+    profile = plain_topic._endpoint_profile[1]
+    assert "<qos_profile name='%s' base_name='lib::prof'>" % profile in _loaded_profiles()
+    with pytest.raises(ValueError):
+        plain_topic.set_qos('lib')
+
+
+def test_invalid_qos():
+    with pytest.raises(ValueError):
+        dds.Qos(reliability='sometimes')
+
+
+def test_participant_profile_is_only_used_by_endpoints_on_request(make_participant):
+    topic = make_participant(qos_library='L', qos_profile='P').get_topic('test.Sample')
+    topic.publish({'id': 1})
+    assert fake._lookup(topic._writer).profile is None
+
+    topic = make_participant(qos_library='L', qos_profile='P', endpoint_qos=True).get_topic('test.Sample')
+    topic.publish({'id': 1})
+    assert fake._lookup(topic._writer).profile == (b'L', b'P')
+
+
+def test_publish_queue_survives_a_writer_that_cannot_be_created(sample_topic, monkeypatch):
+    def no_writer():
+        raise dds.Error('no writer')
+
+    monkeypatch.setattr(sample_topic, '_get_writer', no_writer)
+    sample_topic.set_publish_queue()
+    sample_topic.publish({'id': 1})
+    sample_topic.publish({'id': 2})
+    assert sample_topic.flush(5)
+    errors = sample_topic.publish_errors()
+    assert [data for data, error in errors] == [{'id': 1}, {'id': 2}]
+    assert all(isinstance(error, dds.Error) for data, error in errors)
+    assert sample_topic.stats()['write_errors'] == 2
+
+    # the writer thread is still running
+    monkeypatch.undo()
+    sample_topic.publish({'id': 3})
+    assert sample_topic.flush(5)
+    assert sample_topic.stats()['samples_published'] == 1
@@ -0,0 +1,223 @@
+import asyncio
+import time
+
+import pytest
+
+import dds
+import dds_fake as fake
+
+from conftest import wait_until
+
+
+def test_counters_are_always_kept(sample_topic):
+    got = []
+    sample_topic.subscribe(got.append, dispatch='inline')
+    for i in range(10):
+        sample_topic.publish({'id': i})
+    sample_topic.publish_many([{'id': i} for i in range(5)])
+    sample_topic.publish_many([{'id': 1}, {'id': 'bad'}])
+    sample_topic.dispose({'id': 3})
+    assert wait_until(lambda: len(got) == 16)
+    fake.drain()
+
+    stats = sample_topic.stats()
+    assert stats['samples_published'] == 16
+    assert stats['write_errors'] == 1
+    assert stats['samples_disposed'] == 1
+    assert stats['callbacks'] == 16
+    assert stats['samples_taken'] >= 16
+    assert stats['takes'] > 0
+    # histograms are opt-in
+    assert stats['encode_time']['count'] == 0
+    assert stats['decode_time']['count'] == 0
+    assert stats['callback_time']['count'] == 0
+
+
+def test_histograms_are_allocated_when_enabled(sample_topic, monkeypatch):
+    reads = []
+    sample_topic.subscribe(lambda sample: None, dispatch='ordered')
+    dispatcher = type(sample_topic._dispatcher)
+    depth = dispatcher.queue_depth
+    monkeypatch.setattr(dispatcher, 'queue_depth', property(lambda self: reads.append(1) or depth.fget(self)))
+    sample_topic.publish({'id': 1})
+    assert wait_until(lambda: sample_topic._stats.samples_taken == 1)
+    # neither the histograms nor the queue depth are needed yet
+    assert not hasattr(sample_topic._stats, 'decode_time')
+    assert reads == []
+    assert sample_topic.stats()['queue_depth']['count'] == 0
+    assert reads == [1]
+
+    sample_topic.enable_stats()
+    sample_topic.publish({'id': 2})
+    assert wait_until(lambda: sample_topic.stats()['queue_depth']['count'] == 1)
+
+
+def test_callback_errors_are_counted(sample_topic):
+    sample_topic.subscribe(lambda sample: 1 / 0, dispatch='inline')
+    sample_topic.publish({'id': 1})
+    assert wait_until(lambda: sample_topic.stats()['callback_errors'] == 1)
+
+
+def test_enable_stats_records_histograms(participant):
+    topic = participant.get_topic('test.Sample')
+    got = []
+    topic.subscribe(got.append, dispatch='ordered')
+    participant.enable_stats()
+    for i in range(10):
+        topic.publish({'id': i})
+    assert wait_until(lambda: len(got) == 10)
+    fake.drain()
+
+    stats = topic.stats()
+    assert stats['encode_time']['count'] == 10
+    assert stats['decode_time']['count'] == 10
+    assert wait_until(lambda: topic.stats()['callback_time']['count'] == 10)
+    assert stats['samples_per_take']['count'] > 0
+    # topics created later record them as well
+    assert participant.get_topic('test.Plain')._stats.detailed
+
+    participant.enable_stats(False)
+    topic.publish({'id': 11})
+    assert topic.stats()['encode_time']['count'] == 10
+
+
+def test_participant_stats_and_reset(participant):
+    topic = participant.get_topic('test.Sample')
+    topic.subscribe(lambda sample: None, dispatch='inline')
+    topic.publish({'id': 1})
+    assert wait_until(lambda: topic.stats()['callbacks'] == 1)
+
+    stats = participant.stats()
+    assert stats['totals']['samples_published'] == 1
+    assert 'Sample' in stats['topics']
+
+    participant.reset_stats()
+    assert topic.stats()['samples_published'] == 0
+    assert topic.stats()['callbacks'] == 0
+
+
+def test_histogram_percentiles():
+    histogram = dds._Histogram(128)
+    values = [i * 1e-6 for i in range(1, 1001)]
+    for value in values:
+        histogram.record(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == 1000
+    assert snapshot['min'] == values[0]
+    assert snapshot['max'] == values[-1]
+    for name, exact in (('p50', values[499]), ('p90', values[899]), ('p99', values[989])):
+        assert exact <= snapshot[name] <= exact * (1 + 1 / 128.)
+
+
+def test_latency_tracking(sample_topic):
+    sample_topic.subscribe(lambda sample: None, dispatch='ordered')
+    sample_topic.track_latency()
+    for i in range(20):
+        sample_topic.publish({'id': i})
+    assert wait_until(lambda: sample_topic.latency_stats()['callback']['count'] == 20)
+    sample_topic.reset_stats()
+    assert sample_topic.latency_stats()['callback']['count'] == 0
+
+
+def test_status_counters(sample_topic):
+    events = []
+    sample_topic.watch_status('sample_rejected', events.append)
+    sample_topic.watch_status('sample_lost')
+    fake.set_reader_limit('Sample', 2)
+    try:
+        for i in range(5):
+            sample_topic.publish({'id': i})
+        fake.raise_status('Sample', fake.SAMPLE_LOST_STATUS, 1)
+        assert wait_until(lambda: events)
+    finally:
+        fake.set_reader_limit('Sample', None)
+    fake.drain()
+    stats = sample_topic.stats()
+    assert stats['samples_rejected'] == 3
+    assert stats['samples_lost'] == 1
+
+
+def test_cache_keeps_the_newest_sample_per_instance(sample_topic):
+    sample_topic.enable_cache()
+    for i in range(5):
+        sample_topic.publish({'id': i, 'name': 'n%d' % i})
+    sample_topic.publish({'id': 2, 'name': 'newer'})
+    assert wait_until(lambda: len(sample_topic.snapshot()) == 5)
+    fake.drain()
+
+    assert sample_topic.latest(2)[b'name'] == b'newer'
+    assert sample_topic.latest({'id': 2})[b'name'] == b'newer'
+    assert sample_topic.latest((4,))[b'name'] == b'n4'
+    assert sample_topic.latest(9) is None
+    assert sorted(sample_topic.snapshot()) == [(i,) for i in range(5)]
+    assert sample_topic.stats()['cache_size'] == 5
+
+
+def test_cache_forgets_disposed_and_unregistered_instances(sample_topic):
+    sample_topic.enable_cache()
+    for i in range(4):
+        sample_topic.publish({'id': i})
+    assert wait_until(lambda: len(sample_topic.snapshot()) == 4)
+    sample_topic.dispose({'id': 1})
+    sample_topic.unregister({'id': 3})
+    assert wait_until(lambda: len(sample_topic.snapshot()) == 2)
+    assert sorted(sample_topic.snapshot()) == [(0,), (2,)]
+
+
+def test_cache_size_limit(sample_topic):
+    sample_topic.enable_cache(max_size=2)
+    for i in range(5):
+        sample_topic.publish({'id': i})
+    assert wait_until(lambda: sample_topic.latest(4) is not None)
+    assert sorted(sample_topic.snapshot()) == [(3,), (4,)]
+
+
+def test_cache_ttl(sample_topic):
+    sample_topic.enable_cache(ttl=0.5)
+    sample_topic.publish({'id': 1})
+    time.sleep(0.3)
+    sample_topic.publish({'id': 2})
+    assert wait_until(lambda: sample_topic.latest(2) is not None)
+    time.sleep(0.3)
+    assert sorted(sample_topic.snapshot()) == [(2,)]
+    time.sleep(0.3)
+    assert sample_topic.snapshot() == {}
+
+
+def test_cache_uses_the_subscription_format(sample_topic):
+    sample_topic.enable_cache()
+    sample_topic.subscribe(lambda sample: None, sample_format='record', dispatch='inline')
+    sample_topic.publish({'id': 7, 'name': 'r'})
+    assert wait_until(lambda: sample_topic.latest(7) is not None)
+    assert sample_topic.latest(7).name == b'r'
+
+
+def test_disabled_cache(sample_topic):
+    with pytest.raises(dds.Error):
+        sample_topic.latest(1)
+
+
+def test_cache_cannot_be_combined_with_take(sample_topic, plain_topic):
+    sample_topic.enable_cache()
+    with pytest.raises(dds.Error):
+        sample_topic.take(timeout=0)
+    with pytest.raises(dds.Error):
+        sample_topic.read(timeout=0)
+
+    plain_topic.take(timeout=0)
+    with pytest.raises(dds.Error):
+        plain_topic.enable_cache()
+
+
+def test_cache_cannot_be_combined_with_streams(sample_topic, plain_topic):
+    async def main():
+        sample_topic.enable_cache()
+        with pytest.raises(dds.Error, match='streams cannot be used while the cache is enabled'):
+            sample_topic.stream()
+
+        stream = plain_topic.stream()
+        stream.close()
+        with pytest.raises(dds.Error, match='the cache cannot be enabled on a topic consumed with a stream'):
+            plain_topic.enable_cache()
+
+    asyncio.run(main())
@@ -0,0 +1,369 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import dds
+import dds_fake as fake
+
+from conftest import wait_until
+
+
+@pytest.mark.parametrize('dispatch', ['thread', 'inline', 'ordered', 'pool'])
+def test_dispatch_modes_deliver_every_sample_in_order_per_instance(sample_topic, dispatch):
+    got = []
+    lock = threading.Lock()
+
+    def callback(sample):
+        with lock:
+            got.append((sample[b'id'], sample[b'u8']))
+
+    sample_topic.subscribe(callback, dispatch=dispatch)
+    for i in range(60):
+        sample_topic.publish({'id': i % 3, 'u8': i})
+    assert wait_until(lambda: len(got) == 60)
+    if dispatch != 'thread':
+        for key in range(3):
+            values = [value for k, value in got if k == key]
+            assert values == sorted(values)
+
+
+def test_ordered_dispatch_uses_one_thread(sample_topic):
+    threads = set()
+    sample_topic.subscribe(lambda sample: threads.add(threading.current_thread()), dispatch='ordered')
+    for i in range(20):
+        sample_topic.publish({'id': i})
+    fake.drain()
+    assert wait_until(lambda: sample_topic.stats()['callbacks'] == 20)
+    assert len(threads) == 1
+
+
+def test_inline_dispatch_runs_in_the_receive_thread(sample_topic):
+    names = []
+    sample_topic.subscribe(lambda sample: names.append(threading.current_thread().name), dispatch='inline')
+    sample_topic.publish({'id': 1})
+    assert wait_until(lambda: names)
+    assert names[0] != threading.current_thread().name
+
+
+def test_bounded_queue_drops_newest(sample_topic):
+    got = []
+
+    def slow(sample):
+        time.sleep(0.01)
+        got.append(sample[b'u8'])
+
+    sample_topic.subscribe(slow, dispatch='ordered', queue_size=5, overflow='drop_newest')
+    for i in range(50):
+        sample_topic.publish({'id': 1, 'u8': i})
+    assert wait_until(lambda: len(got) + sample_topic.stats()['dropped'] == 50)
+    assert got[0] == 0
+    assert got == sorted(got)
+    assert sample_topic.stats()['dropped'] > 0
+
+
+def test_conflate_keeps_the_newest_sample_per_instance(sample_topic):
+    gate = threading.Event()
+    got = []
+    revoked = []
+
+    def slow(sample):
+        gate.wait()
+        got.append((sample[b'id'], sample[b'name']))
+
+    sample_topic.subscribe(slow, instance_revoked_cb=lambda sample: revoked.append(sample[b'id']), dispatch='conflate')
+    for n in range(20):
+        for i in range(3):
+            sample_topic.publish({'id': i, 'name': 'v%d' % n})
+    sample_topic.dispose({'id': 1})
+    fake.drain()
+    gate.set()
+    assert wait_until(lambda: revoked and len(got) >= 2)
+    fake.drain()
+    time.sleep(0.05)
+
+    newest = {}
+    for key, name in got:
+        newest[key] = name
+    assert newest[0] == newest[2] == b'v19'
+    assert revoked == [1]
+    stats = sample_topic.stats()
+    assert stats['conflated'] > 0
+    assert stats['callbacks'] + stats['conflated'] == 61
+
+
+def test_conflate_keeps_the_place_of_a_busy_instance(sample_topic):
+    gate = threading.Event()
+    got = []
+
+    def slow(sample):
+        gate.wait()
+        got.append((sample[b'id'], sample[b'u8']))
+
+    sample_topic.subscribe(slow, dispatch='conflate')
+    sample_topic.publish({'id': 9, 'u8': 0})
+    # the first sample holds up the dispatcher thread
+    assert wait_until(lambda: sample_topic.stats()['takes'] and sample_topic._dispatcher.queue_depth == 0)
+    sample_topic.publish({'id': 0, 'u8': 1})
+    sample_topic.publish({'id': 1, 'u8': 2})
+    for i in range(3, 10):
+        sample_topic.publish({'id': 0, 'u8': i})
+    fake.drain()
+    gate.set()
+    assert wait_until(lambda: len(got) == 3)
+    assert got == [(9, 0), (0, 9), (1, 2)]
+
+
+def test_conflate_does_not_batch(sample_topic):
+    with pytest.raises(ValueError):
+        sample_topic.subscribe(print, batch=True, dispatch='conflate')
+
+
+def test_unknown_dispatch_mode(sample_topic):
+    with pytest.raises(ValueError):
+        sample_topic.subscribe(print, dispatch='fastest')
+
+
+def test_batches_are_limited_in_size(plain_topic):
+    batches = []
+    plain_topic.subscribe(lambda batch: batches.append([s[b'value'] for s in batch]), batch=True,
+                          max_samples=3, max_latency=0.05, dispatch='inline')
+    for i in range(7):
+        plain_topic.publish({'value': i})
+    assert wait_until(lambda: sum(map(len, batches)) == 7)
+    assert [x for batch in batches for x in batch] == list(range(7))
+    assert all(len(batch) <= 3 for batch in batches)
+
+
+def test_batches_are_delivered_in_order(sample_topic):
+    batches = []
+    sample_topic.subscribe(lambda batch: batches.append([s[b'id'] for s in batch]), batch=True,
+                           max_samples=7, max_latency=0.001, dispatch='ordered')
+    for i in range(1000):
+        sample_topic.publish({'id': i})
+    assert wait_until(lambda: sum(map(len, batches)) == 1000)
+    assert [x for batch in batches for x in batch] == list(range(1000))
+
+
+def test_samples_discarded_with_a_pending_batch_are_counted(sample_topic):
+    sample_topic.subscribe(lambda batch: None, batch=True, max_latency=10)
+    for i in range(5):
+        sample_topic.publish({'id': i})
+    fake.drain()
+    sample_topic.unsubscribe()
+    assert sample_topic.stats()['dropped'] == 5
+
+
+def test_max_samples_needs_batch(sample_topic):
+    with pytest.raises(ValueError):
+        sample_topic.subscribe(print, max_samples=3)
+
+
+def test_content_filter(sample_topic):
+    got = []
+    filtered = sample_topic.subscribe(got.append, filter_expression='id > 4', dispatch='inline')
+    for i in range(8):
+        sample_topic.publish({'id': i})
+    assert wait_until(lambda: len(got) == 3)
+    assert [s[b'id'] for s in got] == [5, 6, 7]
+    assert filtered.stats()['callbacks'] == 3
+
+
+def test_filter_parameters_can_be_changed(sample_topic):
+    got = []
+    filtered = sample_topic.subscribe(got.append, filter_expression='id = %0 OR name = %1',
+                                      filter_parameters=[3, "'bob'"], dispatch='inline')
+    reader = filtered._reader
+    for i in range(6):
+        sample_topic.publish({'id': i, 'name': 'bob' if i == 5 else 'x'})
+    assert wait_until(lambda: len(got) == 2)
+    assert [s[b'id'] for s in got] == [3, 5]
+
+    del got[:]
+    sequences = len(fake._string_seqs)
+    filtered.set_filter_parameters([4, "'nobody'"])
+    # the parameter sequence is finalized after the call
+    assert len(fake._string_seqs) == sequences
+    for i in range(6):
+        sample_topic.publish({'id': i, 'name': 'bob' if i == 5 else 'x'})
+    assert wait_until(lambda: got)
+    fake.drain()
+    assert [s[b'id'] for s in got] == [4]
+    # the reader is kept
+    assert filtered._reader is reader
+
+
+def test_filter_parameters_need_an_expression(sample_topic):
+    with pytest.raises(ValueError):
+        sample_topic.subscribe(print, filter_parameters=[1])
+
+
+def test_take_and_read(sample_topic):
+    assert sample_topic.take(timeout=0) == []
+    for i in range(5):
+        sample_topic.publish({'id': i})
+    assert [s[b'id'] for s in sample_topic.read(max_samples=2)] == [0, 1]
+    assert [s[b'id'] for s in sample_topic.read()] == [2, 3, 4]
+    assert sample_topic.read(timeout=0) == []
+    assert [s[b'id'] for s in sample_topic.take(max_samples=3)] == [0, 1, 2]
+    assert [s[b'id'] for s in sample_topic.take()] == [3, 4]
+
+
+def test_take_timeout_expires(sample_topic):
+    start = time.monotonic()
+    assert sample_topic.take(timeout=0.2) == []
+    assert time.monotonic() - start >= 0.19
+
+
+def test_take_waits_for_data(sample_topic):
+    sample_topic.take(timeout=0)
+    timer = threading.Timer(0.1, lambda: sample_topic.publish({'id': 9}))
+    timer.start()
+    try:
+        assert [s[b'id'] for s in sample_topic.take(timeout=5)] == [9]
+    finally:
+        timer.cancel()
+
+
+def test_instance_state_is_taken_per_instance(sample_topic):
+    events = []
+    sample_topic.subscribe(lambda sample: events.append(('data', sample[b'id'], sample[b'u8'])),
+                           instance_revoked_cb=lambda sample: events.append(('disposed', sample[b'id'])),
+                           dispatch='ordered')
+    reader = fake._lookup(sample_topic._reader)
+    # the samples are received before the listener takes them, so they are
+    # all taken with the instance already disposed
+    with fake._lock:
+        sample_topic.publish({'id': 1, 'u8': 1})
+        sample_topic.publish({'id': 1, 'u8': 2})
+        sample_topic.publish({'id': 2, 'u8': 3})
+        sample_topic.dispose({'id': 1})
+        assert len(reader.samples) == 4
+    assert wait_until(lambda: len(events) == 4)
+    fake.drain()
+    assert events == [('data', 1, 1), ('data', 1, 2), ('data', 2, 3), ('disposed', 1)]
+
+
+def test_take_skips_disposals(sample_topic):
+    sample_topic.take(timeout=0)
+    sample_topic.publish({'id': 1})
+    sample_topic.take()
+    sample_topic.dispose({'id': 1})
+    assert sample_topic.take(timeout=0.05) == []
+
+
+def test_stream(sample_topic):
+    async def main(topic):
+        stream = topic.stream()
+        for i in range(20):
+            await topic.publish_async({'id': i})
+        got = []
+        async for sample in stream:
+            got.append(sample[b'id'])
+            if len(got) == 20:
+                break
+        stream.close()
+        return got
+
+    assert asyncio.run(main(sample_topic)) == list(range(20))
+
+
+def test_a_full_stream_does_not_hold_up_others(sample_topic, plain_topic):
+    async def main(slow_topic, fast_topic):
+        slow = slow_topic.stream(queue_size=2, overflow='error')
+        fast = fast_topic.stream(queue_size=100)
+        for i in range(10):
+            slow_topic.publish({'id': i})
+            fast_topic.publish({'value': i})
+        got = [(await asyncio.wait_for(fast.__anext__(), 2))[b'value'] for _ in range(10)]
+        with pytest.raises(dds.Error):
+            async for sample in slow:
+                pass
+        return got
+
+    assert asyncio.run(main(sample_topic, plain_topic)) == list(range(10))
+    # the stream ended, so none of its samples were delivered
+    assert sample_topic.stats()['dropped'] == 10
+
+
+def test_stream_needs_a_running_loop(sample_topic):
+    with pytest.raises(RuntimeError):
+        sample_topic.stream()
+
+
+def test_stream_drops_oldest_by_default(plain_topic):
+    async def main(topic):
+        stream = topic.stream(queue_size=3)
+        for i in range(10):
+            topic.publish({'value': i})
+        await asyncio.sleep(0.2)
+        got = [(await stream.__anext__())[b'value'] for _ in range(3)]
+        stream.close()
+        return got
+
+    assert asyncio.run(main(plain_topic)) == [7, 8, 9]
+    assert plain_topic.stats()['dropped'] == 7
+
+
+def test_stream_cannot_be_used_with_the_cache(sample_topic):
+    async def main(topic):
+        topic.enable_cache()
+        with pytest.raises(dds.Error, match='streams cannot be used while the cache is enabled'):
+            topic.stream()
+
+    asyncio.run(main(sample_topic))
+
+
+def test_a_failing_take_ends_the_stream(plain_topic):
+    def failing(*args):
+        raise dds.Error('take failed')
+
+    async def main(topic):
+        stream = topic.stream()
+        topic._pull_available = failing
+        topic.publish({'value': 1})
+        with pytest.raises(dds.Error, match='take failed'):
+            await asyncio.wait_for(stream.__anext__(), 2)
+
+    asyncio.run(main(plain_topic))
+
+
+def test_streams_are_not_held_up_by_a_waiting_take(plain_topic):
+    async def main(topic):
+        stream = topic.stream()
+        # as while another thread waits in take
+        with topic._pull_lock:
+            topic.publish({'value': 1})
+            sample = await asyncio.wait_for(stream.__anext__(), 2)
+        stream.close()
+        return sample[b'value']
+
+    assert asyncio.run(main(plain_topic)) == 1
+
+
+def test_streams_and_take_wait_on_conditions_of_their_own(plain_topic):
+    async def main(topic):
+        stream = topic.stream()
+        topic.take(timeout=0.01)
+        reader = fake._lookup(topic._reader)
+        assert wait_until(lambda: len(reader.read_conditions) == 2)
+        assert reader.condition is None
+        stream.close()
+        assert wait_until(lambda: len(reader.read_conditions) == 1)
+
+    asyncio.run(main(plain_topic))
+
+
+def test_publish_async_with_a_handle(sample_topic):
+    async def main(topic):
+        stream = topic.stream()
+        handle = topic.register_instance({'id': 8})
+        await topic.publish_async({'id': 8, 'name': 'h'}, handle)
+        with pytest.raises(dds.Error):
+            await topic.publish_async({'id': 9}, handle=handle)
+        sample = await asyncio.wait_for(stream.__anext__(), 2)
+        stream.close()
+        return sample[b'name']
+
+    assert asyncio.run(main(sample_topic)) == b'h'
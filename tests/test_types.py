@@ -0,0 +1,249 @@
+import array
+import threading
+
+import pytest
+
+import dds
+import dds_fake as fake
+
+from conftest import wait_until
+
+
+FULL = {
+    'id': 3, 'name': 'abc', 'color': 'GREEN', 'pos': {'x': 1.0, 'y': 2.0},
+    'path': [{'x': 1.0, 'y': 1.0}, {'x': 2.0, 'y': 0.5}], 'values': [1.0, 2.5],
+    'matrix': [1.0, 2.0, 3.0, 4.0], 'blob': [1, 2, 255], 'flag': True,
+    'colors': ['BLUE', 'RED'], 'u8': 7,
+}
+
+
+def receive(topic, sample_format='dict'):
+    got = []
+    topic.subscribe(got.append, dispatch='inline', sample_format=sample_format)
+    return got
+
+
+def test_dict_round_trip(sample_topic):
+    got = receive(sample_topic)
+    sample_topic.publish(FULL)
+    assert wait_until(lambda: got)
+    sample = got[0]
+    assert sample[b'id'] == 3
+    assert sample[b'name'] == b'abc'
+    assert sample[b'color'] == b'GREEN'
+    assert sample[b'pos'] == {b'x': 1.0, b'y': 2.0}
+    assert sample[b'path'] == [{b'x': 1.0, b'y': 1.0}, {b'x': 2.0, b'y': 0.5}]
+    assert sample[b'values'] == [1.0, 2.5]
+    assert sample[b'matrix'] == [1.0, 2.0, 3.0, 4.0]
+    assert list(sample[b'blob']) == [1, 2, 255]
+    assert sample[b'flag'] is True
+    assert sample[b'colors'] == [b'BLUE', b'RED']
+
+    # a received sample can be published again as it is
+    sample_topic.publish(sample)
+    assert wait_until(lambda: len(got) == 2)
+    assert got[1] == got[0]
+
+
+def test_sparse_data_gets_defaults(sample_topic):
+    got = receive(sample_topic)
+    sample_topic.publish({'id': 4, 'pos': {'y': 3.0}})
+    assert wait_until(lambda: got)
+    assert got[0][b'pos'] == {b'x': 0.0, b'y': 3.0}
+    assert got[0][b'name'] == b''
+    assert got[0][b'path'] == []
+
+
+@pytest.mark.parametrize('bad', [{'u8': 300}, {'color': 'PURPLE'}])
+def test_invalid_values_are_rejected(sample_topic, bad):
+    with pytest.raises(ValueError):
+        sample_topic.publish(dict(FULL, **bad))
+
+
+def test_arrays_must_have_their_length(sample_topic):
+    with pytest.raises(ValueError, match="'matrix' is an array of 4 elements, got 2 values"):
+        sample_topic.publish({'id': 1, 'matrix': [1.0, 2.0]})
+    with pytest.raises(ValueError):
+        sample_topic.publish({'id': 1, 'matrix': b'\0' * 8})
+
+
+def test_plans_are_built_once_across_threads():
+    # a type no other test uses, so its plan is built here; other threads
+    # must never see it before it is complete
+    inner = fake.struct('plans::Inner', [('x', fake.DOUBLE), ('tags', fake.sequence(fake.string(), 4))])
+    fake.register_library('plan_types', [
+        fake.struct('plans::Outer', [('a', inner), ('b', fake.sequence(inner, 4)), ('c', fake.array(inner, 2))]),
+    ])
+    plans = []
+
+    def build():
+        topic = dds.DDS('plan_types').get_topic('plans.Outer')
+        plans.append(topic._plan)
+        assert topic._plan.decode(topic._pool.template)[b'c'] == [{b'x': 0.0, b'tags': []}] * 2
+
+    threads = [threading.Thread(target=build) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(plans) == 8
+    assert all(plan is plans[0] for plan in plans)
+
+
+def test_record_format(sample_topic):
+    got = receive(sample_topic, 'record')
+    sample_topic.publish(FULL)
+    assert wait_until(lambda: got)
+    record = got[0]
+    assert isinstance(record, tuple)
+    assert record.id == 3
+    assert record.pos.x == 1.0
+    assert record.path[1].y == 0.5
+    assert record._asdict()['colors'] == [b'BLUE', b'RED']
+
+    sample_topic.publish(record._replace(id=5))
+    assert wait_until(lambda: len(got) == 2)
+    assert got[1] == record._replace(id=5)
+
+
+def test_record_with_keyword_members_round_trips(participant):
+    topic = participant.get_topic('test.Keywords')
+    got = receive(topic, 'record')
+    topic.publish({'id': 1, 'def': 4, 'class': 9, 'inner': {'lambda': 3}})
+    assert wait_until(lambda: got)
+    record = got[0]
+    assert tuple(record) == (1, 4, 9, (3,))
+
+    # members whose names are keywords are matched by position
+    topic.publish(record)
+    assert wait_until(lambda: len(got) == 2)
+    assert got[1] == record
+
+
+def test_plain_tuples_are_not_records(participant):
+    topic = participant.get_topic('test.Keywords')
+    with pytest.raises(TypeError, match='is not a record of test::Keywords'):
+        topic.publish((1, 2, 3, (4,)))
+    with pytest.raises(TypeError, match='is not a record of test::Inner'):
+        topic.publish({'id': 1, 'inner': (3,)})
+
+
+def test_view_format(sample_topic):
+    seen = []
+    kept = []
+
+    def callback(view):
+        seen.append((view['id'], view[b'name'], view['pos']))
+        kept.append(view)
+
+    sample_topic.subscribe(callback, dispatch='inline', sample_format='view')
+    sample_topic.publish(FULL)
+    assert wait_until(lambda: seen)
+    assert seen[0] == (3, b'abc', {b'x': 1.0, b'y': 2.0})
+    assert len(kept[0]) == len(FULL)
+    assert 'name' in kept[0] and b'name' in kept[0] and 'nope' not in kept[0]
+    with pytest.raises(KeyError):
+        kept[0]['nope']
+    # inline views read the loaned sample and expire after the callback
+    with pytest.raises(dds.Error):
+        kept[0]['flag']
+
+
+def test_membership_does_not_decode(sample_topic):
+    got = []
+
+    def callback(view):
+        got.append(('flag' in view, b'values' in view, 'nope' in view, dict(view._values)))
+
+    sample_topic.subscribe(callback, dispatch='inline', sample_format='view')
+    sample_topic.publish(FULL)
+    assert wait_until(lambda: got)
+    assert got[0] == (True, True, False, {})
+
+
+def test_views_materialize(sample_topic):
+    got = []
+    sample_topic.subscribe(lambda view: got.append(view.materialize()), dispatch='inline', sample_format='view')
+    sample_topic.publish(FULL)
+    assert wait_until(lambda: got)
+    assert got[0]['flag'] is True
+    assert dict(got[0])[b'values'] == [1.0, 2.5]
+
+
+def test_views_passed_to_other_threads_are_usable(sample_topic):
+    got = []
+    sample_topic.subscribe(got.append, dispatch='ordered', sample_format='view')
+    sample_topic.publish(FULL)
+    assert wait_until(lambda: got)
+    fake.drain()
+    assert got[0]['name'] == b'abc'
+
+
+def test_unknown_sample_format(sample_topic):
+    with pytest.raises(ValueError):
+        sample_topic.subscribe(print, sample_format='xml')
+
+
+def test_array_format_keeps_booleans_as_bools(make_participant):
+    topic = make_participant(array_format='array').get_topic('test.Arrays')
+    got = receive(topic)
+    topic.publish({'flags': [True, False, True], 'counts': [1, 2, 3]})
+    assert wait_until(lambda: got)
+    assert got[0][b'flags'] == [True, False, True]
+    assert all(type(flag) is bool for flag in got[0][b'flags'])
+    assert got[0][b'counts'] == array.array('i', [1, 2, 3])
+
+
+def test_array_format_defaults_to_lists(sample_topic):
+    got = receive(sample_topic)
+    sample_topic.publish(FULL)
+    assert wait_until(lambda: got)
+    assert type(got[0][b'values']) is list
+    assert type(got[0][b'matrix']) is list
+    assert got[0][b'blob'] == [1, 2, 255]
+
+
+def test_array_format_array(make_participant):
+    topic = make_participant(array_format='array').get_topic('test.Sample')
+    got = receive(topic)
+    topic.publish(FULL)
+    assert wait_until(lambda: got)
+    assert got[0][b'values'] == array.array('f', [1.0, 2.5])
+    assert got[0][b'matrix'] == array.array('d', [1.0, 2.0, 3.0, 4.0])
+    assert got[0][b'blob'] == array.array('B', [1, 2, 255])
+
+
+def test_array_format_numpy(make_participant):
+    numpy = pytest.importorskip('numpy')
+    topic = make_participant(array_format='numpy').get_topic('test.Arrays')
+    got = receive(topic)
+    topic.publish({'flags': [False, True], 'counts': [4, 5, 6]})
+    assert wait_until(lambda: got)
+    assert isinstance(got[0][b'counts'], numpy.ndarray)
+    assert got[0][b'counts'].tolist() == [4, 5, 6]
+    assert got[0][b'flags'].tolist() == [False, True]
+
+    # arrays are accepted when publishing as well
+    topic.publish({'counts': numpy.arange(3, dtype=numpy.int32)})
+    assert wait_until(lambda: len(got) == 2)
+    assert got[1][b'counts'].tolist() == [0, 1, 2]
+
+
+@pytest.mark.parametrize('octet_format, octet_type', [('bytes', bytes), ('memoryview', memoryview)])
+def test_octet_format(make_participant, octet_format, octet_type):
+    topic = make_participant(octet_format=octet_format).get_topic('test.Arrays')
+    got = receive(topic)
+    topic.publish({'blob': b'\x00\x01\xff', 'counts': [1]})
+    assert wait_until(lambda: got)
+    blob = got[0][b'blob']
+    assert type(blob) is octet_type
+    assert bytes(blob) == b'\x00\x01\xff'
+    # only octets are affected
+    assert got[0][b'counts'] == [1]
+
+
+def test_invalid_array_formats(make_participant):
+    with pytest.raises(ValueError):
+        make_participant(array_format='tuple')
+    with pytest.raises(ValueError):
+        make_participant(octet_format='str')